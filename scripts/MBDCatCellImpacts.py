@@ -1,5 +1,13 @@
+import os
+import tempfile
 import numpy as np
 import pandas as pd
+import InputsPreCleaning as ipc
+import OutputDelta as od
+import RunProfiler as rprof
+import SalesIncidence as si
+import WorkbookExport as wbx
+import XFactorSolver as xfs
 import XZTGenerator as XZTGen
 
 """ 
@@ -33,8 +41,17 @@ Considered steps for presentation:
     Impacts worksheet that will be feed into the macros.
 """
 
+vue_impacts_ucols = ['MbdID', 'MbdName', 'Cell_ID', 'CategoryCode',
+                     'CategoryName', 'Baseline_Sales',
+                     'Baseline_CellImportance']
 
-class MBDCCImpcts:
+mbd_partition_cols = ['CategoryName']
+
+mbd_diag_cols = ['MbdID', 'CategoryName', 'MBD Type', 'Target',
+                 'OutOfTarget', 'Numerical Distribution']
+
+
+class MBDCCImpcts(XZTGen.StagedPipeline):
     """
     A class for analyzing and generating MBD (Micro Brand Development) and Cell Category impacts.
 
@@ -58,8 +75,34 @@ class MBDCCImpcts:
             - User-defined data.
         vue_impacts (pd.DataFrame): DataFrame with VUE impact data.
             - VUE data.
+            - Only the columns in vue_impacts_ucols are loaded.
+            - Not loaded when chunksize is set; stream_mbd_diagnostics reads it in chunks.
+        chunksize (int): Rows per VUE_Impacts chunk in streaming mode, or None.
+        max_workers (int): The number of threads the cell and MBD stages split their 
+            CategoryName partitions on.
+        profiler (RunProfiler.RunProfiler): Records the cleaning steps, the stages of this 
+            object and of xztg, and the saved outputs, if profile is True.
+        delta (bool): Whether saving an output also writes its rows that changed since the 
+            previous run (see OutputDelta.py).
+
+    The cell impacts frame is computed once and shared by the MBD aggregation and 
+    the final diagnostic join: the set_* methods that do not write outputs are 
+    memoized following stage_graph, like the XZTGen.XZTG stages.
     """
 
+    stage_graph = {'set_cell_impacts': [],
+                   'set_mbd_incidence': ['set_cell_impacts'],
+                   'set_mbd_impacts': ['set_mbd_incidence'],
+                   'set_mbd_nd': ['set_mbd_impacts'],
+                   'set_mbd_targets': ['set_mbd_nd'],
+                   'set_mbd_cell_diag': ['set_cell_impacts', 'set_mbd_targets']}
+    cc_param = XZTGen.StageInput('set_cell_impacts')
+    cw_param = XZTGen.StageInput('set_cell_impacts')
+    cell_adj_df = XZTGen.StageInput('set_cell_impacts')
+    vue_impacts = XZTGen.StageInput('set_cell_impacts')
+    mbd_numdist = XZTGen.StageInput('set_mbd_nd')
+    mbd_typetarget = XZTGen.StageInput('set_mbd_targets')
+
     def __init__(self, 
                  working_dir: str,
                  distance_param: float,
@@ -68,7 +111,13 @@ class MBDCCImpcts:
                  cell_cat_param: float, 
                  cell_weight_param: float,
                  same_dir_gap_tolerance: float,
-                 diff_dir_gap_tolerance: float):
+                 diff_dir_gap_tolerance: float,
+                 non_handler_patterns: list = None,
+                 chunksize: int = None,
+                 max_workers: int = 1,
+                 profile: bool = False,
+                 delta: bool = False,
+                 save: bool = True):
         """
         Initialize the MBDCCImpcts (Micro Brand Development Cell Category Impacts) object.
 
@@ -81,6 +130,22 @@ class MBDCCImpcts:
             cell_weight_param (float): Parameter for cell weight calculations.
             same_dir_gap_tolerance (float): Tolerance threshold for values in the same direction.
             diff_dir_gap_tolerance (float): Tolerance threshold for values in different directions.
+            non_handler_patterns (list, optional): Cell name fragments that flag a cell as 
+                non-handler. Defaults to XZTGen.default_non_handler_patterns.
+            chunksize (int, optional): If given, VUE_Impacts.csv is not loaded into memory 
+                and stream_mbd_diagnostics reads it in chunks of this many rows. Defaults 
+                to None.
+            max_workers (int, optional): The number of threads used to process the 
+                CategoryName partitions of the impacts, and the INDEX and CHANNEL partitions 
+                of the cells in XZTG. Results do not depend on it. Defaults to 1.
+            profile (bool, optional): Whether to record the time, memory and rows of every 
+                step in {working_dir}/outputs/run_report.json (see RunProfiler.py). 
+                Defaults to False.
+            delta (bool, optional): Whether to write, next to each saved output, the rows 
+                inserted, removed or changed since the previous run ({output}_delta.csv), 
+                and log them in {working_dir}/outputs/changelog.csv. Defaults to False.
+            save (bool, optional): Whether to save XZTemplate_v0.csv (and its delta) from 
+                the cell diagnostics of step 5. Defaults to True.
 
         Returns:
             None
@@ -95,17 +160,24 @@ class MBDCCImpcts:
             a. Input directory: {working_dir}/inputs
             b. Output directory: {working_dir}/outputs
         3. Store all input parameters as instance attributes
-        4. Initialize XZTGen XZTG object with the working directory
-        5. Generate cell diagnostics using:
+        4. Clean the six input files in a single pass (CleaningInputs.get_clean_frames) 
+           and initialize XZTGen XZTG object with the working directory, the non-handler 
+           patterns and its three cleaned DataFrames
+        5. Generate cell diagnostics using the parameters below, saving them only if 
+           save is True:
             - Distance parameter
             - NSPC parameter
             - X-Factor parameter
             - Same direction gap tolerance
             - Different direction gap tolerance
-        6. Load input CSV files:
+        6. Take the other cleaned DataFrames of step 4, which were loaded in the same pass:
             a. MBD_NumDist.csv: Numerical distribution data
             b. MBD_TypeTarget.csv: Type and target data
-            c. VUE_Impacts.csv: VUE impact data
+            c. VUE_Impacts.csv: VUE impact data (only the vue_impacts_ucols columns), 
+               unless chunksize is given, in which case it is only cleaned into 
+               xztg.clean_dir and streamed from there
+           The MbdID, MbdName and CategoryName categoricals of the three files are given 
+           the same categories, so the MBD merges and groupbys work on integer codes.
 
         Attributes Created:
             - working_dir: Base working directory
@@ -122,8 +194,13 @@ class MBDCCImpcts:
             - cell_adj_df: DataFrame with cell diagnostics
             - mbd_numdist: DataFrame with MBD numerical distribution data
             - mbd_typetarget: DataFrame with MBD type and target data
-            - vue_impacts: DataFrame with VUE impact data
+            - vue_impacts: DataFrame with VUE impact data, or None in streaming mode
+            - chunksize: Rows per VUE_Impacts chunk in streaming mode
+            - max_workers: Number of threads for the partitioned stages
+            - profiler: RunProfiler shared with xztg, disabled unless profile is True
+            - delta: Whether the saved outputs get a delta file, also set on xztg
         """
+        self._stage_cache = {}
         self.working_dir = working_dir
         self.input_dir = f'{self.working_dir}/inputs'
         self.output_dir = f'{self.working_dir}/outputs'
@@ -134,16 +211,34 @@ class MBDCCImpcts:
         self.cw_param = cell_weight_param
         self.same_dir_gap_tolerance = same_dir_gap_tolerance
         self.diff_dir_gap_tolerance = diff_dir_gap_tolerance
-        self.xztg = XZTGen.XZTG(self.working_dir)
+        self.max_workers = max_workers
+        self.profiler = rprof.RunProfiler(enabled=profile)
+        self.delta = delta
+        load_files = dict.fromkeys(XZTGen.xztg_input_files + ['MBD_NumDist.csv',
+                                                              'MBD_TypeTarget.csv'])
+        if chunksize is None:
+            load_files['VUE_Impacts.csv'] = vue_impacts_ucols
+        input_frames = ipc.CleaningInputs(self.working_dir,
+                                          self.profiler).get_clean_frames(load_files)
+        self.xztg = XZTGen.XZTG(self.working_dir, non_handler_patterns, max_workers,
+                                self.profiler, delta, input_frames)
         self.cell_adj_df = self.xztg.get_cell_diagnostics(self.distance_param,
                                                           self.nspc_param,
                                                           self.xf_param,
                                                           self.same_dir_gap_tolerance,
-                                                          self.diff_dir_gap_tolerance)
-        self.mbd_numdist = pd.read_csv(f'{self.input_dir}/MBD_NumDist.csv')
-        self.mbd_typetarget = pd.read_csv(
-            f'{self.input_dir}/MBD_TypeTarget.csv')
-        self.vue_impacts = pd.read_csv(f'{self.input_dir}/VUE_Impacts.csv')
+                                                          self.diff_dir_gap_tolerance,
+                                                          save=save)
+        self.chunksize = chunksize
+        with self.profiler.stage('unify MBD categories', type(self).__name__) as record:
+            mbd_frames = [input_frames['MBD_NumDist.csv'], input_frames['MBD_TypeTarget.csv']]
+            if self.chunksize is None:
+                mbd_frames.append(input_frames['VUE_Impacts.csv'])
+            mbd_frames = ipc.unify_categories(mbd_frames,
+                                              ['MbdID', 'MbdName', 'CategoryName'])
+            record['rows_out'] = sum(len(frame) for frame in mbd_frames)
+        self.mbd_numdist = mbd_frames[0]
+        self.mbd_typetarget = mbd_frames[1]
+        self.vue_impacts = mbd_frames[2] if self.chunksize is None else None
 
     def relative_change(self, 
                         v1, 
@@ -171,19 +266,17 @@ class MBDCCImpcts:
         Determine cell relevance based on impact and weight.
 
         Args:
-            impact_col (float): The impact value.
-            weight_col (float): The weight value.
+            impact_col (pd.Series or np.ndarray): The impact values.
+            weight_col (pd.Series or np.ndarray): The weight values.
 
         Returns:
-            int: 1 if the cell is relevant, 0 otherwise.
+            np.ndarray: 1 where the cell is relevant, 0 otherwise.
 
         Summary:
             Checks if the absolute impact is >= cc_param and weight is >= cw_param.
         """
-        if (abs(impact_col) >= self.cc_param and weight_col >= self.cw_param):
-            return 1
-        else:
-            return 0
+        return np.where((np.abs(impact_col) >= self.cc_param) &
+                        (weight_col >= self.cw_param), 1, 0)
 
     def out_of_target_mbd(self, 
                           mbd_impact, 
@@ -192,19 +285,38 @@ class MBDCCImpcts:
         Check if MBD impact is out of target.
 
         Args:
-            mbd_impact (float): The MBD impact value.
-            mbd_target (float): The MBD target value.
+            mbd_impact (pd.Series or np.ndarray): The MBD impact values.
+            mbd_target (pd.Series or np.ndarray): The MBD target values.
 
         Returns:
-            int: 1 if out of target, 0 otherwise.
+            np.ndarray: 1 where out of target, 0 otherwise.
 
         Summary:
             Compares the absolute MBD impact to the target value.
         """
-        if abs(mbd_impact) >= mbd_target:
-            return 1
-        else:
-            return 0
+        return np.where(np.abs(mbd_impact) >= mbd_target, 1, 0)
+
+    def count_mbds(self,
+                   mbd_df: pd.DataFrame):
+        """
+        Count the MBD-categories and the MBDs, and those out of target.
+
+        Args:
+            mbd_df (pd.DataFrame): MBD-categories with their MbdID and OutOfTarget, as 
+                returned by set_mbd_targets() or set_mbd_type().
+
+        Returns:
+            dict: The counts:
+                - OutOfTargetMBDCats, MBDCats: MBD-categories (rows of mbd_df), and those 
+                  out of target.
+                - OutOfTargetMBDs, MBDs: Distinct MbdIDs, and those with at least one 
+                  MBD-category out of target.
+        """
+        out_of_target = mbd_df['OutOfTarget'] >= 1
+        return {'OutOfTargetMBDCats': int(out_of_target.sum()),
+                'MBDCats': len(mbd_df),
+                'OutOfTargetMBDs': int(mbd_df.loc[out_of_target, 'MbdID'].nunique()),
+                'MBDs': int(mbd_df['MbdID'].nunique())}
 
     def cellcat_cond(self, 
                      v1, 
@@ -213,20 +325,18 @@ class MBDCCImpcts:
         Determine cell category condition.
 
         Args:
-            v1 (int): First condition value.
-            v2 (int): Second condition value.
+            v1 (pd.Series or np.ndarray): First condition values.
+            v2 (pd.Series or np.ndarray): Second condition values.
 
         Returns:
-            str: 'Anomalous' if sum of inputs >= 1, 'Normal' otherwise.
+            np.ndarray: 'Anomalous' where sum of inputs >= 1, 'Normal' otherwise.
 
         Summary:
             Classifies the cell category based on the sum of two input conditions.
         """
-        if (v1 + v2) >= 1:
-            return 'Anomalous'
-        else:
-            return 'Normal'
+        return np.where((v1 + v2) >= 1, 'Anomalous', 'Normal')
 
+    @XZTGen.pipeline_stage
     def set_cell_impacts(self):
         """
         Calculate and set cell impacts.
@@ -239,7 +349,7 @@ class MBDCCImpcts:
             and determines cell relevance.
         
         Step-by-step:
-        1. Define columns to use (ucols) from vue_impacts.
+        1. Define columns to use (ucols) from vue_impacts (vue_impacts_ucols).
             - 'MbdID'
             - 'MbdName'
             - 'Cell_ID'
@@ -247,9 +357,9 @@ class MBDCCImpcts:
             - 'CategoryName'
             - 'Baseline_Sales'
             - 'Baseline_CellImportance'
-        2. Create a copy of vue_impacts and select only the defined columns.
-        3. Create a copy of cell_adj_df and select only 'Cell_ID' and X-Factor columns.
-        4. Merge the impacts and celladj DataFrames on 'Cell_ID'.
+        2. Select only the defined columns of vue_impacts.
+        3. Take cell_adj_df indexed on 'Cell_ID' (key_index), once for all the partitions.
+        4. Join its X-Factor columns to the impacts on 'Cell_ID' (inner join).
         5. Calculate new columns:
             a. 'UnprojectedSales': Baseline_Sales / BAU_XFactor
             b. 'VUE_ProjectedSales': UnprojectedSales * VUE_XFactor
@@ -259,27 +369,60 @@ class MBDCCImpcts:
             e. 'ADJ_SalesImpact': Relative change between Baseline_Sales and ADJ_ProjectedSales:
                 row['ADJ_ProjectedSales'] / row['Baseline_Sales'] - 1
         6. Add 'CellCatTest' column:
-            a. Apply cell_relevance method to ADJ_SalesImpact and Baseline_CellImportance for each row:
-                - Checks if the abs(row['ADJ_SalesImpact']) >= cell_cat_param.
-                - Checks if row['Baseline_CellImportance'] >= cell_weight_param.
+            a. Evaluate cell_relevance on the ADJ_SalesImpact and Baseline_CellImportance columns:
+                - Checks if abs(ADJ_SalesImpact) >= cell_cat_param.
+                - Checks if Baseline_CellImportance >= cell_weight_param.
                 - If both conditions are met the cell is relevant, and returns 1; otherwise returns 0.
         7. Return the final DataFrame with all calculated impacts and tests.
         """
-        ucols = ['MbdID', 'MbdName', 'Cell_ID', 'CategoryCode',
-                 'CategoryName', 'Baseline_Sales',
-                 'Baseline_CellImportance']
-        impacts = self.vue_impacts.copy()
-        impacts = impacts[ucols]
-        celladj = self.cell_adj_df.copy()
-        celladj = celladj[['Cell_ID', 'BAU_XFactor',
-                           'VUE_XFactor', 'ADJ_XFactor']]
-        impact_df = pd.merge(impacts, celladj, on='Cell_ID')
+        if self.vue_impacts is None:
+            raise ValueError('VUE_Impacts.csv is not loaded in streaming mode (chunksize is set). '
+                             'Use stream_mbd_diagnostics() instead.')
+        self.key_index('cell_adj_df', 'Cell_ID')
+        impact_df = XZTGen.map_partitions(self._cell_impacts_frame, self.vue_impacts,
+                                          mbd_partition_cols, self.max_workers)
+        impact_df.reset_index(inplace=True, drop=True)
         impact_df_message = '''
         Consider that only the Cell_IDs from VUE_Impacts.csv that are also
         present in XZTemplate_v0.csv will be considered. This match will result
         in the Impacts dataframe.
         '''
         print(impact_df_message)
+        return impact_df
+
+    def _cell_impacts_frame(self,
+                            impacts: pd.DataFrame):
+        """
+        Join VUE impact rows to the cell X-Factors and add the sales impact columns.
+
+        Args:
+            impacts (pd.DataFrame): VUE impact rows with at least the vue_impacts_ucols columns.
+
+        Returns:
+            pd.DataFrame: The cell impacts of those rows, as described in set_cell_impacts, 
+                          steps 1 to 6, keeping the index labels of impacts.
+        """
+        ucols = vue_impacts_ucols
+        impacts = impacts[ucols]
+        celladj = self.key_index('cell_adj_df', 'Cell_ID')
+        impact_df = celladj.join(impacts, ['BAU_XFactor', 'VUE_XFactor', 'ADJ_XFactor'])
+        self.profiler.record_merge('XZTemplate_v0', impacts, celladj.table, impact_df,
+                                   'Cell_ID')
+        self._add_sales_impacts(impact_df)
+        return impact_df
+
+    def _add_sales_impacts(self,
+                           impact_df: pd.DataFrame):
+        """
+        Add the projected sales, impacts and cell relevance columns.
+
+        Args:
+            impact_df (pd.DataFrame): A DataFrame with Baseline_Sales, Baseline_CellImportance 
+                and the BAU, VUE and ADJ X-Factors of each row.
+
+        Summary:
+            Computes the columns described in set_cell_impacts, steps 5 and 6.
+        """
         impact_df['UnprojectedSales'] = (
             impact_df['Baseline_Sales'] / impact_df['BAU_XFactor'])
         impact_df['VUE_ProjectedSales'] = (
@@ -290,13 +433,28 @@ class MBDCCImpcts:
             impact_df['Baseline_Sales'], impact_df['VUE_ProjectedSales'])
         impact_df['ADJ_SalesImpact'] = self.relative_change(
             impact_df['Baseline_Sales'], impact_df['ADJ_ProjectedSales'])
-        impact_df['CellCatTest'] = impact_df.apply(
-            lambda row: self.cell_relevance(
-                row['ADJ_SalesImpact'],
-                row['Baseline_CellImportance']),
-            axis=1)
-        return impact_df
+        impact_df['CellCatTest'] = self.cell_relevance(
+            impact_df['ADJ_SalesImpact'],
+            impact_df['Baseline_CellImportance'])
+
+    @XZTGen.pipeline_stage
+    def set_mbd_incidence(self):
+        """
+        Build the sparse MBD-category by cell incidence of the unprojected sales.
+
+        Returns:
+            SalesIncidence.SalesIncidence: The UnprojectedSales of set_cell_impacts() summed 
+                by MBD-category (the grouping columns of set_mbd_impacts) and Cell_ID.
+
+        Summary:
+            The incidence does not depend on the VUE or ADJ X-Factors, so it is built once 
+            and every X-Factor vector, including the ADJ edits of update_adjustments and 
+            the candidates of evaluate_mbd_impacts, is projected to MBD level with one 
+            sparse matrix-vector product instead of a join and a groupby.
+        """
+        return si.SalesIncidence(self.set_cell_impacts())
 
+    @XZTGen.pipeline_stage
     def set_mbd_impacts(self):
         """
         Calculate and set MBD impacts.
@@ -308,45 +466,105 @@ class MBDCCImpcts:
             Aggregates cell impacts to MBD level and calculates VUE and ADJ sales impacts.
         
         Step-by-step:
-        1. Define grouping columns (gcols) for MBD level aggregation:
+        1. Take the MBD-category by cell incidence from set_mbd_incidence(). Its rows are 
+           the MBD-categories, identified by the grouping columns (gcols), in sorted order:
             - 'MbdID'
             - 'MbdName'
             - 'CategoryCode'
             - 'CategoryName'
-        2. Define columns to use (ucols), including gcols and sales columns:
-            - 'MbdID'
-            - 'MbdName'
-            - 'CategoryCode'
-            - 'CategoryName'
-            - 'Baseline_Sales'
-            - 'VUE_ProjectedSales'
-            - 'ADJ_ProjectedSales'
-        3. Create a copy of the DataFrame returned by set_cell_impacts().
-        4. Select only the defined columns (ucols) from the impact_df.
-        5. Group the data by gcols and sum the sales columns.
-        6. Reset the index of the grouped DataFrame, keeping the grouping columns.
-        7. Calculate new columns:
+        2. Take the Baseline_Sales sum of each MBD-category from the incidence.
+        3. Calculate the projected sales of each MBD-category as the product of the 
+           incidence with the X-Factor of each cell in cell_adj_df:
+            a. 'VUE_ProjectedSales': with VUE_XFactor
+            b. 'ADJ_ProjectedSales': with ADJ_XFactor
+           These are the sums of the cell VUE_ProjectedSales and ADJ_ProjectedSales of 
+           set_cell_impacts(), skipping cells with a NaN X-Factor. They are added in a 
+           different order than a groupby sum, so they can differ from it in the last 
+           digits.
+        4. Calculate new columns:
             a. 'VUE_SalesImpact': Relative change between Baseline_Sales and VUE_ProjectedSales:
                 (VUE_ProjectedSales / Baseline_Sales) - 1
             b. 'ADJ_SalesImpact': Relative change between Baseline_Sales and ADJ_ProjectedSales:
                 (ADJ_ProjectedSales / Baseline_Sales) - 1
-        8. Return the final DataFrame with aggregated MBD impacts.
+        5. Return the final DataFrame with aggregated MBD impacts.
+        """
+        incidence = self.set_mbd_incidence()
+        cell_adj = self.cell_adj_df.set_index('Cell_ID')
+        impact_df = incidence.keys.copy()
+        impact_df['Baseline_Sales'] = incidence.baseline_sales
+        impact_df['VUE_ProjectedSales'] = incidence.project(
+            incidence.factor_vector(cell_adj['VUE_XFactor']))
+        impact_df['ADJ_ProjectedSales'] = incidence.project(
+            incidence.factor_vector(cell_adj['ADJ_XFactor']))
+        self._add_mbd_sales_impacts(impact_df)
+        return impact_df
+
+    def evaluate_mbd_impacts(self,
+                             adj_xfactors: pd.Series):
+        """
+        Compute the MBD ADJ sales impacts of candidate ADJ_XFactor values.
+
+        Args:
+            adj_xfactors (pd.Series): New ADJ_XFactor values indexed by Cell_ID. Cells not 
+                in adj_xfactors keep their current ADJ_XFactor.
+
+        Returns:
+            pd.DataFrame: The grouping columns of set_mbd_impacts, with the Baseline_Sales, 
+                          ADJ_ProjectedSales and ADJ_SalesImpact each MBD-category would 
+                          have.
+
+        Summary:
+            Projects the candidate X-Factors through the cached set_mbd_incidence(), which 
+            takes milliseconds, and changes nothing: call update_adjustments to apply them.
+        """
+        incidence = self.set_mbd_incidence()
+        factors = self.cell_adj_df.set_index('Cell_ID')['ADJ_XFactor']
+        factors = factors[~factors.index.duplicated(keep='last')]
+        factors = adj_xfactors.combine_first(factors)
+        impact_df = incidence.keys.copy()
+        impact_df['Baseline_Sales'] = incidence.baseline_sales
+        impact_df['ADJ_ProjectedSales'] = incidence.project(incidence.factor_vector(factors))
+        impact_df['ADJ_SalesImpact'] = self.relative_change(
+            impact_df['Baseline_Sales'], impact_df['ADJ_ProjectedSales'])
+        return impact_df
+
+    def _sum_mbd_sales(self,
+                       impact_df: pd.DataFrame):
+        """
+        Sum the cell sales of each MBD and category.
+
+        Args:
+            impact_df (pd.DataFrame): Cell impacts, as returned by set_cell_impacts.
+
+        Returns:
+            pd.DataFrame: The Baseline_Sales, VUE_ProjectedSales and ADJ_ProjectedSales sums, 
+                          indexed by the grouping columns of set_mbd_impacts, step 1.
         """
         gcols = ['MbdID', 'MbdName', 'CategoryCode',
                  'CategoryName']
         ucols = gcols + ['Baseline_Sales',
                          'VUE_ProjectedSales',
                          'ADJ_ProjectedSales']
-        impact_df = self.set_cell_impacts().copy()
         impact_df = impact_df[ucols]
-        impact_df = impact_df.groupby(gcols).sum()
-        impact_df.reset_index(inplace=True, drop=False)
+        return impact_df.groupby(gcols, observed=True).sum()
+
+    def _add_mbd_sales_impacts(self,
+                               impact_df: pd.DataFrame):
+        """
+        Add the MBD level VUE and ADJ sales impact columns.
+
+        Args:
+            impact_df (pd.DataFrame): MBD sales sums, as returned by _sum_mbd_sales.
+
+        Summary:
+            Computes the columns described in set_mbd_impacts, step 7.
+        """
         impact_df['VUE_SalesImpact'] = self.relative_change(
             impact_df['Baseline_Sales'], impact_df['VUE_ProjectedSales'])
         impact_df['ADJ_SalesImpact'] = self.relative_change(
             impact_df['Baseline_Sales'], impact_df['ADJ_ProjectedSales'])
-        return impact_df
 
+    @XZTGen.pipeline_stage
     def set_mbd_nd(self):
         """
         Set up MBD numerical distribution data.
@@ -362,19 +580,19 @@ class MBDCCImpcts:
             - 'MbdID'
             - 'CategoryName'
             - 'Numerical Distribution'
-        2. Create a copy of the mbd_numdist DataFrame.
-        3. Select only the defined columns (ucols) from the mbd_nd DataFrame.
-        4. Call set_mbd_impacts() to get the MBD impacts DataFrame.
-        5. Merge the MBD impacts DataFrame with the mbd_nd DataFrame:
-            - Merge on columns 'MbdID' and 'CategoryName'
+        2. Take the mbd_numdist table indexed on 'MbdID' and 'CategoryName' (key_index).
+        3. Call set_mbd_impacts() to get the MBD impacts DataFrame.
+        4. Join 'Numerical Distribution' to the MBD impacts DataFrame:
+            - Join on columns 'MbdID' and 'CategoryName' (inner join)
+        5. Reset the index of the joined DataFrame.
         6. Return the merged DataFrame containing MBD impacts and numerical distribution data.
         """
-        ucols = ['MbdID', 'CategoryName', 'Numerical Distribution']
-        mbd_nd = self.mbd_numdist.copy()
-        mbd_nd = mbd_nd[ucols]
+        mbd_nd = self.key_index('mbd_numdist', ['MbdID', 'CategoryName'])
         mbd_impacts = self.set_mbd_impacts()
-        mbd_impact_df = pd.merge(mbd_impacts, mbd_nd,
-                                 on=['MbdID', 'CategoryName'])
+        mbd_impact_df = mbd_nd.join(mbd_impacts, ['Numerical Distribution'])
+        mbd_impact_df.reset_index(inplace=True, drop=True)
+        self.profiler.record_merge('MBD_NumDist.csv', mbd_impacts, mbd_nd.table, mbd_impact_df,
+                                   ['MbdID', 'CategoryName'])
         mbd_impact_df_message = '''
         Consider that only the key Mbd_ID + CategoryName from Impacts dataframe that are also
         present in MBD_NumDist.csv will be considered. This match will result
@@ -383,7 +601,8 @@ class MBDCCImpcts:
         print(mbd_impact_df_message)
         return mbd_impact_df
 
-    def set_mbd_type(self):
+    @XZTGen.pipeline_stage
+    def set_mbd_targets(self):
         """
         Set up MBD type and target data.
 
@@ -391,99 +610,147 @@ class MBDCCImpcts:
             pd.DataFrame: DataFrame with MBD impacts, types, and out-of-target flags.
 
         Summary:
-            Merges MBD impacts with type and target data, determines if impacts are out of target,
-            and saves results to a CSV file.
+            Merges MBD impacts with type and target data, and determines if impacts are 
+            out of target.
         
         Step-by-step:
         1. Define columns to use (ucols) from mbd_typetarget:
             - 'MbdID'
             - 'MBD Type'
             - 'Target'
-        2. Create a copy of the mbd_typetarget DataFrame.
-        3. Select only the defined columns (ucols) from the mbd_tt DataFrame.
+        2. Take the mbd_typetarget table indexed on 'MbdID' (key_index).
+        3. Reset the index after the join in step 5.
         4. Call set_mbd_nd() to get the MBD impacts with numerical distribution DataFrame.
-        5. Merge the impact_df (from step 4) with mbd_tt DataFrame on 'MbdID'.
+        5. Join 'MBD Type' and 'Target' to the impact_df (from step 4) on 'MbdID'.
         6. Add 'OutOfTarget' column:
-            a. Apply out_of_target_mbd method to ADJ_SalesImpact and Target for each row:
-                abs(row['ADJ_SalesImpact']) >= Target
-        7. Save the resulting DataFrame to a CSV file:
-            a. File path: {self.output_dir}/MBDCat_Impacts_v0.csv
-            b. CSV is saved without the index column
+            a. Evaluate out_of_target_mbd on the ADJ_SalesImpact and Target columns:
+                abs(ADJ_SalesImpact) >= Target
+        7. Drop duplicated rows.
         8. Return the final DataFrame with MBD impacts, types, and out-of-target flags.
         """
-        ucols = ['MbdID', 'MBD Type', 'Target']
-        mbd_tt = self.mbd_typetarget.copy()
-        mbd_tt = mbd_tt[ucols]
+        mbd_tt = self.key_index('mbd_typetarget', 'MbdID')
         impact_df = self.set_mbd_nd()
-        mbd_impacts = pd.merge(impact_df, mbd_tt, on='MbdID')
+        mbd_impacts = mbd_tt.join(impact_df, ['MBD Type', 'Target'])
+        mbd_impacts.reset_index(inplace=True, drop=True)
+        self.profiler.record_merge('MBD_TypeTarget.csv', impact_df, mbd_tt.table, mbd_impacts,
+                                   'MbdID')
         mbd_impacts_message = '''
         Consider that only the Mbd_IDs from MBD_Impacts dataframe
         that are also present in MBD_TypeTarget.csv will be considered. This match will result
         in the MBDCat_Impacts_v0 dataframe.
         '''
         print(mbd_impacts_message)
-        mbd_impacts['OutOfTarget'] = mbd_impacts.apply(
-            lambda row:
-                self.out_of_target_mbd(
-                    row['ADJ_SalesImpact'],
-                    row['Target']),
-                axis=1)
+        mbd_impacts['OutOfTarget'] = self.out_of_target_mbd(
+            mbd_impacts['ADJ_SalesImpact'], mbd_impacts['Target'])
         mbd_impacts.drop_duplicates(inplace=True, ignore_index=True)
-        mbd_impacts.to_csv(f'{self.output_dir}/MBDCat_Impacts_v0.csv',
-                           index=False)
-        print('MBDCat_Impacts_v0.csv has been saved to the outputs directory.')
         return mbd_impacts
 
-    def get_mbd_diagnostics(self):
+    def set_mbd_type(self,
+                     save: bool = True):
         """
-        Generate MBD and cell category diagnostics.
+        Set up MBD type and target data, and save it.
+
+        Args:
+            save (bool, optional): Whether to save the result to the outputs directory. 
+                Defaults to True.
+
+        Returns:
+            pd.DataFrame: DataFrame with MBD impacts, types, and out-of-target flags.
+
+        Summary:
+            Takes the result of set_mbd_targets() and, if save is True, saves it to 
+            {self.output_dir}/MBDCat_Impacts_v0.csv without the index column (and its 
+            delta if delta is True).
+        """
+        mbd_impacts = self.set_mbd_targets()
+        if save:
+            previous = self._read_previous('MBDCat_Impacts_v0.csv')
+            with self.profiler.stage('save MBDCat_Impacts_v0.csv',
+                                     type(self).__name__) as record:
+                mbd_impacts.to_csv(f'{self.output_dir}/MBDCat_Impacts_v0.csv',
+                                   index=False)
+                record['rows_out'] = len(mbd_impacts)
+            print('MBDCat_Impacts_v0.csv has been saved to the outputs directory.')
+            self._write_delta(previous, mbd_impacts, 'MBDCat_Impacts_v0.csv')
+        return mbd_impacts
+
+    @XZTGen.pipeline_stage
+    def set_mbd_cell_diag(self):
+        """
+        Set up MBD and cell category diagnostics.
 
         Returns:
             pd.DataFrame: DataFrame with MBD and cell category diagnostics.
 
         Summary:
-            Combines MBD and cell impact data, generates diagnostics for each cell category,
-            and saves results to a CSV file.
+            Combines MBD and cell impact data, and generates diagnostics for each cell category.
             
         Step-by-step:
-        1. Define the columns to use (ucols) for MBD and cell categories:
+        1. Define the columns to use (mbd_diag_cols) for MBD and cell categories:
             - 'MbdID'
             - 'CategoryName'
+            - 'MBD Type'
+            - 'Target'
             - 'OutOfTarget'
-        2. Call set_mbd_type() to obtain the MBD DataFrame.
-        3. Select only the defined columns (ucols) from the MBD DataFrame.
-        4. Call set_cell_impacts() to obtain the cell impacts DataFrame.
-        5. Merge the MBD DataFrame and the cell impacts DataFrame into cell_diag based on 'MbdID' and 'CategoryName'.
+            - 'Numerical Distribution'
+        2. Call set_mbd_targets() to obtain the MBD DataFrame.
+        3. Select only the defined columns from the MBD DataFrame and index them on 
+           'MbdID' and 'CategoryName' (_mbd_key_index), once for all the partitions.
+        4. Call set_cell_impacts() to obtain the cell impacts DataFrame; it was already 
+           computed for set_mbd_targets() and is reused, not rebuilt.
+        5. Join the MBD columns to the cell impacts DataFrame into cell_diag based on 'MbdID' and 'CategoryName'.
         6. Add the 'MBDCatDiag' column: 
-            - Apply the cellcat_cond method to 'CellCatTest' and 'OutOfTarget' for each row:
-                - 'Anomalous' if (row['CellCatTest'] + row['OutOfTarget']) >= 1, 'Normal' otherwise.
-        7. Save the resulting DataFrame to a CSV file: 
-            - File path: {self.output_dir}/MBDCatCell_Impacts_v0.csv 
-            - The CSV is saved without the index column.
+            - Evaluate cellcat_cond on the 'CellCatTest' and 'OutOfTarget' columns:
+                - 'Anomalous' if (CellCatTest + OutOfTarget) >= 1, 'Normal' otherwise.
+        7. Select the output columns and drop duplicated rows.
         8. Return the final DataFrame with MBD and cell category diagnostics.
         """
-        ucols = ['MbdID',
-                 'CategoryName',
-                 'MBD Type',
-                 'Target',
-                 'OutOfTarget',
-                 'Numerical Distribution']
-        mbd_df = self.set_mbd_type()
-        mbd_df = mbd_df[ucols]
-        cell_df = self.set_cell_impacts()
-        cell_diag = pd.merge(cell_df, mbd_df,
-                             on=['MbdID', 'CategoryName'])
+        mbd_df = self._mbd_key_index(self.set_mbd_targets())
+        cell_diag = XZTGen.map_partitions(lambda cell_df: self._cell_diag_frame(cell_df, mbd_df),
+                                          self.set_cell_impacts(),
+                                          mbd_partition_cols, self.max_workers)
+        cell_diag.reset_index(inplace=True, drop=True)
         cell_diag_message = '''
         Consider that only the key Mbd_ID + CategoryName from Impacts dataframe that are also
         present in MBDCat_Impacts_v0.csv will be considered. This match will result
         in the MBDCatCell_Impacts_v0 dataframe.
         '''
         print(cell_diag_message)
-        cell_diag['MBDCatDiag'] = cell_diag.apply(
-            lambda row: self.cellcat_cond(
-                row['CellCatTest'],
-                row['OutOfTarget']),
-            axis=1)
+        return cell_diag
+
+    def _mbd_key_index(self,
+                       mbd_df: pd.DataFrame):
+        """
+        Index the MBD targets on their (MbdID, CategoryName) key, for _cell_diag_frame.
+
+        Args:
+            mbd_df (pd.DataFrame): MBD targets, as returned by set_mbd_targets.
+
+        Returns:
+            XZTGen.KeyIndex: The index of the mbd_diag_cols columns of mbd_df.
+        """
+        return XZTGen.KeyIndex(mbd_df[mbd_diag_cols], ['MbdID', 'CategoryName'])
+
+    def _cell_diag_frame(self,
+                         cell_df: pd.DataFrame,
+                         mbd_df: XZTGen.KeyIndex):
+        """
+        Join cell impacts to their MBD targets and add the MBD-category-cell diagnostic.
+
+        Args:
+            cell_df (pd.DataFrame): Cell impacts, as returned by set_cell_impacts.
+            mbd_df (XZTGen.KeyIndex): MBD targets, as returned by _mbd_key_index, so all 
+                the partitions or chunks of cell_df are joined to one index.
+
+        Returns:
+            pd.DataFrame: The diagnostics described in set_mbd_cell_diag, steps 1 to 7, 
+                          keeping the index labels of cell_df.
+        """
+        cell_diag = mbd_df.join(cell_df, mbd_diag_cols[2:])
+        self.profiler.record_merge('MBDCat_Impacts_v0', cell_df, mbd_df.table, cell_diag,
+                                   ['MbdID', 'CategoryName'])
+        cell_diag['MBDCatDiag'] = self.cellcat_cond(
+            cell_diag['CellCatTest'], cell_diag['OutOfTarget'])
         cell_diag = cell_diag[['MbdID',
                                'MbdName',
                                'Cell_ID',
@@ -505,8 +772,559 @@ class MBDCCImpcts:
                                'CellCatTest',
                                'OutOfTarget',
                                'MBDCatDiag']]
-        cell_diag.drop_duplicates(inplace=True, ignore_index=True)
-        cell_diag.to_csv(f'{self.output_dir}/MBDCatCell_Impacts_v0.csv',
-                         index=False)
+        cell_diag = cell_diag.drop_duplicates()
+        return cell_diag
+
+    def get_mbd_diagnostics(self):
+        """
+        Generate MBD and cell category diagnostics and save results.
+
+        Returns:
+            pd.DataFrame: DataFrame with MBD and cell category diagnostics.
+
+        Summary:
+            Saves the MBD level results through set_mbd_type(), then takes the result of 
+            set_mbd_cell_diag() and saves it to {self.output_dir}/MBDCatCell_Impacts_v0.csv 
+            without the index column. With delta set, the rows that changed since the 
+            previous run are saved too. Saves the run report if profile is True.
+        """
+        self.set_mbd_type()
+        cell_diag = self.set_mbd_cell_diag()
+        previous = self._read_previous('MBDCatCell_Impacts_v0.csv')
+        with self.profiler.stage('save MBDCatCell_Impacts_v0.csv',
+                                 type(self).__name__) as record:
+            cell_diag.to_csv(f'{self.output_dir}/MBDCatCell_Impacts_v0.csv',
+                             index=False)
+            record['rows_out'] = len(cell_diag)
         print('MBDCatCell_Impacts_v0.csv has been saved to the outputs directory.')
+        self._write_delta(previous, cell_diag, 'MBDCatCell_Impacts_v0.csv')
+        self.profiler.write(f'{self.output_dir}/run_report.json', self.working_dir)
         return cell_diag
+
+    def stream_mbd_diagnostics(self,
+                               chunksize: int = None):
+        """
+        Generate and save the MBD and cell category diagnostics reading VUE_Impacts in chunks.
+
+        Args:
+            chunksize (int, optional): Rows per VUE_Impacts chunk. Defaults to self.chunksize, 
+                or to ipc.clean_chunksize if that is None too.
+
+        Returns:
+            pd.DataFrame: DataFrame with MBD impacts, types, and out-of-target flags, as 
+                          returned by set_mbd_type().
+
+        Summary:
+            Saves the same MBDCat_Impacts_v0.csv and MBDCatCell_Impacts_v0.csv files as 
+            get_mbd_diagnostics(), but holds at most one chunk, or the rows of one 
+            partition (mbd_partition_cols) when writing, of cell rows in memory, so the 
+            memory used does not grow with the size of VUE_Impacts.csv beyond the largest 
+            category. MBDCatCell_Impacts_v0.csv comes out grouped by partition, in input 
+            order within each. The MBD-category-cell rows are not returned; they are only 
+            written.
+
+        Step-by-step:
+        1. First pass over the cleaned VUE_Impacts file, chunk by chunk:
+            a. Build the cell impacts of the chunk (set_cell_impacts, steps 1 to 6).
+            b. Sum its sales by MBD and category, and add the sums to the running totals.
+        2. Store the totals, with their sales impacts, as the set_mbd_impacts result, then 
+           call set_mbd_type() to add the numerical distribution, types and targets, and to 
+           save MBDCat_Impacts_v0.csv.
+        3. Second pass over the cleaned VUE_Impacts file, chunk by chunk:
+            a. Build the cell impacts of the chunk again.
+            b. Join them to the MBD targets and add MBDCatDiag (set_mbd_cell_diag).
+            c. Split the rows by partition and spill each part to a temporary file in 
+               the clean cache directory.
+        4. For each partition, in the order of map_partitions, read its spilled parts back, 
+           drop the duplicated rows, as set_mbd_cell_diag does within each partition, and 
+           append the rest to MBDCatCell_Impacts_v0.csv. Duplicates always share their 
+           partition, so every row is compared exactly with all the others.
+        5. With delta set, save the rows that changed since the previous run. The delta 
+           compares whole files, so it holds both runs of MBDCatCell_Impacts_v0.csv in memory.
+        """
+        chunksize = chunksize or self.chunksize or ipc.clean_chunksize
+        mbd_sums = None
+        impact_rows = 0
+        with self.profiler.stage('stream MBD sums', type(self).__name__) as record:
+            for chunk in ipc.iter_clean_file(self.xztg.clean_dir, 'VUE_Impacts.csv',
+                                             columns=vue_impacts_ucols, chunksize=chunksize):
+                impact_rows += len(chunk)
+                chunk_sums = self._sum_mbd_sales(self._cell_impacts_frame(chunk))
+                if mbd_sums is None:
+                    mbd_sums = chunk_sums
+                else:
+                    mbd_sums = mbd_sums.add(chunk_sums, fill_value=0)
+            mbd_impacts = mbd_sums.sort_index().reset_index(drop=False)
+            self._add_mbd_sales_impacts(mbd_impacts)
+            self.profiler.record_input('VUE_Impacts.csv', impact_rows)
+            record['rows_out'] = len(mbd_impacts)
+        self.set_stage_result('set_mbd_impacts', mbd_impacts)
+        mbd_df = self.set_mbd_type()
+        mbd_index = self._mbd_key_index(mbd_df)
+
+        output_path = f'{self.output_dir}/MBDCatCell_Impacts_v0.csv'
+        previous = self._read_previous('MBDCatCell_Impacts_v0.csv')
+        with self.profiler.stage('stream MBDCatCell_Impacts_v0.csv',
+                                 type(self).__name__) as record, \
+                tempfile.TemporaryDirectory(dir=self.xztg.clean_dir) as spill_dir:
+            spills = {}
+            empty = None
+            for number, chunk in enumerate(ipc.iter_clean_file(
+                    self.xztg.clean_dir, 'VUE_Impacts.csv', columns=vue_impacts_ucols,
+                    chunksize=chunksize)):
+                cell_diag = self._cell_diag_frame(self._cell_impacts_frame(chunk), mbd_index)
+                empty = cell_diag.iloc[:0]
+                for key, partition in cell_diag.groupby(mbd_partition_cols, sort=False,
+                                                        dropna=False, observed=True):
+                    paths = spills.setdefault(key, [])
+                    paths.append(f'{spill_dir}/{list(spills).index(key)}_{number}.pkl')
+                    partition.to_pickle(paths[-1])
+            rows_out = 0
+            if spills:
+                keys = pd.MultiIndex.from_tuples(list(spills)).sort_values()
+            else:
+                keys = []
+                if empty is not None:
+                    empty.to_csv(output_path, index=False)
+            for number, key in enumerate(keys):
+                partition = pd.concat([pd.read_pickle(path) for path in spills[key]])
+                partition = partition.drop_duplicates()
+                partition.to_csv(output_path, mode='a' if number else 'w',
+                                 header=number == 0, index=False)
+                rows_out += len(partition)
+            record['rows_out'] = rows_out
+        print('MBDCatCell_Impacts_v0.csv has been saved to the outputs directory.')
+        self._write_delta(previous, None, 'MBDCatCell_Impacts_v0.csv')
+        self.profiler.write(f'{self.output_dir}/run_report.json', self.working_dir)
+        return mbd_df
+
+    def _read_previous(self,
+                       filename: str):
+        """
+        Read the previous run of an output before it is overwritten, in delta mode.
+
+        Args:
+            filename (str): The output file name.
+
+        Returns:
+            pd.DataFrame or None: The previous output, or None if delta is False or there 
+                                  is no previous output.
+        """
+        if not self.delta:
+            return None
+        return od.read_previous(self.output_dir, filename)
+
+    def _write_delta(self,
+                     previous: pd.DataFrame,
+                     current: pd.DataFrame,
+                     filename: str):
+        """
+        Write the delta of a saved output against its previous run, in delta mode.
+
+        Args:
+            previous (pd.DataFrame or None): The previous output, from _read_previous.
+            current (pd.DataFrame or None): The saved output, or None to read it back when 
+                it was only streamed to disk.
+            filename (str): The output file name.
+        """
+        if self.delta:
+            with self.profiler.stage(f'delta {filename}', type(self).__name__):
+                od.write_delta(previous, current, self.output_dir, filename)
+
+    def export_workbook(self,
+                        template_path: str,
+                        output_path: str = None):
+        """
+        Write the CellAdj and Impacts results into a copy of the macro workbook.
+
+        Args:
+            template_path (str): The LatAM_XZ_Distance .xlsm workbook to copy.
+            output_path (str, optional): The path of the filled workbook. Defaults to the 
+                template file name in the outputs directory.
+
+        Returns:
+            str: The path of the filled workbook.
+
+        Summary:
+            Writes the cell diagnostics (cell_adj_df, as in XZTemplate_v0.csv) into the 
+            CellAdj sheet and the MBD-category-cell diagnostics (set_mbd_cell_diag(), as in 
+            MBDCatCell_Impacts_v0.csv) into the Impacts sheet, with WorkbookExport.export_workbook. 
+            The VBA project, the pivot tables and the other sheets are kept. In streaming 
+            mode, the MBD-category-cell rows are read back from MBDCatCell_Impacts_v0.csv, 
+            so stream_mbd_diagnostics() must have been run first.
+        """
+        if output_path is None:
+            output_path = f'{self.output_dir}/{os.path.basename(template_path)}'
+        if self.chunksize is None:
+            cell_diag = self.set_mbd_cell_diag()
+        else:
+            cell_diag = pd.read_csv(f'{self.output_dir}/MBDCatCell_Impacts_v0.csv')
+        with self.profiler.stage('export workbook', type(self).__name__) as record:
+            rows = wbx.export_workbook(template_path, output_path,
+                                       {'CellAdj': self.cell_adj_df,
+                                        'Impacts': cell_diag})
+            record['rows_out'] = sum(rows.values())
+        return output_path
+
+    def _patch_rows(self,
+                    stage_df: pd.DataFrame,
+                    key_cols: list,
+                    new_values: pd.DataFrame):
+        """
+        Overwrite the rows of a cached DataFrame with values looked up by key.
+
+        Args:
+            stage_df (pd.DataFrame): The cached DataFrame to modify in place.
+            key_cols (list): The columns identifying the rows.
+            new_values (pd.DataFrame): The new values, indexed by the key columns (unique).
+
+        Returns:
+            pd.Series: Boolean mask of the modified rows.
+        """
+        keys = pd.MultiIndex.from_frame(stage_df[key_cols])
+        new_index = pd.MultiIndex.from_frame(new_values.index.to_frame())
+        rows = keys.isin(new_index)
+        aligned = new_values.set_axis(new_index).reindex(keys[rows])
+        aligned.index = stage_df.index[rows]
+        stage_df.loc[rows, aligned.columns] = aligned
+        return pd.Series(rows, index=stage_df.index)
+
+    def update_adjustments(self,
+                           adj_changes: pd.DataFrame):
+        """
+        Apply analysts' ADJ_XFactor / ADJ_XUniverse edits, recomputing only what they touch.
+
+        Args:
+            adj_changes (pd.DataFrame): 'Cell_ID' plus the edited ADJ_XFactor and/or 
+                ADJ_XUniverse columns. Missing values keep the current ADJ value.
+
+        Returns:
+            pd.DataFrame or None: The recomputed MBD-category-cell rows (those of the edited 
+                cells and of every MBD-category they contribute to), or None if the 
+                diagnostics had not been computed yet.
+
+        Summary:
+            Propagates the edits through the cached cell diagnostics, cell impacts and MBD 
+            aggregates in place, so a single-cell edit costs in proportion to the cells and 
+            MBDs it touches. Call get_mbd_diagnostics() (and xztg.get_cell_diagnostics()) 
+            afterwards to save the updated outputs.
+
+        Step-by-step:
+        1. Call xztg.update_adjustments() to recompute the affected area-channel groups 
+           and cell flags, and copy those rows into cell_adj_df. If the XZTG stages were 
+           not cached, recompute cell_adj_df fully instead (without saving it) and 
+           return None.
+        2. Recompute the cell impacts rows of the cells whose ADJ_XFactor changed.
+        3. Re-project the ADJ sales of the MBD-categories containing those rows through 
+           set_mbd_incidence (evaluate_mbd_impacts) and patch the MBD level 
+           stages (set_mbd_impacts, set_mbd_nd, set_mbd_targets), updating OutOfTarget.
+        4. Patch the MBD-category-cell rows of set_mbd_cell_diag: impacts of the edited 
+           cells, then OutOfTarget and MBDCatDiag of the affected MBD-categories. If an 
+           MBD-category maps to several MBD rows, set_mbd_cell_diag is invalidated instead.
+        5. Return the recomputed MBD-category-cell rows.
+        """
+        gcols = ['MbdID', 'MbdName', 'CategoryCode', 'CategoryName']
+        cells_sub = self.xztg.update_adjustments(adj_changes)
+        if cells_sub is None or 'CellDiagnostic' not in cells_sub.columns:
+            self.cell_adj_df = self.xztg.get_cell_diagnostics(self.distance_param,
+                                                              self.nspc_param,
+                                                              self.xf_param,
+                                                              self.same_dir_gap_tolerance,
+                                                              self.diff_dir_gap_tolerance,
+                                                              save=False)
+            return None
+        cells_sub = cells_sub.drop_duplicates('Cell_ID', keep='last').set_index('Cell_ID')
+        cell_adj = self._cell_adj_df
+        self._patch_rows(cell_adj, ['Cell_ID'],
+                         cells_sub[[col for col in cell_adj.columns if col != 'Cell_ID']])
+        xf_ids = adj_changes.loc[adj_changes['ADJ_XFactor'].notna(), 'Cell_ID'] \
+            if 'ADJ_XFactor' in adj_changes.columns else []
+        new_xf = cells_sub.loc[cells_sub.index.isin(xf_ids), 'ADJ_XFactor']
+        if 'set_cell_impacts' not in self._stage_cache:
+            return None
+        impact_df = self._stage_cache['set_cell_impacts'][1]
+        impact_sub = impact_df.loc[impact_df['Cell_ID'].isin(new_xf.index)].copy()
+        impact_sub['ADJ_XFactor'] = impact_sub['Cell_ID'].map(new_xf)
+        self._add_sales_impacts(impact_sub)
+        impact_df.loc[impact_sub.index, impact_sub.columns] = impact_sub
+        mbd_keys = pd.MultiIndex.from_frame(impact_sub[gcols].drop_duplicates())
+        if 'set_mbd_impacts' in self._stage_cache:
+            mbd_sub = self.evaluate_mbd_impacts(new_xf)
+            in_keys = pd.MultiIndex.from_frame(mbd_sub[gcols]).isin(mbd_keys)
+            mbd_sub = mbd_sub.loc[in_keys].set_index(gcols)[['ADJ_ProjectedSales',
+                                                             'ADJ_SalesImpact']]
+            for stage in ['set_mbd_impacts', 'set_mbd_nd', 'set_mbd_targets']:
+                if stage not in self._stage_cache:
+                    break
+                stage_df = self._stage_cache[stage][1]
+                rows = self._patch_rows(stage_df, gcols, mbd_sub)
+                if stage == 'set_mbd_targets':
+                    stage_df.loc[rows, 'OutOfTarget'] = self.out_of_target_mbd(
+                        stage_df.loc[rows, 'ADJ_SalesImpact'], stage_df.loc[rows, 'Target'])
+        if 'set_mbd_cell_diag' not in self._stage_cache:
+            return None
+        mbd_df = self._stage_cache['set_mbd_targets'][1]
+        if mbd_df.duplicated(['MbdID', 'CategoryName']).any():
+            self.invalidate('set_mbd_cell_diag')
+            return None
+        cell_diag = self._stage_cache['set_mbd_cell_diag'][1]
+        cell_rows = cell_diag['Cell_ID'].isin(new_xf.index)
+        diag_sub = cell_diag.loc[cell_rows].copy()
+        diag_sub['ADJ_XFactor'] = diag_sub['Cell_ID'].map(new_xf)
+        self._add_sales_impacts(diag_sub)
+        cell_diag.loc[diag_sub.index, diag_sub.columns] = diag_sub
+        out_of_target = mbd_df.set_index(['MbdID', 'CategoryName'])[['OutOfTarget']]
+        key_rows = self._patch_rows(cell_diag, ['MbdID', 'CategoryName'],
+                                    out_of_target[out_of_target.index.isin(
+                                        mbd_keys.droplevel(['MbdName', 'CategoryCode']))])
+        rows = key_rows | cell_rows
+        cell_diag.loc[rows, 'MBDCatDiag'] = self.cellcat_cond(
+            cell_diag.loc[rows, 'CellCatTest'], cell_diag.loc[rows, 'OutOfTarget'])
+        return cell_diag.loc[rows].copy()
+
+    def get_params(self):
+        """
+        Return the diagnostic parameters of this object.
+
+        Returns:
+            dict: The seven parameters, keyed by their MBDCCImpcts argument names.
+        """
+        return {'distance_param': self.distance_param,
+                'nspc_param': self.nspc_param,
+                'xf_param': self.xf_param,
+                'cell_cat_param': self.cc_param,
+                'cell_weight_param': self.cw_param,
+                'same_dir_gap_tolerance': self.same_dir_gap_tolerance,
+                'diff_dir_gap_tolerance': self.diff_dir_gap_tolerance}
+
+    def update_params(self,
+                      params: dict):
+        """
+        Change diagnostic parameters, recomputing only the test columns they affect.
+
+        Args:
+            params (dict): New values keyed by parameter name (see get_params). Parameters 
+                not in params keep their value.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If params has unknown parameter names.
+
+        Summary:
+            The parameters only enter the diagnostic tests, never the sales or X-Factors, 
+            so the cached impacts and MBD aggregates stay valid. The cell parameters 
+            recompute the cell flags and cell_adj_df (whose X-Factors do not change, so 
+            set_cell_impacts is kept); cell_cat_param and cell_weight_param recompute 
+            CellCatTest and MBDCatDiag in the cached set_cell_impacts and 
+            set_mbd_cell_diag results in place. Nothing is written to the outputs directory; 
+            call get_mbd_diagnostics() (and xztg.get_cell_diagnostics()) to save them.
+        """
+        current = self.get_params()
+        unknown = [key for key in params if key not in current]
+        if len(unknown) > 0:
+            raise ValueError(f'Unknown parameters: {unknown}. '
+                             f'The proper parameters are: {list(current)}.')
+        new = {**current, **{key: float(value) for key, value in params.items()}}
+        cell_params = ['distance_param', 'nspc_param', 'xf_param',
+                       'same_dir_gap_tolerance', 'diff_dir_gap_tolerance']
+        if any(new[key] != current[key] for key in cell_params):
+            self.distance_param = new['distance_param']
+            self.nspc_param = new['nspc_param']
+            self.xf_param = new['xf_param']
+            self.same_dir_gap_tolerance = new['same_dir_gap_tolerance']
+            self.diff_dir_gap_tolerance = new['diff_dir_gap_tolerance']
+            self._cell_adj_df = self.xztg.get_cell_diagnostics(
+                *[new[key] for key in cell_params], save=False)
+            self.drop_key_indexes('cell_adj_df')
+        if new['cell_cat_param'] == current['cell_cat_param'] \
+                and new['cell_weight_param'] == current['cell_weight_param']:
+            return None
+        self._cc_param = new['cell_cat_param']
+        self._cw_param = new['cell_weight_param']
+        for stage in ['set_cell_impacts', 'set_mbd_cell_diag']:
+            if stage in self._stage_cache:
+                stage_df = self._stage_cache[stage][1]
+                stage_df['CellCatTest'] = self.cell_relevance(
+                    stage_df['ADJ_SalesImpact'], stage_df['Baseline_CellImportance'])
+        if 'set_mbd_cell_diag' in self._stage_cache:
+            cell_diag = self._stage_cache['set_mbd_cell_diag'][1]
+            cell_diag['MBDCatDiag'] = self.cellcat_cond(
+                cell_diag['CellCatTest'], cell_diag['OutOfTarget'])
+        return None
+
+    def propose_adj_xfactors(self,
+                             cells: list = None,
+                             target_margin: float = 0.01,
+                             max_relative_change: float = None,
+                             apply: bool = False):
+        """
+        Propose ADJ_XFactor values that bring the MBD-categories within target.
+
+        Args:
+            cells (list, optional): The Cell_IDs whose ADJ_XFactor can change. Defaults to 
+                the Anomalous cells of cell_adj_df.
+            target_margin (float, optional): Relative margin kept under each Target, since 
+                OutOfTarget is set when |ADJ_SalesImpact| >= Target. Defaults to 0.01, i.e. 
+                the impacts are kept within 99% of their target.
+            max_relative_change (float, optional): If given, every proposed ADJ_XFactor stays 
+                within this relative change of its VUE_XFactor. Defaults to None, which only 
+                keeps them non-negative.
+            apply (bool, optional): Whether to apply the proposal with update_adjustments. 
+                Defaults to False.
+
+        Returns:
+            pd.DataFrame: One row per cell of cells with impacts: 'Cell_ID', 'VUE_XFactor', 
+                          the current 'ADJ_XFactor' and 'Proposed_ADJ_XFactor'.
+
+        Summary:
+            Solves for all the cells at once (XFactorSolver.solve_xfactors): the proposed 
+            X-Factors are as close as possible to VUE_XFactor, in relative terms, while the 
+            ADJ_SalesImpact of every MBD-category of set_mbd_targets stays under its Target. 
+            The other cells keep their current ADJ_XFactor. The impacts are evaluated 
+            through set_mbd_incidence, so nothing is rerun until the proposal is applied.
+
+        Step-by-step:
+        1. Take the VUE and current ADJ X-Factors of every cell with impacts, and the 
+           Target of every MBD-category (the lowest, if an MBD has several).
+        2. Solve for the X-Factors of cells, within the bounds given by 
+           max_relative_change, keeping each |ADJ_SalesImpact| under 
+           Target * (1 - target_margin).
+        3. Print the out-of-target MBD-category counts before and after the proposal, and 
+           split the ones left out of target into those without any of the given cells 
+           (which the proposal cannot change) and those the cells could not bring within 
+           target.
+        4. If apply is True, pass the proposed values to update_adjustments.
+        5. Return the proposal.
+        """
+        gcols = si.mbd_key_cols
+        incidence = self.set_mbd_incidence()
+        cell_adj = self.cell_adj_df.drop_duplicates('Cell_ID', keep='last').set_index('Cell_ID')
+        if cells is None:
+            cells = cell_adj.index[cell_adj['CellDiagnostic'] == 'Anomalous']
+        vue = incidence.factor_vector(cell_adj['VUE_XFactor'])
+        adj = incidence.factor_vector(cell_adj['ADJ_XFactor'])
+        variable = incidence.cell_ids.isin(cells)
+        lower = np.zeros(len(vue))
+        upper = np.full(len(vue), np.inf)
+        if max_relative_change is not None:
+            lower = np.maximum(vue * (1 - max_relative_change), 0)
+            upper = vue * (1 + max_relative_change)
+        mbd_df = self.set_mbd_targets()
+        targets = mbd_df.groupby(gcols, observed=True)['Target'].min()
+        targets = targets.reindex(pd.MultiIndex.from_frame(incidence.keys)).to_numpy(dtype=float)
+        with self.profiler.stage('propose ADJ_XFactor', type(self).__name__) as record:
+            proposed, info = xfs.solve_xfactors(incidence, vue, adj, variable, lower, upper,
+                                                targets * (1 - target_margin))
+            record['rows_out'] = int(variable.sum())
+        proposal = pd.DataFrame({'Cell_ID': incidence.cell_ids[variable],
+                                 'VUE_XFactor': vue[variable],
+                                 'ADJ_XFactor': adj[variable],
+                                 'Proposed_ADJ_XFactor': proposed[variable]})
+        has_target = ~np.isnan(targets)
+        before = self.out_of_target_mbd(
+            self.relative_change(incidence.baseline_sales, incidence.project(adj)), targets)
+        after = self.out_of_target_mbd(
+            self.relative_change(incidence.baseline_sales, incidence.project(proposed)), targets)
+        after = after[has_target] >= 1
+        reachable = np.bincount(incidence.rows, weights=(variable & (vue > 0))[incidence.cols],
+                                minlength=len(incidence))[has_target] > 0
+        print(f'{len(proposal)} ADJ_XFactor values proposed. MBD-categories out of target: '
+              f'{int(before[has_target].sum())} before, {int(after.sum())} after.')
+        if (after & ~reachable).any():
+            print(f'{int((after & ~reachable).sum())} of them have none of the given cells, '
+                  'so the proposal cannot change them.')
+        if (after & reachable).any():
+            print(f'{int((after & reachable).sum())} of them could not be brought within '
+                  'target by changing the given cells (within max_relative_change); their '
+                  'impacts were brought as close to target as possible.')
+        if not info['Converged']:
+            print(f"The proposal did not converge in {info['Iterations']} iterations.")
+        if apply:
+            self.update_adjustments(proposal[['Cell_ID', 'Proposed_ADJ_XFactor']].rename(
+                columns={'Proposed_ADJ_XFactor': 'ADJ_XFactor'}))
+        return proposal
+
+    def sweep_mbd_diagnostics(self,
+                              cell_cat_params: list,
+                              cell_weight_params: list):
+        """
+        Count anomalous MBD-category-cell rows for every combination of impact parameters.
+
+        Args:
+            cell_cat_params (list): Values to evaluate for the cell-category parameter.
+            cell_weight_params (list): Values to evaluate for the cell-weight parameter.
+
+        Returns:
+            pd.DataFrame: One row per parameter combination, with the parameter values and 
+                          the counts:
+                - AnomalousMBDCatCells, MBDCatCells: MBD-category-cell rows, and those 
+                  Anomalous.
+                - OutOfTargetMBDCats, MBDCats: MBD-categories (rows of 
+                  MBDCat_Impacts_v0.csv), and those out of target.
+                - OutOfTargetMBDs, MBDs: Distinct MbdIDs, and those with at least one 
+                  MBD-category out of target.
+
+        Summary:
+            Takes the MBD-category-cell rows from set_mbd_cell_diag(), without writing any 
+            output, and broadcasts CellCatTest over both parameter axes. 
+            OutOfTarget does not depend on any parameter, so the out-of-target counts 
+            are the same for every combination.
+        """
+        mbd_df = self.set_mbd_targets()
+        cell_diag = self.set_mbd_cell_diag()
+        cell_diag = cell_diag.drop(columns=['CellCatTest', 'MBDCatDiag']).drop_duplicates(
+            ignore_index=True)
+        impact = np.abs(cell_diag['ADJ_SalesImpact'].to_numpy())
+        weight = cell_diag['Baseline_CellImportance'].to_numpy()
+        out_of_target = cell_diag['OutOfTarget'].to_numpy() >= 1
+        cc_grid = np.asarray(cell_cat_params, dtype=float).reshape(-1)
+        cw_grid = np.asarray(cell_weight_params, dtype=float).reshape(-1)
+        cc_tests = impact[None, :] >= cc_grid[:, None]
+        cw_tests = weight[None, :] >= cw_grid[:, None]
+        anomalous = ((cc_tests[:, None, :] & cw_tests[None, :, :]) |
+                     out_of_target).sum(axis=-1)
+        mesh = np.meshgrid(cc_grid, cw_grid, indexing='ij')
+        sweep_df = pd.DataFrame({'cell_cat_param': mesh[0].ravel(),
+                                 'cell_weight_param': mesh[1].ravel(),
+                                 'AnomalousMBDCatCells': anomalous.ravel(),
+                                 'MBDCatCells': len(cell_diag),
+                                 **self.count_mbds(mbd_df)})
+        return sweep_df
+
+    def sweep_diagnostics(self,
+                          param_grid: dict):
+        """
+        Evaluate the cell and MBD diagnostics for a grid of parameter values.
+
+        Args:
+            param_grid (dict): Values to evaluate, keyed by parameter name 
+                ('distance_param', 'nspc_param', 'xf_param', 'same_dir_gap_tolerance', 
+                'diff_dir_gap_tolerance', 'cell_cat_param', 'cell_weight_param'). 
+                Parameters not in the grid keep the value of this object.
+
+        Returns:
+            pd.DataFrame: One row per parameter combination, with the anomalous cell, 
+                          anomalous MBD-category-cell, out-of-target MBD-category and 
+                          out-of-target MBD counts (see sweep_mbd_diagnostics).
+
+        Summary:
+            Runs sweep_cell_diagnostics and sweep_mbd_diagnostics once each, reusing the 
+            cached stages of this object, and crosses their results. The cell parameters 
+            do not affect the impacts, so both sweeps are independent.
+        """
+        current = self.get_params()
+        unknown = [key for key in param_grid if key not in current]
+        if len(unknown) > 0:
+            raise ValueError(f'Unknown parameters in param_grid: {unknown}. '
+                             f'The proper parameters are: {list(current)}.')
+        grid = {key: param_grid.get(key, [value]) for key, value in current.items()}
+        cell_sweep = self.xztg.sweep_cell_diagnostics(grid['distance_param'],
+                                                      grid['nspc_param'],
+                                                      grid['xf_param'],
+                                                      grid['same_dir_gap_tolerance'],
+                                                      grid['diff_dir_gap_tolerance'])
+        mbd_sweep = self.sweep_mbd_diagnostics(grid['cell_cat_param'],
+                                               grid['cell_weight_param'])
+        return pd.merge(cell_sweep, mbd_sweep, how='cross')
@@ -0,0 +1,163 @@
+import os
+import time
+import concurrent.futures
+import pandas as pd
+import MBDCatCellImpacts as MBDCCI
+
+"""
+Overall summary:
+Runs the XZTemplate and Impacts scripts (MBDCatCellImpacts.MBDCCImpcts) for
+many markets at once. Each market is a working directory with its own inputs
+and outputs folders, as described in Scripts_instructions.tex. The markets
+are run in parallel worker processes, so a regional refresh takes about as
+long as the slowest market, and a summary with the timings and anomaly counts
+of every market is returned (and optionally saved).
+"""
+
+market_param_names = ['distance_param',
+                      'nspc_param',
+                      'xf_param',
+                      'cell_cat_param',
+                      'cell_weight_param',
+                      'same_dir_gap_tolerance',
+                      'diff_dir_gap_tolerance',
+                      'non_handler_patterns',
+                      'chunksize',
+                      'max_workers',
+                      'profile',
+                      'delta']
+required_param_names = market_param_names[:7]
+
+
+def find_working_dirs(root: str):
+    """
+    List the market working directories under a root directory.
+
+    Args:
+        root (str): A directory whose subdirectories are market working directories.
+
+    Returns:
+        list: The paths of the subdirectories of root with an inputs folder, sorted by name.
+    """
+    return [f'{root}/{name}' for name in sorted(os.listdir(root))
+            if os.path.isdir(f'{root}/{name}/inputs')]
+
+
+def run_market(working_dir: str,
+               params: dict):
+    """
+    Run the full pipeline of one market and summarize it.
+
+    Args:
+        working_dir (str): The market working directory.
+        params (dict): The MBDCCImpcts arguments, keyed by the names in market_param_names.
+
+    Returns:
+        dict: The summary row of the market:
+            - WorkingDir: The market working directory.
+            - Status: 'OK', or 'Failed' if the pipeline raised an error.
+            - Seconds: Wall time of the market.
+            - Cells, AnomalousCells: Rows of XZTemplate_v0.csv, and those diagnosed 'Anomalous'.
+            - MBDCats, OutOfTargetMBDCats: Rows of MBDCat_Impacts_v0.csv, and those out of 
+              target.
+            - MBDs, OutOfTargetMBDs: Distinct MbdIDs, and those with at least one 
+              MBD-category out of target (MBDCCImpcts.count_mbds).
+            - MBDCatCells, AnomalousMBDCatCells: Rows of MBDCatCell_Impacts_v0.csv, and those
+              diagnosed 'Anomalous'. Not counted in streaming mode (chunksize set).
+            - Error: The error message if the market failed.
+
+    Summary:
+        Builds MBDCCImpcts with params, which saves XZTemplate_v0.csv, then saves the
+        MBD outputs with get_mbd_diagnostics(), or with stream_mbd_diagnostics() if
+        params has a chunksize. Errors are caught and reported in the summary row, so
+        one failing market does not stop the others.
+    """
+    summary = {'WorkingDir': working_dir, 'Status': 'OK'}
+    start = time.perf_counter()
+    try:
+        mbdcci = MBDCCI.MBDCCImpcts(working_dir, **params)
+        if mbdcci.chunksize is None:
+            cell_diag = mbdcci.get_mbd_diagnostics()
+            mbd_df = mbdcci.set_mbd_type(save=False)
+        else:
+            cell_diag = None
+            mbd_df = mbdcci.stream_mbd_diagnostics()
+        summary['Cells'] = len(mbdcci.cell_adj_df)
+        summary['AnomalousCells'] = int(
+            (mbdcci.cell_adj_df['CellDiagnostic'] == 'Anomalous').sum())
+        summary.update(mbdcci.count_mbds(mbd_df))
+        if cell_diag is not None:
+            summary['MBDCatCells'] = len(cell_diag)
+            summary['AnomalousMBDCatCells'] = int(
+                (cell_diag['MBDCatDiag'] == 'Anomalous').sum())
+    except Exception as error:
+        summary['Status'] = 'Failed'
+        summary['Error'] = f'{type(error).__name__}: {error}'
+    summary['Seconds'] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def run_markets(working_dirs,
+                params: dict,
+                market_params: dict = None,
+                max_workers: int = None,
+                summary_path: str = None):
+    """
+    Run the full pipeline of several markets in parallel processes.
+
+    Args:
+        working_dirs (list or str): The market working directories, or a root directory
+            whose subdirectories with an inputs folder are the markets (find_working_dirs).
+        params (dict): The MBDCCImpcts arguments shared by all markets, keyed by the names
+            in market_param_names. The first seven are required unless every market sets
+            them in market_params.
+        market_params (dict, optional): Per-market arguments that override params, keyed
+            by working directory. Defaults to None.
+        max_workers (int, optional): The number of worker processes. Defaults to the
+            number of markets, capped at the number of CPUs.
+        summary_path (str, optional): If given, the summary is saved to this CSV path.
+            Defaults to None.
+
+    Returns:
+        pd.DataFrame: One run_market summary row per market, in the order of working_dirs.
+
+    Summary:
+        Each market runs in its own process through run_market, so markets do not share
+        memory or stage caches, and a failing market is reported instead of stopping the
+        batch. The batch takes about as long as its slowest market when there are enough
+        CPUs for all of them.
+    """
+    if isinstance(working_dirs, str):
+        working_dirs = find_working_dirs(working_dirs)
+    market_params = market_params or {}
+    run_params = []
+    for working_dir in working_dirs:
+        market = {**params, **market_params.get(working_dir, {})}
+        unknown = [key for key in market if key not in market_param_names]
+        missing = [key for key in required_param_names if key not in market]
+        if len(unknown) > 0 or len(missing) > 0:
+            raise ValueError(f'Invalid parameters for {working_dir}: unknown {unknown}, '
+                             f'missing {missing}.')
+        run_params.append(market)
+    if max_workers is None:
+        max_workers = max(1, min(len(working_dirs), os.cpu_count() or 1))
+
+    summaries = [None] * len(working_dirs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_market, working_dir, market): i
+                   for i, (working_dir, market) in enumerate(zip(working_dirs, run_params))}
+        for future in concurrent.futures.as_completed(futures):
+            summary = future.result()
+            summaries[futures[future]] = summary
+            print(f"{summary['WorkingDir']}: {summary['Status']} in {summary['Seconds']} s")
+    summary_df = pd.DataFrame(summaries,
+                              columns=['WorkingDir', 'Status', 'Seconds',
+                                       'Cells', 'AnomalousCells',
+                                       'MBDCats', 'OutOfTargetMBDCats',
+                                       'MBDs', 'OutOfTargetMBDs',
+                                       'MBDCatCells', 'AnomalousMBDCatCells',
+                                       'Error'])
+    if summary_path is not None:
+        summary_df.to_csv(summary_path, index=False)
+        print(f'The batch summary has been saved to {summary_path}.')
+    return summary_df
@@ -0,0 +1,200 @@
+import datetime
+import os
+import numpy as np
+import pandas as pd
+
+"""
+Overall summary:
+Optional delta mode for the three _v0.csv outputs. Each output is still
+saved in full (it is the baseline of the next run), but before it is
+overwritten the previous run is kept in memory, and the rows inserted,
+removed or changed between the two runs are written to a
+{output}_delta.csv file next to it. Every run also appends one line per
+output to outputs/changelog.csv with its counts and changed columns, so
+downstream consumers and the macro workbook can apply the patch instead of
+reloading the whole output.
+"""
+
+delta_keys = {'XZTemplate_v0.csv': ['Cell_ID'],
+              'MBDCat_Impacts_v0.csv': ['MbdID', 'CategoryName'],
+              'MBDCatCell_Impacts_v0.csv': ['MbdID', 'CategoryName', 'Cell_ID']}
+
+delta_rtol = 1e-12
+
+changelog_columns = ['Run', 'File', 'Inserted', 'Removed', 'Changed', 'Unchanged',
+                     'ChangedColumns']
+
+
+def read_previous(output_dir: str,
+                  filename: str):
+    """
+    Read the output of the previous run before it is overwritten.
+
+    Args:
+        output_dir (str): The outputs directory path.
+        filename (str): The output file name, a key of delta_keys.
+
+    Returns:
+        pd.DataFrame or None: The previous output, or None if there is none.
+    """
+    path = f'{output_dir}/{filename}'
+    if not os.path.exists(path):
+        return None
+    return pd.read_csv(path)
+
+
+def diff_outputs(previous: pd.DataFrame,
+                 current: pd.DataFrame,
+                 key_cols: list):
+    """
+    Compare two runs of an output row by row.
+
+    Args:
+        previous (pd.DataFrame): The output of the previous run.
+        current (pd.DataFrame): The output of the current run.
+        key_cols (list): The columns identifying a row.
+
+    Returns:
+        tuple: The delta and the changed column names:
+            - pd.DataFrame: A 'Change' column ('inserted', 'removed' or 'changed') followed
+              by the output columns, with the current values (the previous ones for
+              removed rows), sorted by key.
+            - list: The non-key columns with at least one changed value.
+
+    Summary:
+        Rows are matched by key; if a key is repeated, its rows are matched in order of
+        appearance. Missing values are equal to each other, and numbers are equal when
+        they differ by less than delta_rtol relative to each other, so differences in the
+        last digits, such as those of the chunked sums in streaming mode, are not changes.
+        The columns the previous run did not have, or no longer has, count as changed on
+        every matched row.
+    """
+    previous = _keyed(previous, key_cols)
+    current = _keyed(current, key_cols)
+    inserted = current.loc[~current.index.isin(previous.index)]
+    removed = previous.loc[~previous.index.isin(current.index)]
+    common = current.index[current.index.isin(previous.index)]
+    columns = [col for col in current.columns if col in previous.columns]
+    new_values = current.loc[common, columns]
+    old_values = previous.loc[common, columns]
+    differs = (new_values != old_values) & ~(new_values.isna() & old_values.isna())
+    for col in columns:
+        if pd.api.types.is_float_dtype(new_values[col]) \
+                and pd.api.types.is_float_dtype(old_values[col]):
+            differs[col] = ~np.isclose(new_values[col].to_numpy(), old_values[col].to_numpy(),
+                                       rtol=delta_rtol, atol=0, equal_nan=True)
+    changed = differs.any(axis=1).to_numpy().copy()
+    changed_columns = [col for col in columns if differs[col].any()]
+    schema_columns = [col for col in current.columns.append(previous.columns)
+                      if col not in columns]
+    if len(schema_columns) > 0 and len(common) > 0:
+        changed[:] = True
+        changed_columns += schema_columns
+    delta = pd.concat([inserted.assign(Change='inserted'),
+                       removed.assign(Change='removed'),
+                       current.loc[common[changed]].assign(Change='changed')])
+    delta = delta.sort_index(kind='stable').reset_index(drop=False)
+    delta = delta[['Change'] + [col for col in delta.columns
+                                if col not in ['Change', '_Occurrence']]]
+    return delta, changed_columns
+
+
+def _keyed(df: pd.DataFrame,
+           key_cols: list):
+    """
+    Index an output by its key columns and the occurrence number of each key.
+
+    Args:
+        df (pd.DataFrame): The output.
+        key_cols (list): The columns identifying a row.
+
+    Returns:
+        pd.DataFrame: The output without the key columns, indexed by the key columns and
+                      '_Occurrence' (0 unless the key is repeated).
+    """
+    occurrence = df.groupby(key_cols, sort=False, dropna=False).cumcount()
+    return df.assign(_Occurrence=occurrence).set_index(key_cols + ['_Occurrence'])
+
+
+def _as_saved(current: pd.DataFrame,
+              previous: pd.DataFrame = None):
+    """
+    Type an output held in memory as its saved CSV file is read back by read_previous.
+
+    Args:
+        current (pd.DataFrame): The output of the current run.
+        previous (pd.DataFrame, optional): The output of the previous run, as read back.
+
+    Returns:
+        pd.DataFrame: current with its categorical columns turned into their categories' 
+                      type, and its text columns that are numbers in previous parsed as 
+                      numbers, like pd.read_csv does with text IDs such as IBD_ID.
+    """
+    current = current.reset_index(drop=True)
+    for col in current.columns:
+        values = current[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(values.cat.categories.dtype)
+        if previous is not None and col in previous.columns \
+                and pd.api.types.is_numeric_dtype(previous[col]) \
+                and not pd.api.types.is_numeric_dtype(values):
+            try:
+                values = pd.to_numeric(values)
+            except (ValueError, TypeError):
+                pass
+        current[col] = values
+    return current
+
+
+def write_delta(previous: pd.DataFrame,
+                current: pd.DataFrame,
+                output_dir: str,
+                filename: str,
+                run: str = None):
+    """
+    Write the rows of an output that changed since the previous run, and log them.
+
+    Args:
+        previous (pd.DataFrame or None): The previous output, from read_previous. If None,
+            every row of the output is inserted.
+        current (pd.DataFrame or None): The output just saved by the current run. If None,
+            it is read back from {output_dir}/{filename}, for outputs that were written
+            chunk by chunk and are not in memory.
+        output_dir (str): The outputs directory path.
+        filename (str): The output file name, a key of delta_keys.
+        run (str, optional): The run identifier written to the changelog. Defaults to the
+            current time.
+
+    Returns:
+        dict: The changelog line of the output (see changelog_columns).
+
+    Summary:
+        Types current as it would be read back from its CSV file (_as_saved), so both runs 
+        are compared alike, compares it with previous (diff_outputs), writes the delta to
+        {output_dir}/{name}_delta.csv and appends the counts to {output_dir}/changelog.csv.
+    """
+    run = run or datetime.datetime.now().isoformat(timespec='seconds')
+    key_cols = delta_keys[filename]
+    if current is None:
+        current = pd.read_csv(f'{output_dir}/{filename}')
+    current = _as_saved(current, previous)
+    if previous is None:
+        previous = current.iloc[:0]
+    delta, changed_columns = diff_outputs(previous, current, key_cols)
+    delta_name = filename.replace('.csv', '_delta.csv')
+    delta.to_csv(f'{output_dir}/{delta_name}', index=False)
+    counts = delta['Change'].value_counts()
+    log = {'Run': run,
+           'File': filename,
+           'Inserted': int(counts.get('inserted', 0)),
+           'Removed': int(counts.get('removed', 0)),
+           'Changed': int(counts.get('changed', 0)),
+           'Unchanged': len(current) - int(counts.get('inserted', 0))
+           - int(counts.get('changed', 0)),
+           'ChangedColumns': ';'.join(changed_columns)}
+    changelog_path = f'{output_dir}/changelog.csv'
+    pd.DataFrame([log], columns=changelog_columns).to_csv(
+        changelog_path, mode='a', header=not os.path.exists(changelog_path), index=False)
+    print(f"{delta_name} has been saved to the outputs directory: {log['Inserted']} "
+          f"inserted, {log['Removed']} removed and {log['Changed']} changed rows.")
+    return log
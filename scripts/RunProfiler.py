@@ -0,0 +1,210 @@
+import contextlib
+import datetime
+import json
+import time
+import tracemalloc
+import pandas as pd
+
+"""
+Overall summary:
+Optional instrumentation of a template run. When enabled, every cleaning step
+of InputsPreCleaning.CleaningInputs, every XZTGenerator.XZTG and
+MBDCatCellImpacts.MBDCCImpcts stage, and every output file written is
+recorded with its wall time, peak memory, and the rows it took in and gave
+out, including the rows dropped by each inner merge. The records are saved
+as a JSON report (run_report.json) next to the outputs.
+"""
+
+
+class RunProfiler:
+    """
+    Records the time, memory and row counts of the stages of a run.
+
+    Attributes:
+        enabled (bool): Whether anything is recorded. A disabled profiler costs nothing.
+        records (list): One dict per finished stage, in the order they finished:
+            - stage, component: The stage name and the class that ran it.
+            - seconds: Wall time, including the upstream stages it had to compute.
+            - self_seconds: Wall time excluding the nested stages.
+            - peak_memory_mb: Peak memory traced by tracemalloc during the stage.
+            - peak_increase_mb: That peak minus the memory traced when the stage started.
+            - rows_in: Rows of each upstream stage result or input the stage read.
+            - rows_out: Rows of the stage result.
+            - merges: One entry per inner merge, with the rows on each side, the rows
+              out, and the left and right rows dropped because their key had no match.
+              A merge run once per partition or chunk is one entry whose counts are the
+              sums over its calls.
+
+    Memory is traced with tracemalloc, which slows allocation-heavy code down;
+    enable the profiler to investigate a run, not for every run.
+    """
+
+    def __init__(self,
+                 enabled: bool = True):
+        """
+        Initialize the RunProfiler object.
+
+        Args:
+            enabled (bool, optional): Whether to record the run. Defaults to True.
+
+        Summary:
+            Starts tracemalloc if the profiler is enabled and it is not tracing yet.
+        """
+        self.enabled = enabled
+        self.records = []
+        self._stack = []
+        self._start = time.perf_counter()
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self,
+              name: str,
+              component: str):
+        """
+        Record the block of code run inside the context as a stage.
+
+        Args:
+            name (str): The stage name.
+            component (str): The class or module running the stage.
+
+        Yields:
+            dict: The record of the stage, where the caller can set 'rows_out'.
+
+        Summary:
+            Stages can be nested: the time and memory peak of a nested stage also count
+            for the stages it runs in, and its time is excluded from their self_seconds.
+        """
+        if not self.enabled:
+            yield {}
+            return
+        self._fold_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        record = {'stage': name,
+                  'component': component,
+                  'seconds': None,
+                  'self_seconds': None,
+                  'peak_memory_mb': None,
+                  'peak_increase_mb': None,
+                  'rows_in': {},
+                  'rows_out': None,
+                  'merges': []}
+        frame = {'record': record,
+                 'start': time.perf_counter(),
+                 'start_memory': current,
+                 'child_seconds': 0.0,
+                 'peak': current}
+        self._stack.append(frame)
+        try:
+            yield record
+        finally:
+            self._stack.pop()
+            seconds = time.perf_counter() - frame['start']
+            peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            record['seconds'] = round(seconds, 4)
+            record['self_seconds'] = round(seconds - frame['child_seconds'], 4)
+            record['peak_memory_mb'] = round(peak / 2**20, 2)
+            record['peak_increase_mb'] = round((peak - frame['start_memory']) / 2**20, 2)
+            self.records.append(record)
+            if len(self._stack) > 0:
+                parent = self._stack[-1]
+                parent['child_seconds'] += seconds
+                parent['peak'] = max(parent['peak'], peak)
+            tracemalloc.reset_peak()
+
+    def _fold_peak(self):
+        """
+        Keep the memory peak reached so far by the running stage before it is reset.
+        """
+        if len(self._stack) > 0:
+            frame = self._stack[-1]
+            frame['peak'] = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+
+    def record_input(self,
+                     name: str,
+                     rows: int):
+        """
+        Record the rows of an input read by the running stage.
+
+        Args:
+            name (str): The name of the input, e.g. the upstream stage.
+            rows (int): The number of rows of the input.
+        """
+        if self.enabled and len(self._stack) > 0:
+            self._stack[-1]['record']['rows_in'][name] = rows
+
+    def record_merge(self,
+                     name: str,
+                     left: pd.DataFrame,
+                     right: pd.DataFrame,
+                     result: pd.DataFrame,
+                     on,
+                     right_on=None):
+        """
+        Record an inner merge of the running stage.
+
+        Args:
+            name (str): The name of the right side, e.g. 'Cells_LastPeriod.csv'.
+            left (pd.DataFrame): The left DataFrame of the merge.
+            right (pd.DataFrame): The right DataFrame of the merge, with the key columns.
+            result (pd.DataFrame): The merged DataFrame.
+            on (str or list): The key columns.
+            right_on (str or list, optional): The key columns of right, if they are named 
+                differently. Defaults to on.
+
+        Summary:
+            Counts the left and right rows whose key has no match on the other side,
+            which the inner merge dropped. Merges recorded under the same name in the
+            same stage, such as the merges of each partition or chunk, are added up;
+            'calls' counts them, and the right side counts are summed over the calls too.
+        """
+        if not self.enabled or len(self._stack) == 0:
+            return
+        on = [on] if isinstance(on, str) else list(on)
+        right_on = on if right_on is None else \
+            [right_on] if isinstance(right_on, str) else list(right_on)
+        left_keys = pd.MultiIndex.from_frame(left[on])
+        right_keys = pd.MultiIndex.from_frame(right[right_on].set_axis(on, axis=1))
+        counts = {'calls': 1,
+                  'left_rows': len(left),
+                  'right_rows': len(right),
+                  'rows_out': len(result),
+                  'left_rows_dropped': int((~left_keys.isin(right_keys)).sum()),
+                  'right_rows_dropped': int((~right_keys.isin(left_keys)).sum())}
+        merges = self._stack[-1]['record']['merges']
+        for merge in merges:
+            if merge['merge'] == name:
+                for count, value in counts.items():
+                    merge[count] += value
+                return
+        merges.append({'merge': name, 'on': on, **counts})
+
+    def write(self,
+              path: str,
+              working_dir: str):
+        """
+        Save the recorded stages as a JSON report.
+
+        Args:
+            path (str): The report path, e.g. {output_dir}/run_report.json.
+            working_dir (str): The working directory of the run.
+
+        Summary:
+            Does nothing if the profiler is disabled. The report has the creation time,
+            the working directory, the seconds since the profiler was created and the
+            stage records, slowest self_seconds first.
+        """
+        if not self.enabled:
+            return
+        report = {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                  'working_dir': working_dir,
+                  'total_seconds': round(time.perf_counter() - self._start, 4),
+                  'stages': sorted(self.records,
+                                   key=lambda record: record['self_seconds'], reverse=True)}
+        with open(path, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f'The run report has been saved to {path}.')
+
+
+disabled = RunProfiler(enabled=False)
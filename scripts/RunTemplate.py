@@ -0,0 +1,317 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import sys
+import time
+
+"""
+Overall summary:
+Command line entry point of the XZTemplate and Impacts scripts, for
+scheduled or server runs without a notebook. The working directory and the
+seven diagnostic parameters are given as flags, or in a JSON config file
+whose values the flags override, e.g.:
+    python RunTemplate.py --working-dir /data/CO_CERVEZAS --distance-param 3 \
+        --nspc-param 0.15 --xf-param 0.05 --cell-cat-param 0.2 \
+        --cell-weight-param 0.1 --same-dir-gap-tolerance 0.1 \
+        --diff-dir-gap-tolerance 0.05
+    python RunTemplate.py --config CO_CERVEZAS.json --cell-cat-param 0.3
+pandas and the template scripts are only imported once the arguments are
+valid, so --help and argument errors return at once. The exit status tells
+a scheduler how the run ended (see exit_codes).
+"""
+
+param_names = ['distance_param',
+               'nspc_param',
+               'xf_param',
+               'cell_cat_param',
+               'cell_weight_param',
+               'same_dir_gap_tolerance',
+               'diff_dir_gap_tolerance']
+cell_param_names = ['distance_param',
+                    'nspc_param',
+                    'xf_param',
+                    'same_dir_gap_tolerance',
+                    'diff_dir_gap_tolerance']
+option_names = ['non_handler_patterns',
+                'chunksize',
+                'max_workers',
+                'profile',
+                'delta',
+                'workbook',
+                'cells_only']
+
+option_types = {'non_handler_patterns': list,
+                'chunksize': int,
+                'max_workers': int,
+                'profile': bool,
+                'delta': bool,
+                'workbook': str,
+                'cells_only': bool}
+
+exit_codes = {'ok': 0,
+              'failed': 1,
+              'usage': 2,
+              'invalid_inputs': 3,
+              'missing_files': 4}
+
+
+def build_parser():
+    """
+    Build the command line parser.
+
+    Returns:
+        argparse.ArgumentParser: The parser. Options left out are None (or False), so the
+                                 config file values can fill them.
+    """
+    parser = argparse.ArgumentParser(
+        description='Run the XZTemplate and Impacts diagnostics of a market.',
+        epilog='Exit status: ' + ', '.join(f'{code} {name}'
+                                           for name, code in exit_codes.items()) + '.')
+    parser.add_argument('--config', help='JSON file with any of the options below, keyed by '
+                                         'their names with underscores (e.g. working_dir).')
+    parser.add_argument('--working-dir', help='Market directory with the inputs and outputs '
+                                              'folders.')
+    params = parser.add_argument_group('diagnostic parameters (required, from the flags '
+                                       'or the config file)')
+    params.add_argument('--distance-param', type=float,
+                        help='VUE XZ distance range to flag when exceeded.')
+    params.add_argument('--nspc-param', type=float,
+                        help='Max abs relative change of NSPC at cell level.')
+    params.add_argument('--xf-param', type=float,
+                        help='Max abs relative change of XFactor at cell level.')
+    params.add_argument('--cell-cat-param', type=float,
+                        help='Max abs relative change of Sales at MBD-cell-category level.')
+    params.add_argument('--cell-weight-param', type=float,
+                        help='Min sales weight of a cell in its MBD-category.')
+    params.add_argument('--same-dir-gap-tolerance', type=float,
+                        help='Gap tolerance of XUniverse and ZUniverse variations in the '
+                             'same direction.')
+    params.add_argument('--diff-dir-gap-tolerance', type=float,
+                        help='Gap tolerance of XUniverse and ZUniverse variations in '
+                             'different directions.')
+    options = parser.add_argument_group('run options')
+    options.add_argument('--non-handler-patterns', nargs='+',
+                         help='Cell name fragments of non-handler cells.')
+    options.add_argument('--chunksize', type=int,
+                         help='Stream VUE_Impacts.csv in chunks of this many rows.')
+    options.add_argument('--max-workers', type=int,
+                         help='Threads for the partitioned stages.')
+    options.add_argument('--profile', action='store_true', default=None,
+                         help='Save outputs/run_report.json.')
+    options.add_argument('--delta', action='store_true', default=None,
+                         help='Save the rows changed since the previous run.')
+    options.add_argument('--workbook',
+                         help='Macro workbook (.xlsm) to copy and fill in the outputs folder.')
+    options.add_argument('--cells-only', action='store_true', default=None,
+                         help='Only run the cell diagnostics (XZTemplate_v0.csv).')
+    options.add_argument('--quiet', action='store_true',
+                         help='Only print the run summary.')
+    return parser
+
+
+def coerce_param(name: str,
+                 value):
+    """
+    Check the type of a parameter or option, converting it where it is unambiguous.
+
+    Args:
+        name (str): The parameter name, 'working_dir' or one of param_names and 
+            option_names.
+        value: The value, from the config file or the command line.
+
+    Returns:
+        The value as a finite float for param_names, and as the type of option_types 
+        for the options: an int of at least 1 for chunksize and max_workers, a list of 
+        strings for non_handler_patterns. Numbers given as JSON strings, e.g. "0.3", are 
+        converted.
+
+    Raises:
+        ValueError: If the value has the wrong type or cannot be converted.
+    """
+    expected = float if name in param_names else option_types.get(name, str)
+    try:
+        if expected is bool:
+            if not isinstance(value, bool):
+                raise ValueError('it must be true or false')
+        elif expected is list:
+            if not isinstance(value, list) or \
+                    not all(isinstance(item, str) for item in value):
+                raise ValueError('it must be a list of strings')
+        elif expected is str:
+            if not isinstance(value, str):
+                raise ValueError('it must be a string')
+        elif isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError('it must be a number')
+        elif expected is float:
+            value = float(value)
+            if not math.isfinite(value):
+                raise ValueError('it must be finite')
+        else:
+            number = float(value)
+            if not number.is_integer() or number < 1:
+                raise ValueError('it must be a whole number of at least 1')
+            value = int(number)
+    except ValueError as error:
+        raise ValueError(f'Invalid {name} {value!r}: {error}.') from None
+    return value
+
+
+def resolve_params(args: argparse.Namespace):
+    """
+    Combine the config file and the command line flags.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+        dict: working_dir, the diagnostic parameters and the options that were set.
+
+    Raises:
+        ValueError: If the config file has unknown keys, if a value has the wrong type 
+            (coerce_param), if the working directory or a required parameter is missing, 
+            or if cells_only is combined with workbook or chunksize, which only apply to 
+            the MBD diagnostics.
+    """
+    params = {}
+    if args.config is not None:
+        with open(args.config) as config_file:
+            params = json.load(config_file)
+        unknown = [key for key in params
+                   if key not in ['working_dir'] + param_names + option_names]
+        if len(unknown) > 0:
+            raise ValueError(f'Unknown keys in {args.config}: {unknown}.')
+    for name in ['working_dir'] + param_names + option_names:
+        value = getattr(args, name)
+        if value is not None:
+            params[name] = value
+    params = {name: coerce_param(name, value) for name, value in params.items()
+              if value is not None}
+    required = ['working_dir'] + (cell_param_names if params.get('cells_only')
+                                  else param_names)
+    missing = [name for name in required if params.get(name) is None]
+    if len(missing) > 0:
+        raise ValueError('Missing parameters: '
+                         + ', '.join('--' + name.replace('_', '-') for name in missing) + '.')
+    if params.get('cells_only'):
+        ignored = [name for name in ['workbook', 'chunksize'] if name in params]
+        if len(ignored) > 0:
+            raise ValueError('--cells-only cannot be combined with '
+                             + ', '.join('--' + name for name in ignored) + '.')
+    return params
+
+
+def run(params: dict):
+    """
+    Run the diagnostics of a market.
+
+    Args:
+        params (dict): The parameters returned by resolve_params.
+
+    Returns:
+        dict: The run summary: the working directory, the seconds taken, the number of cells
+              and anomalous cells, and (unless cells_only) the MBD-category and MBD counts 
+              of MBDCCImpcts.count_mbds.
+
+    Summary:
+        With cells_only, only XZTG runs and saves XZTemplate_v0.csv. Otherwise MBDCCImpcts
+        saves the three outputs, streaming VUE_Impacts.csv if a chunksize is given, and
+        fills a copy of the workbook if one is given.
+    """
+    start = time.perf_counter()
+    working_dir = params['working_dir']
+    if not os.path.isdir(f'{working_dir}/inputs'):
+        raise FileNotFoundError(f'{working_dir}/inputs does not exist.')
+    os.makedirs(f'{working_dir}/outputs', exist_ok=True)
+    summary = {'WorkingDir': working_dir}
+    if params.get('cells_only'):
+        import RunProfiler as rprof
+        import XZTGenerator as XZTGen
+        profiler = rprof.RunProfiler(enabled=bool(params.get('profile')))
+        xztg = XZTGen.XZTG(working_dir, params.get('non_handler_patterns'),
+                           params.get('max_workers') or 1, profiler,
+                           bool(params.get('delta')))
+        cells_df = xztg.get_cell_diagnostics(*[params[name] for name in cell_param_names])
+    else:
+        import MBDCatCellImpacts as MBDCCI
+        mbdcci = MBDCCI.MBDCCImpcts(working_dir,
+                                    *[params[name] for name in param_names],
+                                    non_handler_patterns=params.get('non_handler_patterns'),
+                                    chunksize=params.get('chunksize'),
+                                    max_workers=params.get('max_workers') or 1,
+                                    profile=bool(params.get('profile')),
+                                    delta=bool(params.get('delta')))
+        if mbdcci.chunksize is None:
+            mbdcci.get_mbd_diagnostics()
+            mbd_df = mbdcci.set_mbd_type(save=False)
+        else:
+            mbd_df = mbdcci.stream_mbd_diagnostics()
+        if params.get('workbook') is not None:
+            mbdcci.export_workbook(params['workbook'])
+        cells_df = mbdcci.cell_adj_df
+        summary.update(mbdcci.count_mbds(mbd_df))
+    summary['Cells'] = len(cells_df)
+    summary['AnomalousCells'] = int((cells_df['CellDiagnostic'] == 'Anomalous').sum())
+    summary['Seconds'] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def error_exit_code(error: Exception):
+    """
+    Map an error raised by a run to its exit status.
+
+    Args:
+        error (Exception): The error.
+
+    Returns:
+        int: missing_files for a missing file or directory, invalid_inputs for the 
+             InvalidInputError raised by the input checks (wrong file names, columns or 
+             values, or a wrong workbook), failed otherwise, including the other 
+             ValueError and KeyError, which are bugs rather than bad inputs.
+    """
+    import InputsPreCleaning as ipc
+    if isinstance(error, FileNotFoundError):
+        return exit_codes['missing_files']
+    if isinstance(error, ipc.InvalidInputError):
+        return exit_codes['invalid_inputs']
+    return exit_codes['failed']
+
+
+def main(argv: list = None):
+    """
+    Run the command line entry point.
+
+    Args:
+        argv (list, optional): The arguments. Defaults to sys.argv[1:].
+
+    Returns:
+        int: The exit status, one of exit_codes:
+            - ok: The outputs were saved.
+            - failed: An unexpected error stopped the run.
+            - usage: The arguments or the config file are invalid.
+            - invalid_inputs: The input files have wrong names, columns or values.
+            - missing_files: The working directory, an input file or the workbook is missing.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        params = resolve_params(args)
+    except (OSError, ValueError) as error:
+        print(f'{parser.prog}: error: {error}', file=sys.stderr)
+        return exit_codes['usage']
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log) if args.quiet else contextlib.nullcontext():
+            summary = run(params)
+    except Exception as error:
+        sys.stderr.write(log.getvalue())
+        print(f'{type(error).__name__}: {error}', file=sys.stderr)
+        return error_exit_code(error)
+    print(json.dumps(summary))
+    return exit_codes['ok']
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+import numpy as np
+import pandas as pd
+
+try:
+    import scipy.sparse as sp
+    sparse_backend = 'scipy'
+except ImportError:
+    sparse_backend = 'numpy'
+
+"""
+Overall summary:
+Sparse MBD-category by cell incidence of the unprojected sales. Each row is
+an MBD-category (the grouping keys of MBDCCImpcts.set_mbd_impacts), each
+column a Cell_ID, and each value the sum of Baseline_Sales / BAU_XFactor of
+the VUE impact rows of that MBD-category and cell. The projected sales of
+every MBD-category under an X-Factor vector are then one sparse
+matrix-vector product, so new ADJ_XFactor values are evaluated for all the
+MBDs at once without joining and grouping the impact rows again.
+The product uses scipy.sparse when scipy is installed, and a numpy
+bincount over the non-zero entries otherwise.
+"""
+
+mbd_key_cols = ['MbdID', 'MbdName', 'CategoryCode', 'CategoryName']
+
+
+class SparseMatrix:
+    """
+    A sparse matrix stored as its non-zero entries.
+
+    Attributes:
+        rows (np.ndarray): The row of each non-zero entry.
+        cols (np.ndarray): The column of each non-zero entry.
+        values (np.ndarray): The value of each non-zero entry; repeated positions add up.
+        shape (tuple): The number of rows and columns.
+        matrix (scipy.sparse.csr_matrix): The matrix, if scipy is installed, else None.
+
+    Products use scipy.sparse when it is installed and a numpy bincount over the 
+    entries otherwise, so memory and time grow with the non-zero entries only.
+    """
+
+    def __init__(self,
+                 rows: np.ndarray,
+                 cols: np.ndarray,
+                 values: np.ndarray,
+                 shape: tuple):
+        self.rows = rows
+        self.cols = cols
+        self.values = values
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.matrix = None
+        if sparse_backend == 'scipy':
+            self.matrix = sp.csr_matrix((values, (rows, cols)), shape=self.shape)
+
+    def dot(self,
+            vector: np.ndarray):
+        """
+        Multiply the matrix by a vector.
+
+        Args:
+            vector (np.ndarray): One value per column. A 2-D array of shape (columns, k) 
+                multiplies k vectors at once.
+
+        Returns:
+            np.ndarray: One value per row, of shape (rows,) or (rows, k).
+        """
+        if self.matrix is not None:
+            return self.matrix @ vector
+        if vector.ndim == 1:
+            return np.bincount(self.rows, weights=self.values * vector[self.cols],
+                               minlength=self.shape[0])
+        return np.column_stack([self.dot(vector[:, k]) for k in range(vector.shape[1])])
+
+    def dot_transpose(self,
+                      vector: np.ndarray):
+        """
+        Multiply the transposed matrix by a vector.
+
+        Args:
+            vector (np.ndarray): One value per row.
+
+        Returns:
+            np.ndarray: One value per column.
+        """
+        if self.matrix is not None:
+            return self.matrix.T @ vector
+        return np.bincount(self.cols, weights=self.values * vector[self.rows],
+                           minlength=self.shape[1])
+
+    def squared_norms(self,
+                      axis: int):
+        """
+        Compute the squared Euclidean norm of every row or column.
+
+        Args:
+            axis (int): 1 for the rows, 0 for the columns.
+
+        Returns:
+            np.ndarray: The squared norm of each row (axis 1) or column (axis 0).
+        """
+        index = self.rows if axis == 1 else self.cols
+        return np.bincount(index, weights=self.values ** 2, minlength=self.shape[1 - axis])
+
+    def select(self,
+               row_mask: np.ndarray,
+               col_mask: np.ndarray):
+        """
+        Take the submatrix of some rows and columns.
+
+        Args:
+            row_mask (np.ndarray): Boolean mask of the rows to keep.
+            col_mask (np.ndarray): Boolean mask of the columns to keep.
+
+        Returns:
+            SparseMatrix: The submatrix, with its rows and columns numbered in order.
+        """
+        keep = row_mask[self.rows] & col_mask[self.cols]
+        return SparseMatrix((np.cumsum(row_mask) - 1)[self.rows[keep]],
+                            (np.cumsum(col_mask) - 1)[self.cols[keep]],
+                            self.values[keep],
+                            (row_mask.sum(), col_mask.sum()))
+
+
+class SalesIncidence(SparseMatrix):
+    """
+    The unprojected sales of each MBD-category and cell, as a sparse matrix.
+
+    Attributes:
+        keys (pd.DataFrame): The mbd_key_cols of each row, sorted as a groupby sorts them.
+        cell_ids (pd.Index): The Cell_ID of each column.
+        baseline_sales (np.ndarray): The Baseline_Sales sum of each row.
+        rows, cols, values, shape, matrix: The entries, as in SparseMatrix; each value 
+            is the unprojected sales of an MBD-category and cell.
+
+    The incidence only depends on the impact rows and their BAU_XFactor, so ADJ
+    edits and parameter changes do not change it. It is never modified after it
+    is built: copy() returns the object itself, which lets pipeline_stage cache
+    it like a DataFrame stage result.
+    """
+
+    def __init__(self,
+                 impact_df: pd.DataFrame):
+        """
+        Initialize the SalesIncidence object.
+
+        Args:
+            impact_df (pd.DataFrame): Cell impacts, as returned by
+                MBDCCImpcts.set_cell_impacts, with the mbd_key_cols, Cell_ID,
+                Baseline_Sales and UnprojectedSales columns.
+
+        Summary:
+            Numbers the MBD-categories as groupby(mbd_key_cols).sum() orders them and the
+            cells in order of appearance, then adds up the UnprojectedSales of the impact
+            rows sharing an MBD-category and a cell into one entry.
+        """
+        grouped = impact_df.groupby(mbd_key_cols, observed=True)
+        row_codes = grouped.ngroup().to_numpy()
+        baseline = grouped['Baseline_Sales'].sum()
+        self.keys = baseline.index.to_frame(index=False)
+        self.baseline_sales = baseline.to_numpy()
+        col_codes, self.cell_ids = pd.factorize(impact_df['Cell_ID'])
+        entries = pd.DataFrame({'row': row_codes,
+                                'col': col_codes,
+                                'value': impact_df['UnprojectedSales'].to_numpy()})
+        entries = entries.groupby(['row', 'col'], sort=True).sum().reset_index()
+        super().__init__(entries['row'].to_numpy(),
+                         entries['col'].to_numpy(),
+                         entries['value'].to_numpy(),
+                         (len(self.keys), len(self.cell_ids)))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def copy(self):
+        return self
+
+    def factor_vector(self,
+                      factors: pd.Series):
+        """
+        Align X-Factors to the columns of the incidence.
+
+        Args:
+            factors (pd.Series): X-Factors indexed by Cell_ID. Every cell of the incidence
+                must be in the index; other cells are ignored, and the last X-Factor of a 
+                repeated Cell_ID is kept.
+
+        Returns:
+            np.ndarray: The X-Factor of each column. NaN X-Factors are set to 0, so those 
+                        cells add no projected sales, as the groupby sum of the cell 
+                        projected sales skips them (see MBDCCImpcts._sum_mbd_sales).
+
+        Raises:
+            ValueError: If cells of the incidence are missing from the index of factors.
+        """
+        factors = factors[~factors.index.duplicated(keep='last')]
+        missing = ~self.cell_ids.isin(factors.index)
+        if missing.any():
+            print('The following Cell_IDs have impacts but no X-Factor:')
+            for cell_id in self.cell_ids[missing][:10]:
+                print('\t', cell_id)
+            raise ValueError('Please give an X-Factor for every cell with impacts.')
+        vector = factors.reindex(self.cell_ids).to_numpy(dtype=float)
+        return np.where(np.isnan(vector), 0.0, vector)
+
+    def project(self,
+                factors: np.ndarray):
+        """
+        Compute the projected sales of every MBD-category.
+
+        Args:
+            factors (np.ndarray): The X-Factor of each column (see factor_vector). A 2-D
+                array of shape (cells, k) projects k X-Factor vectors at once.
+
+        Returns:
+            np.ndarray: The projected sales of each row, of shape (rows,) or (rows, k).
+        """
+        return self.dot(factors)
+
+    def project_transpose(self,
+                          row_values: np.ndarray):
+        """
+        Multiply the transposed incidence by a vector over the MBD-categories.
+
+        Args:
+            row_values (np.ndarray): One value per row, e.g. a weight per MBD-category.
+
+        Returns:
+            np.ndarray: For each column, the sum over its rows of the unprojected sales 
+                        times the row value.
+        """
+        return self.dot_transpose(row_values)
@@ -0,0 +1,200 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import platform
+import shutil
+import time
+import numpy as np
+import pandas as pd
+import InputsPreCleaning as ipc
+import MBDCatCellImpacts as MBDCCI
+import SyntheticInputs as SI
+
+"""
+Overall summary:
+Times the cleaning step and every stage of XZTGenerator.XZTG and
+MBDCatCellImpacts.MBDCCImpcts on synthetic markets of increasing size
+(SyntheticInputs.py), from 500 cells to 500k cells and tens of millions of
+impact rows. The timings are written to a JSON file together with the
+scaling exponent of each stage between consecutive sizes: an exponent close
+to 1 means the stage grows linearly with the data, close to 2 quadratically.
+Run from the scripts folder, e.g.:
+    python ScalingBenchmark.py --root C:/benchmarks --sizes xs s m
+"""
+
+benchmark_sizes = {'xs': {'n_cells': 500, 'n_mbds': 500, 'n_categories': 1,
+                          'cells_per_mbd': 25},
+                   's': {'n_cells': 5_000, 'n_mbds': 2_000, 'n_categories': 2,
+                         'cells_per_mbd': 50},
+                   'm': {'n_cells': 50_000, 'n_mbds': 10_000, 'n_categories': 4,
+                         'cells_per_mbd': 100},
+                   'l': {'n_cells': 200_000, 'n_mbds': 20_000, 'n_categories': 6,
+                         'cells_per_mbd': 100},
+                   'xl': {'n_cells': 500_000, 'n_mbds': 40_000, 'n_categories': 8,
+                          'cells_per_mbd': 100}}
+
+benchmark_params = {'distance_param': 3,
+                    'nspc_param': 0.15,
+                    'xf_param': 0.05,
+                    'cell_cat_param': 0.2,
+                    'cell_weight_param': 0.1,
+                    'same_dir_gap_tolerance': 0.1,
+                    'diff_dir_gap_tolerance': 0.05}
+
+xztg_stages = ['set_bau_cells',
+               'set_vue_cells',
+               'set_dummy_calc',
+               'set_cell_area_channel_weights',
+               'set_cell_area_channel_weight_diff',
+               'set_bau_vue_averages']
+
+mbd_stages = ['set_cell_impacts',
+              'set_mbd_impacts',
+              'set_mbd_nd',
+              'set_mbd_targets',
+              'set_mbd_cell_diag']
+
+
+def time_market(working_dir: str,
+                params: dict = None):
+    """
+    Time the cleaning step and each pipeline stage on one market.
+
+    Args:
+        working_dir (str): The market working directory, with raw inputs and no clean cache.
+        params (dict, optional): The MBDCCImpcts parameters. Defaults to benchmark_params.
+
+    Returns:
+        dict: Seconds taken by each step, keyed by step name, in pipeline order.
+
+    Summary:
+        The stages are memoized, so calling them one by one in pipeline order times
+        each stage alone: its upstream stages are already cached. The cleaning step
+        is timed on its own first, and the steps that save outputs are timed last,
+        when every stage they use is cached. The messages printed by the scripts
+        are suppressed.
+    """
+    params = params or benchmark_params
+    timings = {}
+
+    def timed(step, func, *args):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = func(*args)
+        timings[step] = round(time.perf_counter() - start, 4)
+        return result
+
+    timed('clean_inputs', ipc.CleaningInputs(working_dir).get_clean_csvs)
+    mbdcci = timed('load_inputs', MBDCCI.MBDCCImpcts, working_dir,
+                   *[params[name] for name in benchmark_params])
+    xztg = mbdcci.xztg
+    xztg.invalidate()
+    for stage in xztg_stages:
+        timed(stage, getattr(xztg, stage))
+    cell_params = [params[name] for name in ['distance_param', 'nspc_param', 'xf_param',
+                                             'same_dir_gap_tolerance',
+                                             'diff_dir_gap_tolerance']]
+    timed('set_cell_flags', xztg.set_cell_flags, *cell_params)
+    timed('save_cell_diagnostics', xztg.get_cell_diagnostics, *cell_params)
+    mbdcci.invalidate()
+    for stage in mbd_stages:
+        timed(stage, getattr(mbdcci, stage))
+    timed('save_mbd_diagnostics', mbdcci.get_mbd_diagnostics)
+    return timings
+
+
+def scaling_exponents(results: list):
+    """
+    Estimate how the time of each step grows with the number of impact rows.
+
+    Args:
+        results (list): The benchmark results of run_benchmark, sorted by size.
+
+    Returns:
+        dict: For each step, the list of log(t2 / t1) / log(n2 / n1) exponents between
+              consecutive sizes, where n is the number of VUE_Impacts rows (NaN if a
+              time is too small to measure).
+    """
+    exponents = {}
+    for small, large in zip(results[:-1], results[1:]):
+        rows_ratio = np.log(large['impact_rows'] / small['impact_rows'])
+        for step, seconds in large['seconds'].items():
+            small_seconds = small['seconds'].get(step, 0)
+            exponent = np.log(seconds / small_seconds) / rows_ratio \
+                if small_seconds >= 1e-3 and seconds > 0 else np.nan
+            exponents.setdefault(step, []).append(round(float(exponent), 3))
+    return exponents
+
+
+def run_benchmark(root: str,
+                  sizes: list = None,
+                  results_path: str = None,
+                  keep_data: bool = False,
+                  seed: int = 0):
+    """
+    Generate synthetic markets of increasing size and time the pipeline on each.
+
+    Args:
+        root (str): A scratch directory; each size is generated in {root}/{size}.
+        sizes (list, optional): Keys of benchmark_sizes to run. Defaults to all of them.
+        results_path (str, optional): The JSON results path. Defaults to
+            {root}/benchmark_results.json.
+        keep_data (bool, optional): Whether to keep the generated markets. Defaults to
+            False, which deletes each one after it is timed.
+        seed (int, optional): Seed of the synthetic data. Defaults to 0.
+
+    Returns:
+        dict: The results saved to results_path:
+            - created, python, pandas, platform: When and where the benchmark ran.
+            - params: The MBDCCImpcts parameters used.
+            - results: One entry per size with its name, generator arguments, row counts
+              of each input file, impact_rows, and the seconds of each step (time_market).
+            - scaling_exponents: The exponents of scaling_exponents(results).
+    """
+    sizes = sizes or list(benchmark_sizes)
+    results_path = results_path or f'{root}/benchmark_results.json'
+    results = []
+    for size in sizes:
+        working_dir = f'{root}/{size}'
+        shutil.rmtree(working_dir, ignore_errors=True)
+        print(f'Generating the {size} market...')
+        rows = SI.generate_inputs(working_dir, seed=seed, **benchmark_sizes[size])
+        print(f'Timing the {size} market ({rows["VUE_Impacts.csv"]} impact rows)...')
+        seconds = time_market(working_dir)
+        results.append({'size': size,
+                        'generator': benchmark_sizes[size],
+                        'rows': rows,
+                        'impact_rows': rows['VUE_Impacts.csv'],
+                        'seconds': seconds})
+        print(f'{size}: {round(sum(seconds.values()), 2)} s')
+        if not keep_data:
+            shutil.rmtree(working_dir, ignore_errors=True)
+    results.sort(key=lambda result: result['impact_rows'])
+    report = {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(),
+              'pandas': pd.__version__,
+              'platform': platform.platform(),
+              'params': benchmark_params,
+              'results': results,
+              'scaling_exponents': scaling_exponents(results)}
+    with open(results_path, 'w') as results_file:
+        json.dump(report, results_file, indent=2)
+    print(f'The benchmark results have been saved to {results_path}.')
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the template scripts on synthetic '
+                                                 'markets of increasing size.')
+    parser.add_argument('--root', required=True,
+                        help='Scratch directory for the synthetic markets.')
+    parser.add_argument('--sizes', nargs='+', choices=list(benchmark_sizes),
+                        help='Sizes to run (default: all).')
+    parser.add_argument('--output', help='JSON results path '
+                                         '(default: {root}/benchmark_results.json).')
+    parser.add_argument('--keep-data', action='store_true',
+                        help='Keep the generated markets.')
+    args = parser.parse_args()
+    run_benchmark(args.root, args.sizes, args.output, args.keep_data)
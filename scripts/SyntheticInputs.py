@@ -0,0 +1,218 @@
+import os
+import numpy as np
+import pandas as pd
+
+"""
+Overall summary:
+Writes synthetic, mutually consistent versions of the six input CSV files
+(Cells_Chars.csv, Cells_LastPeriod.csv, VUE_SampleNSPC.csv, MBD_NumDist.csv,
+MBD_TypeTarget.csv and VUE_Impacts.csv) to the inputs folder of a working
+directory, with the same columns and value formats as the VUE exports. The
+sizes (cells, MBDs, categories, area-channels and cells per MBD) are
+configurable, so the scripts can be run and timed on markets of any size
+(see ScalingBenchmark.py).
+"""
+
+store_type_channels = ['Autoservicios', 'Consumo Local', 'Tradicionales']
+
+mbd_type_targets = {'TOTAL COUNTRY': 0.04,
+                    'MAJOR': 0.1,
+                    'MINOR': 0.15,
+                    'VERY MINOR': 0.2}
+
+first_cell_id = 10_000_000
+first_mbd_id = 20_000_000
+first_category_code = 143_606_380
+impact_block_rows = 1_000_000
+
+
+def generate_inputs(working_dir: str,
+                    n_cells: int = 500,
+                    n_mbds: int = 500,
+                    n_categories: int = 1,
+                    n_areas: int = 8,
+                    n_channels: int = 3,
+                    cells_per_mbd: int = 25,
+                    non_handler_share: float = 0.1,
+                    seed: int = 0):
+    """
+    Write synthetic input files to {working_dir}/inputs.
+
+    Args:
+        working_dir (str): The working directory; its inputs and outputs folders are created.
+        n_cells (int, optional): Number of cells. Defaults to 500.
+        n_mbds (int, optional): Number of MBDs. Defaults to 500.
+        n_categories (int, optional): Number of categories; every MBD is reported in all
+            of them. Defaults to 1.
+        n_areas (int, optional): Number of Nielsen areas. Defaults to 8.
+        n_channels (int, optional): Number of store type channels, at most
+            len(store_type_channels). Defaults to 3.
+        cells_per_mbd (int, optional): Cells of each MBD-category, at most n_cells.
+            Defaults to 25.
+        non_handler_share (float, optional): Share of cells named as non-handlers.
+            Defaults to 0.1.
+        seed (int, optional): Seed of the random generator. Defaults to 0.
+
+    Returns:
+        dict: The number of rows written to each file, keyed by file name.
+
+    Summary:
+        Cells are spread over the n_areas * n_channels area-channels. The VUE universes,
+        panels and factors vary randomly around the last period ones, so some cells are
+        flagged as anomalous. VUE_Impacts.csv has n_mbds * n_categories * cells_per_mbd
+        rows and is written in blocks, so tens of millions of rows can be generated
+        without holding them in memory.
+    """
+    if n_channels > len(store_type_channels):
+        raise ValueError(f'n_channels must be at most {len(store_type_channels)}.')
+    if cells_per_mbd > n_cells:
+        raise ValueError('cells_per_mbd must be at most n_cells.')
+    rng = np.random.default_rng(seed)
+    input_dir = f'{working_dir}/inputs'
+    os.makedirs(input_dir, exist_ok=True)
+    os.makedirs(f'{working_dir}/outputs', exist_ok=True)
+
+    cell_ids = first_cell_id + np.arange(n_cells)
+    areas = rng.integers(0, n_areas, n_cells) + 1
+    channels = rng.integers(0, n_channels, n_cells)
+    store_types = rng.integers(0, 4, n_cells) + 1
+    non_handler = rng.random(n_cells) < non_handler_share
+    area_names = np.array([f'{area}:area_{area}' for area in range(1, n_areas + 1)])
+    channel_names = np.array(store_type_channels[:n_channels])
+    cell_names = np.array([f"{cell_id}_AREA{area}_{channel_names[channel].upper().replace(' ', '_')}"
+                           f"{'_NM' if is_non_handler else ''}"
+                           for cell_id, area, channel, is_non_handler
+                           in zip(cell_ids, areas, channels, non_handler)])
+    rows = {}
+
+    cells_chars = pd.DataFrame({'INDEX': 'SYNTHETIC',
+                                'CHANNEL': 'MONT',
+                                'SAMPLE': '20000211',
+                                'Cell_ID': cell_ids,
+                                'StoreTypeChannel': channel_names[channels],
+                                'NielsenArea': area_names[areas - 1],
+                                'StoreType': [f'{store_type}:store_type_{store_type}'
+                                              for store_type in store_types]})
+    rows['Cells_Chars.csv'] = _write(cells_chars, input_dir, 'Cells_Chars.csv')
+
+    bau_x_panel = rng.integers(50, 20_000, n_cells)
+    bau_z_panel = rng.integers(1, 50, n_cells)
+    bau_x_universe = np.round(bau_x_panel * rng.uniform(5, 150, n_cells))
+    bau_z_universe = np.round(bau_z_panel * rng.uniform(2, 20, n_cells))
+    cells_lastperiod = pd.DataFrame({'Period': 1327,
+                                     'Cell_ID': cell_ids,
+                                     'Cell_Name': cell_names,
+                                     'XPanel': bau_x_panel,
+                                     'ZPanel': bau_z_panel,
+                                     'XUniverse': bau_x_universe,
+                                     'ZUniverse': bau_z_universe,
+                                     'XFactor': np.round(bau_x_universe / bau_x_panel, 4),
+                                     'ZFactor': np.round(bau_z_universe / bau_z_panel, 4),
+                                     'Condition': 'ZZZZZZ'})
+    rows['Cells_LastPeriod.csv'] = _write(cells_lastperiod, input_dir,
+                                          'Cells_LastPeriod.csv')
+
+    vue_x_panel = np.maximum(1, np.round(bau_x_panel * rng.normal(1, 0.02, n_cells)))
+    vue_z_panel = np.maximum(1, np.round(bau_z_panel * rng.normal(1, 0.05, n_cells)))
+    vue_x_universe = np.round(bau_x_universe * rng.normal(1, 0.03, n_cells))
+    vue_z_universe = np.round(bau_z_universe * rng.normal(1, 0.03, n_cells))
+    vue_x_factor = np.round(vue_x_universe / vue_x_panel, 4)
+    vue_z_factor = np.round(vue_z_universe / vue_z_panel, 4)
+    ibd_ids = first_mbd_id + 200_000 + (areas - 1) * n_channels + channels
+    vue_samplenspc = pd.DataFrame({'Period': 1327,
+                                   'Period_Nm': '202405',
+                                   'Sample_ID': 0,
+                                   'Sample_Nm': np.nan,
+                                   'Cell ID': cell_ids,
+                                   'Cell_Name': cell_names,
+                                   'Cell_Condition': [f"CO_CELL = '{cell_id}'"
+                                                      for cell_id in cell_ids],
+                                   'X Universe': vue_x_universe,
+                                   'Z Universe': vue_z_universe,
+                                   'X Panel': vue_x_panel,
+                                   'Z Panel': vue_z_panel,
+                                   'X Factor': vue_x_factor,
+                                   'Z Factor': vue_z_factor,
+                                   'XZ_Ratio': vue_x_factor / vue_z_factor,
+                                   'IBD ID': ibd_ids,
+                                   'IBD Name': [f'{ibd_id} SYNTHETIC IBD'
+                                                for ibd_id in ibd_ids]})
+    rows['VUE_SampleNSPC.csv'] = _write(vue_samplenspc, input_dir, 'VUE_SampleNSPC.csv')
+
+    mbd_ids = first_mbd_id + np.arange(n_mbds)
+    mbd_names = pd.Series([f'SYNTHETIC MBD {mbd}' for mbd in range(n_mbds)])
+    category_names = pd.Series([f'CATEGORY {category}' for category in range(n_categories)])
+    mbd_types = pd.Series(list(mbd_type_targets))[
+        rng.integers(0, len(mbd_type_targets), n_mbds)].reset_index(drop=True)
+    mbd_typetarget = pd.DataFrame({'MbdID': mbd_ids,
+                                   'INDEX': 'SYNTHETIC',
+                                   'MbdName': mbd_names,
+                                   'MBD Type': mbd_types,
+                                   'Target': mbd_types.map(mbd_type_targets)})
+    rows['MBD_TypeTarget.csv'] = _write(mbd_typetarget, input_dir, 'MBD_TypeTarget.csv')
+
+    mbd_numdist = pd.DataFrame({'MbdID': np.repeat(mbd_ids, n_categories),
+                                'INDEX': 'SYNTHETIC',
+                                'MbdName': np.repeat(mbd_names.to_numpy(), n_categories),
+                                'CategoryName': np.tile(category_names.to_numpy(), n_mbds),
+                                'Numerical Distribution': rng.uniform(
+                                    0.05, 0.95, n_mbds * n_categories).round(4)})
+    rows['MBD_NumDist.csv'] = _write(mbd_numdist, input_dir, 'MBD_NumDist.csv')
+
+    rows['VUE_Impacts.csv'] = 0
+    groups_per_block = max(1, impact_block_rows // cells_per_mbd)
+    n_groups = n_mbds * n_categories
+    stride = max(1, n_cells // cells_per_mbd)
+    for start in range(0, n_groups, groups_per_block):
+        groups = np.arange(start, min(start + groups_per_block, n_groups))
+        offsets = rng.integers(0, n_cells, len(groups))
+        cell_pos = (offsets[:, None] + np.arange(cells_per_mbd) * stride) % n_cells
+        cell_pos = cell_pos.ravel()
+        mbd_pos = np.repeat(groups // n_categories, cells_per_mbd)
+        category_pos = np.repeat(groups % n_categories, cells_per_mbd)
+        sales = np.round(rng.lognormal(13, 1.5, len(cell_pos)), 4)
+        group_sales = np.repeat(sales.reshape(-1, cells_per_mbd).sum(axis=1), cells_per_mbd)
+        nspc_sales = np.round(sales * rng.normal(1, 0.02, len(cell_pos)), 4)
+        impacts = pd.DataFrame({'PeriodId': 1327,
+                                'PeriodName': '202405',
+                                'ReportingGroupID': 1,
+                                'ReportingGroupName': 'Reported Group 1',
+                                'MbdOrder': mbd_pos + 1,
+                                'MbdID': mbd_ids[mbd_pos],
+                                'MbdName': mbd_names.to_numpy()[mbd_pos],
+                                'Cell_ID': cell_ids[cell_pos],
+                                'CellName': cell_names[cell_pos],
+                                'CategoryCode': first_category_code + category_pos,
+                                'CategoryName': category_names.to_numpy()[category_pos],
+                                'ProductSegmentLevel': 'CAT',
+                                'productsegmentname': category_names.to_numpy()[category_pos],
+                                'Baseline_Sales': sales,
+                                'Baseline_CellImportance': np.round(sales / group_sales, 4),
+                                'NSPC_W1_Sales': nspc_sales,
+                                'NSPC_W1_Baseline_Impact': np.round(nspc_sales / sales - 1, 4),
+                                'NSPC_W1_CellImportance': np.round(sales / group_sales, 4)})
+        rows['VUE_Impacts.csv'] += _write(impacts, input_dir, 'VUE_Impacts.csv',
+                                          append=start > 0)
+    return rows
+
+
+def _write(df: pd.DataFrame,
+           input_dir: str,
+           filename: str,
+           append: bool = False):
+    """
+    Write a synthetic input DataFrame as a CSV file.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to write.
+        input_dir (str): The inputs directory path.
+        filename (str): The name of the input file.
+        append (bool, optional): Whether to append to the file without a header.
+            Defaults to False.
+
+    Returns:
+        int: The number of rows written.
+    """
+    df.to_csv(f'{input_dir}/{filename}', mode='a' if append else 'w',
+              header=not append, index=False)
+    return len(df)
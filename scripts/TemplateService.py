@@ -0,0 +1,368 @@
+import http.server
+import json
+import sys
+import time
+import urllib.parse
+import pandas as pd
+import MBDCatCellImpacts as MBDCCI
+import RunTemplate as rt
+
+"""
+Overall summary:
+Resident local service for analysts iterating on a market. It loads the
+market once (an MBDCCImpcts object, whose XZTG and impacts stages stay
+cached in memory) and answers JSON requests over HTTP on localhost, e.g.:
+    python TemplateService.py --working-dir /data/CO_CERVEZAS --config market.json
+    curl -X POST localhost:8765/diagnostics -d '{"params": {"cell_cat_param": 0.3}}'
+    curl -X POST localhost:8765/adjustments \
+        -d '{"changes": [{"Cell_ID": 10003436, "ADJ_XFactor": 1.5}]}'
+Parameter changes and ADJ edits only recompute the test columns and the
+cells and MBDs they touch (MBDCCImpcts.update_params and
+update_adjustments), so a request takes a fraction of a full run. Nothing
+is written to the outputs directory until /save is requested.
+
+Endpoints:
+    GET  /status       The summary of the current diagnostics and parameters
+                       (/status?details=1 for the details).
+    POST /diagnostics  {"params": {...}, "details": bool} Re-run the diagnostics
+                       with the given parameters.
+    POST /adjustments  {"changes": [{"Cell_ID": ..., "ADJ_XFactor": ...,
+                       "ADJ_XUniverse": ...}], "details": bool} Apply ADJ edits.
+    POST /save         Save the three outputs (and the deltas, with --delta).
+    POST /reload       Reload the inputs, e.g. after they were replaced.
+With "details": true, the response also lists the anomalous Cell_IDs and the
+out-of-target (MbdID, CategoryName) keys. MBDs are counted by distinct MbdID;
+MBDCats counts the MBD-categories.
+"""
+
+default_host = '127.0.0.1'
+default_port = 8765
+true_flags = ['1', 'true', 'yes']
+
+
+def parse_flag(value):
+    """
+    Read a boolean request option, from the JSON body or the query string.
+
+    Args:
+        value: The option value: a JSON bool, or a string such as '1' or 'false' from
+            the query string. None when the option was not given.
+
+    Returns:
+        bool: JSON bools as they are; strings are true if they are one of true_flags
+              (case-insensitive), so 'details=0' or 'details=false' are false.
+    """
+    if value is None or isinstance(value, bool):
+        return bool(value)
+    return str(value).strip().lower() in true_flags
+
+
+class TemplateService:
+    """
+    Keeps a market loaded and serves diagnostic requests on it.
+
+    Attributes:
+        working_dir (str): The working directory of the market.
+        options (dict): The MBDCCImpcts keyword options (non_handler_patterns,
+            max_workers, profile, delta).
+        mbdcci (MBDCCI.MBDCCImpcts): The loaded market, with its cached stages.
+        loaded (str): When the inputs were loaded.
+
+    Requests are handled one at a time, so they never see a half-updated market.
+    """
+
+    def __init__(self,
+                 working_dir: str,
+                 params: dict,
+                 **options):
+        """
+        Initialize the TemplateService object.
+
+        Args:
+            working_dir (str): The working directory of the market.
+            params (dict): The seven diagnostic parameters, keyed by their MBDCCImpcts
+                argument names (see RunTemplate.param_names).
+            **options: Keyword options passed on to MBDCCImpcts. chunksize is not
+                allowed, since a streamed market is not kept in memory.
+
+        Summary:
+            Loads the market and computes its diagnostics once, so the first request
+            is as fast as the next ones.
+        """
+        if options.get('chunksize') is not None:
+            raise ValueError('The service keeps VUE_Impacts.csv in memory; '
+                             'chunksize cannot be set.')
+        self.working_dir = working_dir
+        self.options = options
+        self.load(params)
+
+    def load(self,
+             params: dict):
+        """
+        Load the market inputs and compute the diagnostics, without saving them.
+
+        Args:
+            params (dict): The seven diagnostic parameters.
+        """
+        self.mbdcci = MBDCCI.MBDCCImpcts(self.working_dir,
+                                         *[params[name] for name in rt.param_names],
+                                         save=False, **self.options)
+        self.mbdcci.set_mbd_cell_diag()
+        self.loaded = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+    def summary(self,
+                details: bool = False):
+        """
+        Summarize the current diagnostics.
+
+        Args:
+            details (bool, optional): Whether to list the anomalous cells and the
+                out-of-target MBD-categories. Defaults to False.
+
+        Returns:
+            dict: The parameters and the cell, anomalous cell, MBD-category-cell and 
+                  anomalous MBD-category-cell counts, with the MBD-category and MBD counts 
+                  of MBDCCImpcts.count_mbds. With details, also 'AnomalousCellIDs' and 
+                  'OutOfTargetMBDCatKeys'.
+        """
+        cells_df = self.mbdcci.cell_adj_df
+        mbd_df = self.mbdcci.set_mbd_targets()
+        cell_diag = self.mbdcci.set_mbd_cell_diag()
+        anomalous = cells_df['CellDiagnostic'] == 'Anomalous'
+        out_of_target = mbd_df['OutOfTarget'] >= 1
+        summary = {'WorkingDir': self.working_dir,
+                   'Loaded': self.loaded,
+                   'Params': self.mbdcci.get_params(),
+                   'Cells': len(cells_df),
+                   'AnomalousCells': int(anomalous.sum()),
+                   **self.mbdcci.count_mbds(mbd_df),
+                   'MBDCatCells': len(cell_diag),
+                   'AnomalousMBDCatCells': int((cell_diag['MBDCatDiag'] == 'Anomalous').sum())}
+        if details:
+            summary['AnomalousCellIDs'] = cells_df.loc[anomalous, 'Cell_ID'].tolist()
+            summary['OutOfTargetMBDCatKeys'] = mbd_df.loc[
+                out_of_target, ['MbdID', 'CategoryName']].astype(str).values.tolist()
+        return summary
+
+    def status(self,
+               request: dict):
+        """
+        Summarize the current diagnostics without changing them.
+
+        Args:
+            request (dict): Optionally 'details'.
+
+        Returns:
+            dict: The summary of the current diagnostics.
+        """
+        return self.summary(parse_flag(request.get('details')))
+
+    def diagnose(self,
+                 request: dict):
+        """
+        Re-run the diagnostics with new parameters.
+
+        Args:
+            request (dict): 'params', the parameters to change (see
+                MBDCCImpcts.get_params), and optionally 'details'.
+
+        Returns:
+            dict: The summary of the new diagnostics.
+        """
+        self.mbdcci.update_params(request.get('params', {}))
+        return self.summary(parse_flag(request.get('details')))
+
+    def adjust(self,
+               request: dict):
+        """
+        Apply ADJ_XFactor / ADJ_XUniverse edits.
+
+        Args:
+            request (dict): 'changes', a list of {'Cell_ID', 'ADJ_XFactor',
+                'ADJ_XUniverse'} records (either ADJ column can be left out), and
+                optionally 'details'.
+
+        Returns:
+            dict: The summary of the updated diagnostics, with 'UpdatedMBDCatCells', the
+                  number of MBD-category-cell rows recomputed.
+        """
+        changes = pd.DataFrame.from_records(request.get('changes', []))
+        updated = self.mbdcci.update_adjustments(changes)
+        summary = self.summary(parse_flag(request.get('details')))
+        summary['UpdatedMBDCatCells'] = None if updated is None else len(updated)
+        return summary
+
+    def save(self,
+             request: dict):
+        """
+        Save the current diagnostics to the outputs directory.
+
+        Args:
+            request (dict): Unused.
+
+        Returns:
+            dict: The summary of the saved diagnostics.
+        """
+        self.mbdcci.xztg.get_cell_diagnostics(*[self.mbdcci.get_params()[name]
+                                                for name in rt.cell_param_names])
+        self.mbdcci.get_mbd_diagnostics()
+        return self.summary()
+
+    def reload(self,
+               request: dict):
+        """
+        Reload the market inputs, keeping the current parameters.
+
+        Args:
+            request (dict): Unused.
+
+        Returns:
+            dict: The summary of the reloaded diagnostics.
+        """
+        self.load(self.mbdcci.get_params())
+        return self.summary()
+
+
+class ServiceHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Routes the HTTP requests to the TemplateService of the server.
+
+    Responses are JSON: the result of the service method with status 200, or
+    {'error': message} with status 400 for invalid requests (bad JSON, unknown
+    parameters or columns, Cell_IDs or values the service rejects), 404 for unknown
+    paths and 500 for unexpected errors, which leave the service running.
+    """
+
+    get_routes = {'/status': 'status'}
+    post_routes = {'/diagnostics': 'diagnose',
+                   '/adjustments': 'adjust',
+                   '/save': 'save',
+                   '/reload': 'reload'}
+
+    def do_GET(self):
+        self._handle(self.get_routes)
+
+    def do_POST(self):
+        self._handle(self.post_routes)
+
+    def _handle(self,
+                routes: dict):
+        """
+        Run the service method of the request path and send its result.
+
+        Args:
+            routes (dict): Maps the paths of the request method to service method names.
+        """
+        url = urllib.parse.urlparse(self.path)
+        if url.path not in routes:
+            self._send(404, {'error': f'Unknown path {url.path}.'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError('The request body must be a JSON object.')
+            request.update(urllib.parse.parse_qsl(url.query))
+            start = time.perf_counter()
+            response = getattr(self.server.service, routes[url.path])(request)
+            response['Seconds'] = round(time.perf_counter() - start, 4)
+        except (ValueError, KeyError, TypeError) as error:
+            self._send(400, {'error': f'{type(error).__name__}: {error}'})
+            return
+        except Exception as error:
+            self._send(500, {'error': f'{type(error).__name__}: {error}'})
+            return
+        self._send(200, response)
+
+    def _send(self,
+              status: int,
+              body: dict):
+        """
+        Send a JSON response.
+
+        Args:
+            status (int): The HTTP status code.
+            body (dict): The response body.
+        """
+        payload = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        sys.stderr.write(f'{self.address_string()} - {format % args}\n')
+
+
+def make_server(service: TemplateService,
+                host: str = default_host,
+                port: int = default_port):
+    """
+    Create the HTTP server of a service.
+
+    Args:
+        service (TemplateService): The loaded service.
+        host (str, optional): The address to listen on. Defaults to localhost only.
+        port (int, optional): The port to listen on; 0 picks a free one. Defaults to
+            default_port.
+
+    Returns:
+        http.server.HTTPServer: The server, not started yet. Call serve_forever() to
+            start it (in a thread, for tests) and shutdown() to stop it.
+    """
+    server = http.server.HTTPServer((host, port), ServiceHandler)
+    server.service = service
+    return server
+
+
+def main(argv: list = None):
+    """
+    Run the service from the command line.
+
+    Args:
+        argv (list, optional): The arguments, those of RunTemplate.py plus --host and
+            --port. Defaults to sys.argv[1:].
+
+    Returns:
+        int: The exit status, one of RunTemplate.exit_codes; the service runs until it
+             is interrupted (Ctrl+C), which returns ok.
+    """
+    parser = rt.build_parser()
+    parser.description = 'Keep a market loaded and serve diagnostic requests on localhost.'
+    parser.add_argument('--host', default=default_host,
+                        help=f'Address to listen on. Defaults to {default_host}.')
+    parser.add_argument('--port', type=int, default=default_port,
+                        help=f'Port to listen on. Defaults to {default_port}.')
+    args = parser.parse_args(argv)
+    try:
+        params = rt.resolve_params(args)
+        unsupported = [name for name in ['chunksize', 'workbook', 'cells_only']
+                       if params.get(name)]
+        if len(unsupported) > 0:
+            raise ValueError(f'Options not supported by the service: {unsupported}.')
+    except (OSError, ValueError) as error:
+        print(f'{parser.prog}: error: {error}', file=sys.stderr)
+        return rt.exit_codes['usage']
+    options = {name: params[name] for name in ['non_handler_patterns', 'max_workers',
+                                               'profile', 'delta'] if name in params}
+    try:
+        service = TemplateService(params['working_dir'],
+                                  {name: params[name] for name in rt.param_names},
+                                  **options)
+    except Exception as error:
+        print(f'{type(error).__name__}: {error}', file=sys.stderr)
+        return rt.error_exit_code(error)
+    server = make_server(service, args.host, args.port)
+    print(f'Serving {params["working_dir"]} on http://{args.host}:{server.server_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return rt.exit_codes['ok']
+
+
+if __name__ == '__main__':
+    sys.exit(main())
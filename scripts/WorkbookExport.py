@@ -0,0 +1,411 @@
+import os
+import re
+import zipfile
+import xml.sax.saxutils
+import numpy as np
+import pandas as pd
+import InputsPreCleaning as ipc
+
+"""
+Overall summary:
+Writes the CellAdj (XZTemplate_v0) and Impacts (MBDCatCell_Impacts_v0)
+results straight into the sheets of a copy of the LatAM_XZ_Distance macro
+workbook (.xlsm), so the analysts do not have to import the CSV outputs by
+hand. The workbook is edited as the zip of XML parts it is: only the XML of
+the filled sheets is regenerated, in bulk, and every other part (the VBA
+project, the pivot tables, the styles, the other sheets) is copied
+unchanged. The pivot tables built on the filled sheets are pointed at the
+new data range and refreshed when the workbook is opened.
+"""
+
+header_aliases = {'Num Dist': 'Numerical Distribution'}
+
+export_block_rows = 50_000
+
+_illegal_xml_chars = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def export_workbook(template_path: str,
+                    output_path: str,
+                    sheets: dict):
+    """
+    Write DataFrames into the sheets of a copy of a macro workbook.
+
+    Args:
+        template_path (str): The .xlsm workbook to copy, e.g. 'LatAM_XZ_Distance (Third_Deliver).xlsm'.
+        output_path (str): The path of the filled copy. Must differ from template_path.
+        sheets (dict): The DataFrame to write in each sheet, keyed by sheet name, e.g.
+            {'CellAdj': cell_adj_df, 'Impacts': cell_diag}.
+
+    Returns:
+        dict: The number of data rows written to each sheet.
+
+    Raises:
+        ValueError: If output_path is template_path.
+        InputsPreCleaning.InvalidInputError: If a sheet is missing from the workbook.
+
+    Summary:
+        The first row of each sheet is kept as its header, and the DataFrame columns are
+        written under the header cell of the same name (see header_aliases); header cells
+        with no matching column, such as 'Comments', are left empty. All the rows below
+        the header are replaced.
+
+    Step-by-step:
+    1. Locate the XML part of each sheet through the workbook relationships.
+    2. For each sheet, read its header row and column styles, and write the header row
+       followed by the DataFrame rows, built column by column in blocks of
+       export_block_rows rows, streaming them into the new part.
+    3. Point the autoFilter and the pivot caches of each filled sheet at its new data
+       range, and make the pivot caches refresh when the workbook is opened.
+    4. Drop the calculation chain, which Excel rebuilds, since it may reference cells
+       that no longer exist.
+    5. Copy every other part unchanged, including the VBA project.
+    """
+    if os.path.abspath(template_path) == os.path.abspath(output_path):
+        raise ValueError('The filled workbook must be saved to a different path '
+                         'than the template.')
+    with zipfile.ZipFile(template_path) as template:
+        parts = template.namelist()
+        sheet_parts = _sheet_parts(template)
+        missing = [sheet for sheet in sheets if sheet not in sheet_parts]
+        if len(missing) > 0:
+            print(f'The workbook {template_path} does not have the sheets:')
+            for sheet in missing:
+                print('\t', sheet)
+            raise ipc.InvalidInputError('Please check the workbook template.')
+        shared_strings = _shared_strings(template)
+        layouts = {sheet_parts[sheet]: _sheet_layout(
+            sheet, template.read(sheet_parts[sheet]).decode('utf-8'), df, shared_strings)
+            for sheet, df in sheets.items()}
+        ranges = {sheet: layouts[sheet_parts[sheet]]['range'] for sheet in sheets}
+        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as output:
+            for part in parts:
+                if part == 'xl/calcChain.xml':
+                    continue
+                if part in layouts:
+                    sheet = [name for name in sheets if sheet_parts[name] == part][0]
+                    _write_sheet(output, part, template.read(part).decode('utf-8'),
+                                 sheets[sheet], layouts[part])
+                    continue
+                data = template.read(part)
+                if part.startswith('xl/pivotCache/pivotCacheDefinition') \
+                        and part.endswith('.xml'):
+                    data = _update_pivot_cache(data.decode('utf-8'), ranges).encode('utf-8')
+                elif part == 'xl/workbook.xml':
+                    data = _update_filter_names(data.decode('utf-8'), ranges).encode('utf-8')
+                elif part == 'xl/_rels/workbook.xml.rels':
+                    data = re.sub(r'<Relationship [^>]*Target="calcChain\.xml"[^>]*/>', '',
+                                  data.decode('utf-8')).encode('utf-8')
+                elif part == '[Content_Types].xml':
+                    data = re.sub(r'<Override [^>]*PartName="/xl/calcChain\.xml"[^>]*/>', '',
+                                  data.decode('utf-8')).encode('utf-8')
+                output.writestr(template.getinfo(part), data)
+    print(f'The workbook has been saved to {output_path}.')
+    return {sheet: len(df) for sheet, df in sheets.items()}
+
+
+def _sheet_parts(template: zipfile.ZipFile):
+    """
+    Map the sheet names of a workbook to their XML parts.
+
+    Args:
+        template (zipfile.ZipFile): The open workbook.
+
+    Returns:
+        dict: The part path of each worksheet, e.g. {'CellAdj': 'xl/worksheets/sheet5.xml'}.
+    """
+    workbook = template.read('xl/workbook.xml').decode('utf-8')
+    rels = template.read('xl/_rels/workbook.xml.rels').decode('utf-8')
+    targets = {}
+    for relationship in re.findall(r'<Relationship [^>]*/>', rels):
+        rel_id = re.search(r'Id="([^"]*)"', relationship).group(1)
+        target = re.search(r'Target="([^"]*)"', relationship).group(1)
+        targets[rel_id] = target.lstrip('/') if target.startswith('/') else f'xl/{target}'
+    sheet_parts = {}
+    for sheet in re.findall(r'<sheet [^>]*/>', workbook):
+        name = xml.sax.saxutils.unescape(re.search(r' name="([^"]*)"', sheet).group(1),
+                                         {'&quot;': '"', '&apos;': "'"})
+        rel_id = re.search(r' r:id="([^"]*)"', sheet).group(1)
+        sheet_parts[name] = targets[rel_id]
+    return sheet_parts
+
+
+def _shared_strings(template: zipfile.ZipFile):
+    """
+    Read the shared strings of a workbook.
+
+    Args:
+        template (zipfile.ZipFile): The open workbook.
+
+    Returns:
+        list: The shared strings, in index order.
+    """
+    if 'xl/sharedStrings.xml' not in template.namelist():
+        return []
+    strings = template.read('xl/sharedStrings.xml').decode('utf-8')
+    return [xml.sax.saxutils.unescape(''.join(re.findall(r'<t[^>]*>([^<]*)</t>', item)))
+            for item in re.findall(r'<si>(.*?)</si>', strings, re.S)]
+
+
+def column_letter(position: int):
+    """
+    Convert a 0-based column position to its Excel letters.
+
+    Args:
+        position (int): The column position, 0 for column A.
+
+    Returns:
+        str: The column letters, e.g. 'A', 'Z', 'AA'.
+    """
+    letters = ''
+    position += 1
+    while position > 0:
+        position, remainder = divmod(position - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _column_position(letters: str):
+    """
+    Convert Excel column letters to a 0-based column position.
+
+    Args:
+        letters (str): The column letters, e.g. 'A', 'AA'.
+
+    Returns:
+        int: The column position, 0 for column A.
+    """
+    position = 0
+    for letter in letters:
+        position = position * 26 + ord(letter) - 64
+    return position - 1
+
+
+def _header(sheet_xml: str,
+            shared_strings: list):
+    """
+    Read the header row of a sheet.
+
+    Args:
+        sheet_xml (str): The sheet XML.
+        shared_strings (list): The shared strings of the workbook.
+
+    Returns:
+        tuple: The XML of the first row (or '' if the sheet is empty), and the header
+               names keyed by column position.
+    """
+    first_row = re.search(r'<row [^>]*?r="1"[^>]*?(?:/>|>.*?</row>)', sheet_xml, re.S)
+    if first_row is None:
+        return '', {}
+    names = {}
+    for ref, attrs, inner in re.findall(r'<c r="([A-Z]+)1"([^>]*?)(?:/>|>(.*?)</c>)',
+                                        first_row.group(0), re.S):
+        if 't="s"' in attrs:
+            value = re.search(r'<v>([^<]*)</v>', inner)
+            name = shared_strings[int(value.group(1))] if value else None
+        else:
+            name = ''.join(re.findall(r'<t[^>]*>([^<]*)</t>', inner or '')) or None
+            name = xml.sax.saxutils.unescape(name) if name else None
+        if name is not None:
+            names[_column_position(ref)] = name.strip()
+    return first_row.group(0), names
+
+
+def _column_styles(sheet_xml: str):
+    """
+    Read the default style of each column of a sheet.
+
+    Args:
+        sheet_xml (str): The sheet XML.
+
+    Returns:
+        dict: The style index of each styled column, keyed by column position.
+    """
+    styles = {}
+    for col in re.findall(r'<col [^>]*/>', sheet_xml):
+        style = re.search(r' style="(\d+)"', col)
+        if style is None:
+            continue
+        first = int(re.search(r' min="(\d+)"', col).group(1))
+        last = int(re.search(r' max="(\d+)"', col).group(1))
+        for position in range(first - 1, min(last, 16_384)):
+            styles[position] = style.group(1)
+    return styles
+
+
+def _cell_values(values: pd.Series):
+    """
+    Convert a column to the XML of its cells, without the cell reference.
+
+    Args:
+        values (pd.Series): The column values.
+
+    Returns:
+        tuple: The cell type attribute (' t="b"', ' t="inlineStr"' or '') and a Series
+               with the inner XML of each cell, None for missing values.
+
+    Summary:
+        Booleans are written as Excel booleans and numbers as numbers. Text columns whose
+        values are all numbers are written as numbers too, as Excel does when it opens
+        the CSV outputs; other text is written as inline strings.
+    """
+    if pd.api.types.is_bool_dtype(values):
+        return ' t="b"', values.map({True: '<v>1</v>', False: '<v>0</v>'})
+    if not pd.api.types.is_numeric_dtype(values):
+        text = values.astype(object).where(values.notna())
+        numbers = pd.to_numeric(text, errors='coerce')
+        if numbers.notna().sum() == text.notna().sum() and text.notna().any():
+            values = numbers
+        else:
+            text = text.astype(str).str.replace(_illegal_xml_chars, '', regex=True)
+            text = text.map(xml.sax.saxutils.escape, na_action='ignore')
+            return ' t="inlineStr"', ('<is><t xml:space="preserve">' + text
+                                      + '</t></is>').where(values.notna())
+    if pd.api.types.is_integer_dtype(values):
+        return '', ('<v>' + values.astype(str) + '</v>').where(values.notna())
+    values = values.astype(float)
+    numbers = values.astype(str).str.removesuffix('.0')
+    return '', ('<v>' + numbers + '</v>').where(np.isfinite(values))
+
+
+def _sheet_layout(sheet: str,
+                  sheet_xml: str,
+                  df: pd.DataFrame,
+                  shared_strings: list):
+    """
+    Match the columns of a DataFrame to the header of a sheet.
+
+    Args:
+        sheet (str): The sheet name.
+        sheet_xml (str): The XML of the sheet in the template.
+        df (pd.DataFrame): The rows to write.
+        shared_strings (list): The shared strings of the workbook.
+
+    Returns:
+        dict: The layout of the filled sheet:
+            - header_row: The XML of the header row. A sheet without header gets the
+              DataFrame column names.
+            - columns: (position, column) pairs of the columns to write, in sheet order.
+            - range: The range of the data with its header, e.g. 'A1:U11833'.
+    """
+    header_row, header = _header(sheet_xml, shared_strings)
+    positions = {header_aliases.get(name, name): position
+                 for position, name in header.items()}
+    unmatched = [col for col in df.columns if col not in positions]
+    if len(header) == 0:
+        positions = {col: position for position, col in enumerate(df.columns)}
+        names = ''.join(f'<c r="{column_letter(position)}1" t="inlineStr"><is><t>'
+                        f'{xml.sax.saxutils.escape(str(col))}</t></is></c>'
+                        for col, position in positions.items())
+        header_row = f'<row r="1">{names}</row>'
+    elif len(unmatched) > 0:
+        print(f'The following columns have no header in the {sheet} sheet '
+              'and were not written:')
+        for col in unmatched:
+            print('\t', col)
+    columns = sorted((position, col) for col, position in positions.items()
+                     if col in df.columns)
+    last_position = max([position for position, _ in columns] + list(header) + [0])
+    return {'header_row': header_row,
+            'columns': columns,
+            'range': f'A1:{column_letter(last_position)}{len(df) + 1}'}
+
+
+def _write_sheet(output: zipfile.ZipFile,
+                 part: str,
+                 sheet_xml: str,
+                 df: pd.DataFrame,
+                 layout: dict):
+    """
+    Write a sheet part with its header row followed by the rows of a DataFrame.
+
+    Args:
+        output (zipfile.ZipFile): The workbook being written.
+        part (str): The path of the sheet part.
+        sheet_xml (str): The XML of the sheet in the template.
+        df (pd.DataFrame): The rows to write.
+        layout (dict): The layout of the sheet, from _sheet_layout.
+
+    Summary:
+        The rows are built column by column, export_block_rows rows at a time, and each
+        block is streamed into the part, so the whole sheet XML is never held in memory.
+        The cells get the default style of their column.
+    """
+    styles = _column_styles(sheet_xml)
+    data_range = layout['range']
+    sheet_data = re.search(r'<sheetData\s*/>|<sheetData>.*?</sheetData>', sheet_xml, re.S)
+    head = sheet_xml[:sheet_data.start()]
+    tail = sheet_xml[sheet_data.end():]
+    head = re.sub(r'<dimension ref="[^"]*"\s*/>', f'<dimension ref="{data_range}"/>', head)
+    tail = re.sub(r'(<autoFilter [^>]*?ref=")[^"]*(")', rf'\g<1>{data_range}\g<2>', tail)
+    with output.open(part, 'w', force_zip64=True) as sheet_file:
+        sheet_file.write(f'{head}<sheetData>{layout["header_row"]}'.encode('utf-8'))
+        for start in range(0, len(df), export_block_rows):
+            block = df.iloc[start:start + export_block_rows]
+            row_numbers = pd.Series(np.arange(start + 2, start + 2 + len(block)).astype(str),
+                                    index=block.index)
+            rows_xml = '<row r="' + row_numbers + '">'
+            for position, col in layout['columns']:
+                cell_type, inner = _cell_values(block[col])
+                style = f' s="{styles[position]}"' if position in styles else ''
+                cells = (f'<c r="{column_letter(position)}' + row_numbers
+                         + f'"{style}{cell_type}>' + inner + '</c>')
+                rows_xml = rows_xml + cells.where(inner.notna(), '')
+            rows_xml = rows_xml + '</row>'
+            sheet_file.write(''.join(rows_xml.tolist()).encode('utf-8'))
+        sheet_file.write(f'</sheetData>{tail}'.encode('utf-8'))
+
+
+def _update_pivot_cache(cache_xml: str,
+                        ranges: dict):
+    """
+    Point a pivot cache built on a filled sheet at its new range and refresh it on open.
+
+    Args:
+        cache_xml (str): The XML of the pivot cache definition.
+        ranges (dict): The new data range of each filled sheet.
+
+    Returns:
+        str: The updated XML, or cache_xml unchanged if its source is not a filled sheet.
+    """
+    source = re.search(r'<worksheetSource [^>]*/>', cache_xml)
+    if source is None:
+        return cache_xml
+    sheet = re.search(r' sheet="([^"]*)"', source.group(0))
+    if sheet is None or xml.sax.saxutils.unescape(sheet.group(1)) not in ranges:
+        return cache_xml
+    new_source = re.sub(r' ref="[^"]*"',
+                        f' ref="{ranges[xml.sax.saxutils.unescape(sheet.group(1))]}"',
+                        source.group(0))
+    cache_xml = cache_xml.replace(source.group(0), new_source)
+    cache_xml = re.sub(r'(<pivotCacheDefinition [^>]*?) refreshOnLoad="[^"]*"', r'\1',
+                       cache_xml)
+    return re.sub(r'<pivotCacheDefinition ', '<pivotCacheDefinition refreshOnLoad="1" ',
+                  cache_xml, count=1)
+
+
+def _update_filter_names(workbook_xml: str,
+                         ranges: dict):
+    """
+    Point the autoFilter names of the filled sheets at their new ranges.
+
+    Args:
+        workbook_xml (str): The workbook XML.
+        ranges (dict): The new data range of each filled sheet.
+
+    Returns:
+        str: The updated workbook XML.
+    """
+    sheet_names = [xml.sax.saxutils.unescape(name, {'&quot;': '"', '&apos;': "'"})
+                   for name in re.findall(r'<sheet [^>]*?name="([^"]*)"', workbook_xml)]
+
+    def new_range(match):
+        sheet = sheet_names[int(match.group(2))]
+        if sheet not in ranges:
+            return match.group(0)
+        first, last = ranges[sheet].split(':')
+        absolute = '$' + re.sub(r'(\d+)', r'$\1', first) + ':$' + re.sub(r'(\d+)', r'$\1', last)
+        quoted = f"'{sheet}'" if re.search(r'\W', sheet) else sheet
+        return f'{match.group(1)}{quoted}!{absolute}</definedName>'
+    return re.sub(r'(<definedName name="_xlnm\._FilterDatabase" localSheetId="(\d+)"[^>]*>)'
+                  r'[^<]*</definedName>', new_range, workbook_xml)
@@ -0,0 +1,328 @@
+import numpy as np
+import SalesIncidence as si
+
+"""
+Overall summary:
+Batch proposal of ADJ_XFactor values. Instead of editing one cell at a
+time and re-checking OutOfTarget, the X-Factors of a set of cells (by
+default the Anomalous ones) are chosen all at once as the solution of
+
+    minimize    sum over the cells of ((x - VUE_XFactor) / VUE_XFactor)^2 / 2
+    subject to  |ADJ_SalesImpact| <= Target, for every MBD-category
+
+where the ADJ sales of every MBD-category are linear in the X-Factors
+through the SalesIncidence matrix. The quadratic program is solved for all
+the MBDs at once with the alternating direction method of multipliers
+(ADMM, as in the indirect OSQP solver). The constraints are kept as sparse
+entries and every linear system is solved with preconditioned conjugate
+gradients, so memory and time grow with the non-zero MBD-category x cell
+entries, not with MBD-categories x cells; only numpy is needed (scipy
+speeds up the products when it is installed). When the targets cannot
+all be met, the excess of each impact over its target is penalized
+instead (by violation_penalty per unit of impact), so the solution still
+moves every MBD-category as close to its target as the cells allow.
+"""
+
+solver_max_iter = 10_000
+solver_tol = 1e-9
+solver_check_every = 25
+solver_polish_every = 250
+violation_penalty = 1e3
+admm_sigma = 1e-6
+admm_alpha = 1.6
+cg_max_iter = 500
+polish_regularization = 1e-12
+
+
+def solve_xfactors(incidence,
+                   reference: np.ndarray,
+                   current: np.ndarray,
+                   variable: np.ndarray,
+                   lower: np.ndarray,
+                   upper: np.ndarray,
+                   targets: np.ndarray,
+                   max_iter: int = solver_max_iter,
+                   tol: float = solver_tol,
+                   penalty: float = violation_penalty):
+    """
+    Find the X-Factors closest to a reference that keep the MBD impacts within target.
+
+    Args:
+        incidence (SalesIncidence.SalesIncidence): The MBD-category by cell incidence.
+        reference (np.ndarray): The X-Factor each column should stay close to (VUE_XFactor).
+        current (np.ndarray): The X-Factor of each column; kept for the fixed columns.
+        variable (np.ndarray): Boolean mask of the columns whose X-Factor is solved for. 
+            Columns whose reference is not positive are kept fixed.
+        lower (np.ndarray): The lowest X-Factor allowed for each column.
+        upper (np.ndarray): The highest X-Factor allowed for each column.
+        targets (np.ndarray): The largest absolute sales impact allowed for each row, or NaN
+            for the rows without a target.
+        max_iter (int, optional): The iteration limit. Defaults to solver_max_iter.
+        tol (float, optional): The largest primal and dual residuals accepted as converged, 
+            and the largest target violation accepted as feasible, in sales impact units. 
+            Defaults to solver_tol.
+        penalty (float, optional): The cost of exceeding a target by one unit of sales 
+            impact, in units of the objective. Defaults to violation_penalty.
+
+    Returns:
+        tuple: The solution and how it was reached:
+            - np.ndarray: The X-Factor of each column.
+            - dict: 'Iterations', 'Converged', 'Feasible' (every target is met), 
+              'MaxViolation' (the largest excess of an absolute sales impact over its 
+              target), 'ViolatedRows' and 'ConstrainedRows'.
+
+    Summary:
+        Only the rows with a target, a non-zero Baseline_Sales and at least one variable
+        column are constraints; the others cannot be changed by the solution. Each 
+        constraint is scaled by the row's Baseline_Sales, so it reads 
+        1 - Target <= ADJ_ProjectedSales / Baseline_Sales <= 1 + Target, and the 
+        variables are the relative changes u = x / reference - 1. The constraint matrix 
+        C is sparse (si.SparseMatrix), with one row per constrained MBD-category and one 
+        column per variable cell, and each ADMM step solves its linear system with 
+        conjugate gradients warm-started from the previous step. If the variable columns 
+        cannot bring every row within target (e.g. within their bounds), the solution 
+        still converges, with Feasible False, and the rows it could not fix keep the 
+        impacts closest to target.
+
+    Step-by-step:
+    1. Compute the part of each row's projected sales coming from the fixed columns and 
+       the impact bounds left for the variable columns.
+    2. Build the sparse constraint matrix C of the relative changes.
+    3. Iterate ADMM on u, the constraint values z and their multipliers y:
+        a. Solve ((1 + sigma + rho) I + rho C'C) u = sigma u + C'(rho z - y) + box terms 
+           with _conjugate_gradient, to an accuracy 100 times finer than the last 
+           residuals (and at least tol / 100), so the early steps stay cheap.
+        b. Move z to the target bounds, by at most penalty / rho for the MBD rows, and 
+           to the X-Factor bounds for the cell rows.
+        c. Update the multipliers with the residuals.
+       Every solver_check_every iterations, stop if the primal and dual residuals are 
+       under tol, or else rescale rho to balance them. Every solver_polish_every 
+       iterations, polish u (_polish): solve the problem again with the bounds the 
+       multipliers show as active turned into equalities, and stop if the result 
+       is optimal.
+    4. If ADMM did not converge, keep the last polished u if it meets the bounds.
+    5. Return the X-Factors of u and the violated targets.
+    """
+    n_rows = len(incidence)
+    base = incidence.baseline_sales
+    variable = variable & (reference > 0)
+    fixed_x = np.where(variable, 0.0, current)
+    has_variable = np.bincount(incidence.rows, weights=variable[incidence.cols].astype(float),
+                               minlength=n_rows) > 0
+    constrained = ~np.isnan(targets) & (base != 0) & has_variable
+    scale = np.where(constrained, 1 / np.where(base != 0, base, 1), 0.0)
+    fixed = incidence.project(fixed_x) * scale
+    scaled = si.SparseMatrix(incidence.rows, incidence.cols,
+                             incidence.values * reference[incidence.cols]
+                             * scale[incidence.rows], incidence.shape)
+    matrix = scaled.select(constrained, variable)
+    at_reference = (fixed + incidence.project(np.where(variable, reference, 0.0)) * scale)
+    low = (1 - targets - at_reference)[constrained]
+    high = (1 + targets - at_reference)[constrained]
+    box_low = lower[variable] / reference[variable] - 1
+    box_high = upper[variable] / reference[variable] - 1
+    info = {'Iterations': 0,
+            'Converged': True,
+            'Feasible': True,
+            'MaxViolation': 0.0,
+            'ViolatedRows': 0,
+            'ConstrainedRows': matrix.shape[0]}
+    u = np.clip(np.zeros(matrix.shape[1]), box_low, box_high)
+    if matrix.shape[0] > 0 and matrix.shape[1] > 0:
+        column_norms = matrix.squared_norms(axis=0)
+        z_rows = matrix.dot(u)
+        z_box = u.copy()
+        y_rows = np.zeros(matrix.shape[0])
+        y_box = np.zeros(len(u))
+        u_tilde = u.copy()
+        cg_tol = 1e-3
+        rho = 0.1
+        info['Converged'] = False
+        for iteration in range(1, max_iter + 1):
+            diagonal = 1 + admm_sigma + rho
+            rhs = (admm_sigma * u + matrix.dot_transpose(rho * z_rows - y_rows)
+                   + rho * z_box - y_box)
+            u_tilde = _conjugate_gradient(
+                lambda v: diagonal * v + rho * matrix.dot_transpose(matrix.dot(v)),
+                rhs, u_tilde, diagonal + rho * column_norms, cg_tol)
+            z_rows_tilde = admm_alpha * matrix.dot(u_tilde) + (1 - admm_alpha) * z_rows
+            z_box_tilde = admm_alpha * u_tilde + (1 - admm_alpha) * z_box
+            u = admm_alpha * u_tilde + (1 - admm_alpha) * u
+            w_rows = z_rows_tilde + y_rows / rho
+            excess = w_rows - np.clip(w_rows, low, high)
+            z_rows_next = w_rows - np.clip(excess, -penalty / rho, penalty / rho)
+            z_box_next = np.clip(z_box_tilde + y_box / rho, box_low, box_high)
+            y_rows += rho * (z_rows_tilde - z_rows_next)
+            y_box += rho * (z_box_tilde - z_box_next)
+            z_rows = z_rows_next
+            z_box = z_box_next
+            if iteration % solver_check_every != 0:
+                continue
+            info['Iterations'] = iteration
+            values = matrix.dot(u)
+            dual = matrix.dot_transpose(y_rows)
+            primal_residual = max(np.abs(values - z_rows).max(initial=0),
+                                  np.abs(u - z_box).max(initial=0))
+            dual_residual = np.abs(u + dual + y_box).max(initial=0)
+            cg_tol = max(min(cg_tol, 1e-2 * max(primal_residual, dual_residual)), 1e-2 * tol)
+            if primal_residual <= tol and dual_residual <= tol:
+                info['Converged'] = True
+                break
+            if iteration % solver_polish_every == 0:
+                polished, optimal = _polish(matrix, u, z_rows, y_rows, y_box, low, high,
+                                            box_low, box_high, penalty, tol)
+                if optimal:
+                    u = polished
+                    info['Converged'] = True
+                    break
+            primal_scale = max(np.abs(values).max(initial=0), np.abs(z_rows).max(initial=0),
+                               np.abs(u).max(initial=0), tol)
+            dual_scale = max(np.abs(u).max(initial=0), np.abs(dual).max(initial=0),
+                             np.abs(y_box).max(initial=0), tol)
+            ratio = np.sqrt((primal_residual / primal_scale)
+                            / max(dual_residual / dual_scale, 1e-30))
+            if ratio > 5 or ratio < 0.2:
+                rho = float(np.clip(rho * ratio, 1e-6, 1e6))
+        if not info['Converged']:
+            polished, optimal = _polish(matrix, u, z_rows, y_rows, y_box, low, high,
+                                        box_low, box_high, penalty, tol)
+            if polished is not None:
+                u = polished
+                info['Converged'] = optimal
+    u = np.clip(u, box_low, box_high)
+    x = current.astype(float).copy()
+    x[variable] = reference[variable] * (1 + u)
+    if matrix.shape[0] > 0:
+        values = matrix.dot(u)
+        violation = np.maximum(np.maximum(values - high, low - values), 0)
+        info['MaxViolation'] = float(violation.max(initial=0))
+        info['ViolatedRows'] = int((violation > tol).sum())
+        info['Feasible'] = info['ViolatedRows'] == 0
+    return x, info
+
+
+def _conjugate_gradient(apply,
+                        rhs: np.ndarray,
+                        start: np.ndarray,
+                        diagonal: np.ndarray,
+                        tol: float,
+                        max_iter: int = cg_max_iter):
+    """
+    Solve a symmetric positive semi-definite linear system with conjugate gradients.
+
+    Args:
+        apply (callable): Multiplies the system matrix by a vector.
+        rhs (np.ndarray): The right-hand side.
+        start (np.ndarray): The first guess, e.g. the solution of the previous step.
+        diagonal (np.ndarray): The diagonal of the system matrix, used as (Jacobi) 
+            preconditioner.
+        tol (float): The largest residual accepted, as max |rhs - A x|.
+        max_iter (int, optional): The iteration limit. Defaults to cg_max_iter.
+
+    Returns:
+        np.ndarray: The solution, or the last iterate if tol was not reached.
+    """
+    diagonal = np.where(diagonal > 0, diagonal, 1.0)
+    solution = start.copy()
+    residual = rhs - apply(solution)
+    preconditioned = residual / diagonal
+    direction = preconditioned.copy()
+    product = residual @ preconditioned
+    for _ in range(max_iter):
+        if np.abs(residual).max(initial=0) <= tol:
+            break
+        applied = apply(direction)
+        curvature = direction @ applied
+        if not curvature > 0:
+            break
+        step = product / curvature
+        solution += step * direction
+        residual -= step * applied
+        preconditioned = residual / diagonal
+        next_product = residual @ preconditioned
+        direction = preconditioned + (next_product / product) * direction
+        product = next_product
+    return solution
+
+
+def _polish(matrix: si.SparseMatrix,
+            u: np.ndarray,
+            z_rows: np.ndarray,
+            y_rows: np.ndarray,
+            y_box: np.ndarray,
+            low: np.ndarray,
+            high: np.ndarray,
+            box_low: np.ndarray,
+            box_high: np.ndarray,
+            penalty: float,
+            tol: float):
+    """
+    Refine an ADMM solution by solving for its active bounds exactly.
+
+    Args:
+        matrix (si.SparseMatrix): The constraint matrix of solve_xfactors.
+        u (np.ndarray): The ADMM relative changes.
+        z_rows (np.ndarray): The ADMM constraint values.
+        y_rows (np.ndarray): The multipliers of the MBD rows.
+        y_box (np.ndarray): The multipliers of the X-Factor bounds.
+        low, high (np.ndarray): The bounds of the MBD rows.
+        box_low, box_high (np.ndarray): The bounds of the relative changes.
+        penalty (float): The violation penalty, the largest multiplier of a row.
+        tol (float): The largest bound violation accepted.
+
+    Returns:
+        tuple: 
+            - np.ndarray or None: The polished relative changes, or None if they break a 
+              bound by more than tol.
+            - bool: Whether they are optimal: the active rows are met, the multipliers of 
+              the active bounds have the sign of their side and the active rows' are 
+              under penalty.
+
+    Summary:
+        A row is active at its lower (upper) bound if its multiplier is negative 
+        (positive) and larger than its distance to the bound, and penalized if its 
+        multiplier reached penalty. With the active X-Factor bounds fixed and the 
+        penalized rows entering as the linear term of their multipliers, the minimum 
+        norm solution of the active rows B is the solution: u = B'w - linear, where 
+        (BB' + delta I) w = bounds + B linear is solved with conjugate gradients; the 
+        tiny delta (polish_regularization) keeps the system definite when active rows 
+        are linearly dependent, e.g. nested MBDs over the same cells. Its row 
+        multipliers are then -w (stationarity u + linear + B'y = 0); if they have the 
+        wrong sign, some bound was wrongly taken as active.
+    """
+    penalized = np.abs(y_rows) >= penalty * (1 - 1e-9)
+    at_low = ~penalized & (z_rows - low < -y_rows)
+    at_high = ~penalized & ~at_low & (high - z_rows < y_rows)
+    fixed = (u - box_low < -y_box) | (box_high - u < y_box)
+    u_fixed = np.where(y_box < 0, box_low, box_high)
+    u_fixed = np.where(fixed, u_fixed, 0.0)
+    free = ~fixed
+    active = at_low | at_high
+    linear = matrix.dot_transpose(np.where(penalized, y_rows, 0.0))
+    active_rows = matrix.select(active, np.ones(len(u), dtype=bool))
+    block = matrix.select(active, free)
+    target = np.where(at_low, low, high)[active] - active_rows.dot(u_fixed)
+    rhs = target + block.dot(linear[free])
+    row_norms = block.squared_norms(axis=1)
+    delta = polish_regularization * max(row_norms.max(initial=0), 1.0)
+    weights = _conjugate_gradient(lambda v: block.dot(block.dot_transpose(v)) + delta * v,
+                                  rhs, np.zeros(len(rhs)), row_norms + delta,
+                                  tol * 1e-2, max_iter=max(cg_max_iter, 2 * len(rhs)))
+    polished = u_fixed.copy()
+    polished[free] = block.dot_transpose(weights) - linear[free]
+    values = matrix.dot(polished)
+    bounded = ~penalized
+    if np.any(values[bounded] < low[bounded] - tol) or np.any(values[bounded] > high[bounded] + tol) \
+            or np.any(polished < box_low - tol) or np.any(polished > box_high + tol):
+        return None, False
+    row_multipliers = -weights
+    gradient = polished + linear
+    box_multipliers = -(gradient + active_rows.dot_transpose(row_multipliers))[fixed]
+    scale = max(1.0, np.abs(row_multipliers).max(initial=0))
+    optimal = (np.abs(block.dot(polished[free]) - target).max(initial=0) <= tol
+               and np.all(row_multipliers[at_high[active]] >= -tol * scale)
+               and np.all(row_multipliers[at_low[active]] <= tol * scale)
+               and np.all(np.abs(row_multipliers) <= penalty)
+               and np.all(box_multipliers[(y_box > 0)[fixed]] >= -tol * scale)
+               and np.all(box_multipliers[(y_box <= 0)[fixed]] <= tol * scale))
+    return polished, bool(optimal)
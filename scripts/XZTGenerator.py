@@ -1,7 +1,12 @@
+import concurrent.futures
+import functools
+import inspect
 import numpy as np
 import pandas as pd
 import re
 import InputsPreCleaning as ipc
+import OutputDelta as od
+import RunProfiler as rprof
 
 """ 
 Overall summary:
@@ -26,8 +31,285 @@ Considered steps for presentation:
    worksheet that will be feed into the macros.
 """
 
+adj_columns = ['ADJ_XFactor', 'ADJ_XUniverse']
 
-class XZTG:
+default_non_handler_patterns = ['_NM', '_NO_MANEJANTE', 'NOMANEJANTE', 'NO MANEJANTE']
+
+area_channel_weight_cols = {'BAU_N Area-Channel Cell Weight': 'BAU_ZUniverse',
+                            'BAU_NSPC Area-Channel Cell Weight': 'BAU_XUniverse',
+                            'VUE_N Area-Channel Cell Weight': 'VUE_ZUniverse',
+                            'VUE_NSPC Area-Channel Cell Weight': 'VUE_XUniverse',
+                            'ADJ_NSPC Area-Channel Cell Weight': 'ADJ_XUniverse'}
+
+cell_partition_cols = ['INDEX', 'CHANNEL']
+
+xztg_input_files = ['Cells_Chars.csv', 'Cells_LastPeriod.csv', 'VUE_SampleNSPC.csv']
+area_channel_group_cols = ['Handler', 'StoreTypeChannel', 'NielsenArea']
+
+
+def pipeline_stage(method):
+    """
+    Memoize a pipeline stage in the stage cache of its object.
+
+    Args:
+        method (callable): The stage method, named as a key of the object's stage_graph.
+
+    Returns:
+        callable: The wrapped method.
+
+    Summary:
+        The result of the stage is cached together with the arguments it was 
+        called with. A call with the same arguments returns a copy of the cached 
+        result; a call with different arguments invalidates the stage and its 
+        downstream stages before recomputing it. Computed stages are recorded by 
+        the profiler of the object, and every stage records the rows of the 
+        upstream results it reads.
+    """
+    name = method.__name__
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        key = tuple(bound.arguments.items())[1:]
+        cached = self._stage_cache.get(name)
+        if cached is not None and cached[0] == key:
+            self.profiler.record_input(name, len(cached[1]))
+            return cached[1].copy()
+        self.invalidate(name)
+        with self.profiler.stage(name, type(self).__name__) as record:
+            result = method(self, *args, **kwargs)
+            record['rows_out'] = len(result)
+        self._stage_cache[name] = (key, result)
+        self.profiler.record_input(name, len(result))
+        return result.copy()
+    return wrapper
+
+
+def map_partitions(func,
+                   df: pd.DataFrame,
+                   keys: list,
+                   max_workers: int = 1):
+    """
+    Apply a function to the partitions of a DataFrame in parallel threads.
+
+    Args:
+        func (callable): Takes a partition of df and returns a DataFrame indexed either by 
+            the index labels of the rows it comes from, or by group keys. Rows of different 
+            partitions must never be combined by func.
+        df (pd.DataFrame): The DataFrame to partition.
+        keys (list): The columns whose values define the partitions.
+        max_workers (int, optional): The number of threads. Defaults to 1, which calls 
+            func on the whole df.
+
+    Returns:
+        pd.DataFrame: The results of all the partitions, concatenated and stably sorted by 
+                      index, so the rows come out in the same order as from func(df).
+
+    Summary:
+        The numpy and pandas kernels release the GIL, so the partitions run on several 
+        cores without copying them to other processes.
+    """
+    if max_workers is None or max_workers <= 1 or len(df) == 0:
+        return func(df)
+    group = df.groupby(keys, sort=True, dropna=False, observed=True).ngroup().to_numpy()
+    if group.max() == 0:
+        return func(df)
+    order = np.argsort(group, kind='stable')
+    bounds = np.flatnonzero(np.diff(group[order])) + 1
+    partitions = [df.iloc[rows] for rows in np.split(order, bounds)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(func, partitions))
+    return pd.concat(results).sort_index(kind='stable')
+
+
+class StageInput:
+    """
+    A pipeline attribute that feeds a stage of the stage graph.
+
+    Reassigning the attribute invalidates the cached results of the stage 
+    that reads it and of every stage downstream of it.
+    """
+
+    def __init__(self, 
+                 stage: str):
+        self.stage = stage
+
+    def __set_name__(self, owner, name):
+        self.attr_name = f'_{name}'
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return getattr(obj, self.attr_name)
+
+    def __set__(self, obj, value):
+        setattr(obj, self.attr_name, value)
+        obj.drop_key_indexes(self.attr_name[1:])
+        obj.invalidate(self.stage)
+
+
+class KeyIndex:
+    """
+    A table indexed once on its join keys, for repeated many-to-one inner joins.
+
+    Attributes:
+        table (pd.DataFrame): The indexed table, the right side of the joins.
+        on (list): The key columns of table.
+        index (pd.Index or pd.MultiIndex): The keys of each row of table.
+        unique (bool): Whether every key appears once, i.e. the joins are many-to-one.
+
+    The hash table of index is built with the KeyIndex and reused by every join, 
+    so joining many partitions or chunks (also from several threads) hashes the 
+    table only once.
+    """
+
+    def __init__(self,
+                 table: pd.DataFrame,
+                 on):
+        self.table = table
+        self.on = [on] if isinstance(on, str) else list(on)
+        self.index = key_values(table, self.on)
+        self.unique = self.index.is_unique
+        if self.unique:
+            self.index.get_indexer(self.index[:1])
+
+    def join(self,
+             left: pd.DataFrame,
+             columns: list,
+             left_on=None):
+        """
+        Inner join the rows of left to the table rows with the same key.
+
+        Args:
+            left (pd.DataFrame): The left side of the join.
+            columns (list): The non-key columns of table to add; none may be in left.
+            left_on (str or list, optional): The key columns of left. Defaults to on.
+
+        Returns:
+            pd.DataFrame: The rows of left whose key is in table, in their order and with 
+                          their index labels, followed by the columns of table, as 
+                          left.join(table.set_index(on)[columns], on=left_on, how='inner').
+
+        Summary:
+            With unique keys, the table rows are gathered by position (get_indexer and 
+            take) instead of building a new hash table for each join. Otherwise the rows 
+            are joined with DataFrame.join, which repeats the left rows of repeated keys.
+        """
+        left_on = self.on if left_on is None else \
+            [left_on] if isinstance(left_on, str) else list(left_on)
+        if not self.unique:
+            right = self.table.set_index(self.on)[columns]
+            return left.join(right, on=left_on, how='inner')
+        positions = self.index.get_indexer(key_values(left, left_on))
+        matched = positions >= 0
+        result = left if matched.all() else left.loc[matched]
+        right = self.table[columns].take(positions[matched])
+        right.index = result.index
+        return pd.concat([result, right], axis=1)
+
+
+def key_values(df: pd.DataFrame,
+               on: list):
+    """
+    Return the join keys of the rows of a DataFrame.
+
+    Args:
+        df (pd.DataFrame): The DataFrame.
+        on (list): The key columns.
+
+    Returns:
+        pd.Index or pd.MultiIndex: The key of each row, an Index for a single column.
+    """
+    if len(on) == 1:
+        return pd.Index(df[on[0]])
+    return pd.MultiIndex.from_frame(df[on])
+
+
+class StagedPipeline:
+    """
+    Base class for pipelines whose set_* methods are memoized with pipeline_stage.
+
+    Attributes:
+        stage_graph (dict): Maps each memoized stage to the stages it depends on.
+        profiler (RunProfiler.RunProfiler): Records the computed stages. Disabled by default.
+    """
+
+    stage_graph = {}
+    profiler = rprof.disabled
+
+    def invalidate(self,
+                   stage: str = None):
+        """
+        Drop cached stage results.
+
+        Args:
+            stage (str, optional): The stage to invalidate. If None, every stage is invalidated.
+
+        Summary:
+            Removes the cached result of the given stage and of all the stages 
+            that depend on it, so they are recomputed on their next call.
+        """
+        if stage is None:
+            self._stage_cache.clear()
+            return
+        self._stage_cache.pop(stage, None)
+        for downstream, upstream in self.stage_graph.items():
+            if stage in upstream:
+                self.invalidate(downstream)
+
+    def key_index(self,
+                  attr: str,
+                  on):
+        """
+        Index a loaded table on its join keys, once.
+
+        Args:
+            attr (str): The attribute holding the table, e.g. 'cells_lastperiod'.
+            on (str or list): The key columns of the table.
+
+        Returns:
+            KeyIndex: The index of the table, built on the first call and kept until the 
+                      attribute is reassigned.
+        """
+        key_indexes = self.__dict__.setdefault('_key_indexes', {})
+        key = (attr, on if isinstance(on, str) else tuple(on))
+        if key not in key_indexes:
+            key_indexes[key] = KeyIndex(getattr(self, attr), on)
+        return key_indexes[key]
+
+    def drop_key_indexes(self,
+                         attr: str):
+        """
+        Forget the key indexes of a table that was replaced.
+
+        Args:
+            attr (str): The attribute holding the table.
+        """
+        key_indexes = self.__dict__.get('_key_indexes', {})
+        for key in [key for key in key_indexes if key[0] == attr]:
+            del key_indexes[key]
+
+    def set_stage_result(self,
+                         stage: str,
+                         result: pd.DataFrame):
+        """
+        Cache a result computed outside a stage that takes no arguments.
+
+        Args:
+            stage (str): The stage the result stands for.
+            result (pd.DataFrame): The result the stage would have returned.
+
+        Summary:
+            Invalidates the stage and the stages that depend on it, then stores result
+            as the cached result of the stage, so the downstream stages build on it.
+        """
+        self.invalidate(stage)
+        self._stage_cache[stage] = ((), result)
+
+
+class XZTG(StagedPipeline):
     """
     A class for processing and analyzing cell data.
 
@@ -38,6 +320,7 @@ class XZTG:
     Attributes:
         working_dir (str): The working directory path.
         input_dir (str): The input directory path.
+        clean_dir (str): The directory path of the cleaned (typed) input files.
         output_dir (str): The output directory path.
         cells_chars (pd.DataFrame): DataFrame containing cell characteristics.
             - User-defined data.
@@ -45,29 +328,86 @@ class XZTG:
             - VUE data.
         vue_samplenspc (pd.DataFrame): DataFrame containing VUE sample NSPC data.
             - VUE data.
+        non_handler_regex (re.Pattern): Compiled pattern matching non-handler cell names.
+        adj_overrides (pd.DataFrame): ADJ_XFactor and ADJ_XUniverse values edited by the 
+            analysts, indexed by Cell_ID. They replace the VUE seeded values in set_dummy_calc.
+        max_workers (int): The number of threads the grouped stages split their work on.
+        profiler (RunProfiler.RunProfiler): Records the cleaning steps, the stages and the 
+            saved outputs; disabled unless one is given.
+        delta (bool): Whether saving an output also writes its rows that changed since the 
+            previous run (see OutputDelta.py).
+
+    Stages (the set_* methods) are memoized following stage_graph: each one is 
+    computed once and reused by the stages downstream of it. Reassigning an input 
+    attribute, or calling a stage with different parameters, recomputes only the 
+    affected stages. After editing an input DataFrame in place, call invalidate() 
+    with the stage that reads it.
     """
 
+    stage_graph = {'set_bau_cells': [],
+                   'set_vue_cells': ['set_bau_cells'],
+                   'set_dummy_calc': ['set_vue_cells'],
+                   'set_cell_area_channel_weights': ['set_dummy_calc'],
+                   'set_cell_area_channel_weight_diff': ['set_cell_area_channel_weights'],
+                   'set_bau_vue_averages': ['set_cell_area_channel_weight_diff'],
+                   'set_cell_flags': ['set_bau_vue_averages']}
+    cells_chars = StageInput('set_bau_cells')
+    cells_lastperiod = StageInput('set_bau_cells')
+    vue_samplenspc = StageInput('set_vue_cells')
+    non_handler_regex = StageInput('set_vue_cells')
+    adj_overrides = StageInput('set_dummy_calc')
+
     def __init__(self, 
-                 working_dir: str):
+                 working_dir: str,
+                 non_handler_patterns: list = None,
+                 max_workers: int = 1,
+                 profiler: rprof.RunProfiler = None,
+                 delta: bool = False,
+                 input_frames: dict = None):
         """
         Initialize the XZTG object.
 
         Args:
             working_dir (str): The working directory path.
+            non_handler_patterns (list, optional): Cell name fragments that flag a cell 
+                as non-handler. Defaults to default_non_handler_patterns.
+            max_workers (int, optional): The number of threads used to compute the 
+                area-channel weights of each INDEX and CHANNEL partition. Defaults to 1.
+            profiler (RunProfiler.RunProfiler, optional): Records the run, see 
+                RunProfiler.py. Defaults to None, which records nothing.
+            delta (bool, optional): Whether to write XZTemplate_v0_delta.csv and log the 
+                changes in changelog.csv when XZTemplate_v0.csv is saved. Defaults to False.
+            input_frames (dict, optional): The cleaned xztg_input_files DataFrames, keyed by 
+                file name, as returned by CleaningInputs.get_clean_frames. Defaults to None, 
+                which cleans the input files and loads them here.
 
         Summary:
-            Sets up directory paths and loads input CSV files into DataFrames.
+            Sets up directory paths, compiles the non-handler pattern, cleans the input 
+            files (reusing the clean cache when they did not change), and takes the 
+            cleaned DataFrames straight from the cleaning, without reading them back.
         """
-        ipc.CleaningInputs(working_dir).get_clean_csvs()
+        self._stage_cache = {}
+        self.max_workers = max_workers
+        self.profiler = profiler or rprof.disabled
+        self.delta = delta
+        cleaning = ipc.CleaningInputs(working_dir, self.profiler)
+        self.clean_dir = cleaning.clean_path
+        if input_frames is None:
+            input_frames = cleaning.get_clean_frames(dict.fromkeys(xztg_input_files))
+        if non_handler_patterns is None:
+            non_handler_patterns = default_non_handler_patterns
+        self.non_handler_regex = re.compile(
+            '|'.join(map(re.escape, non_handler_patterns)))
+        self.adj_overrides = pd.DataFrame(columns=adj_columns, dtype=float,
+                                          index=pd.Index([], name='Cell_ID'))
         self.working_dir = working_dir
         self.input_dir = f'{self.working_dir}/inputs'
         self.output_dir = f'{self.working_dir}/outputs'
-        self.cells_chars = pd.read_csv(f'{self.input_dir}/Cells_Chars.csv')
-        self.cells_lastperiod = pd.read_csv(
-            f'{self.input_dir}/Cells_LastPeriod.csv')
-        self.vue_samplenspc = pd.read_csv(
-            f'{self.input_dir}/VUE_SampleNSPC.csv')
+        self.cells_chars = input_frames['Cells_Chars.csv']
+        self.cells_lastperiod = input_frames['Cells_LastPeriod.csv']
+        self.vue_samplenspc = input_frames['VUE_SampleNSPC.csv']
 
+    @pipeline_stage
     def set_bau_cells(self):
         """
         Set up BAU cell data.
@@ -80,24 +420,24 @@ class XZTG:
             cells_chars, and calculates BAU_XZRatio.
             
         Step-by-step:
-        1. Create a copy of the cells_lastperiod DataFrame.
-        2. Filter out 'Period' and 'Condition' columns from the copied DataFrame.
-        3. Rename columns to prefix 'BAU_' to all except 'Cell_ID' and 'Cell_Name'.
-        4. Create a copy of the cells_chars DataFrame.
-        5. Merge the processed cells_lastperiod with cells_chars on 'Cell_ID'.
-        6. Calculate 'BAU_XZRatio' by dividing 'BAU_XFactor' by 'BAU_ZFactor'.
-        7. Return the resulting DataFrame.
-        """
-        cells_lp = self.cells_lastperiod.copy()
-        cells_lp = cells_lp[[
-            x for x in cells_lp.columns.unique().tolist()
-            if x not in ['Period', 'Condition']]]
-        cells_lp.rename(
-            columns={x: f'BAU_{x}' for x in cells_lp.columns.unique().tolist()
-                     if x not in ['Cell_ID', 'Cell_Name']},
+        1. Take the cells_lastperiod table indexed on 'Cell_ID' (key_index).
+        2. Leave out its 'Period' and 'Condition' columns.
+        3. Join its other columns to cells_chars on 'Cell_ID' (inner join, in the order 
+           of cells_chars).
+        4. Rename the cells_lastperiod columns to prefix 'BAU_' to all except 'Cell_Name'.
+        5. Calculate 'BAU_XZRatio' by dividing 'BAU_XFactor' by 'BAU_ZFactor'.
+        6. Return the resulting DataFrame.
+        """
+        cells_lp = self.key_index('cells_lastperiod', 'Cell_ID')
+        lp_columns = [x for x in cells_lp.table.columns.unique().tolist()
+                      if x not in ['Period', 'Condition', 'Cell_ID']]
+        cells_ch = self.cells_chars
+        cells_df = cells_lp.join(cells_ch, lp_columns).reset_index(drop=True)
+        cells_df.rename(
+            columns={x: f'BAU_{x}' for x in lp_columns if x != 'Cell_Name'},
             inplace=True)
-        cells_ch = self.cells_chars.copy()
-        cells_df = pd.merge(cells_ch, cells_lp, on='Cell_ID')
+        self.profiler.record_merge('Cells_LastPeriod.csv', cells_ch, cells_lp.table, cells_df,
+                                   'Cell_ID')
         cells_df_message = '''
         Consider that only the Cell_IDs from Cells_Chars.csv that are also
         present in Cells_LastPeriod.csv will be considered. This match will result
@@ -117,19 +457,60 @@ class XZTG:
             cell_name (str): The name of the cell.
 
         Returns:
-            int: 0 if the cell name contains specific patterns, 1 otherwise.
+            int: 0 if the cell name contains a non-handler pattern, 1 otherwise.
 
         Summary:
-            Checks if the cell name contains any of the patterns '_NM', '_NO_MANEJANTE', or 'NOMANEJANTE'.
-            Returns 0 if a pattern is found, 1 otherwise.
+            Checks if the cell name contains any of the non-handler patterns 
+            (by default '_NM', '_NO_MANEJANTE', 'NOMANEJANTE' or 'NO MANEJANTE').
+            Returns 0 if a pattern is found, 1 otherwise. set_vue_cells classifies 
+            whole columns with _handler_values instead.
         """
-        patterns = ['_NM', '_NO_MANEJANTE', 'NOMANEJANTE', 'NO MANEJANTE']
-        combined_pattern = '|'.join(map(re.escape, patterns))
-        if re.search(combined_pattern, cell_name):
+        if self.non_handler_regex.search(str(cell_name)):
             return 0
         else:
             return 1
 
+    def _handler_values(self,
+                        cell_names: pd.Series):
+        """
+        Determine the handler values of a column of cell names, as get_handler_value does.
+
+        Args:
+            cell_names (pd.Series): The names of the cells.
+
+        Returns:
+            np.ndarray: 0 where the cell name contains a non-handler pattern, 1 otherwise.
+
+        Summary:
+            Matches the whole column at once with the pattern compiled at initialization.
+        """
+        non_handler = cell_names.astype(str).str.contains(self.non_handler_regex)
+        return np.where(non_handler, 0, 1)
+
+    def xz_distance(self,
+                    x_factor,
+                    z_factor,
+                    z_panel):
+        """
+        Calculate the signed XZ distance between X and Z factors.
+
+        Args:
+            x_factor (pd.Series): The X factor values.
+            z_factor (pd.Series): The Z factor values.
+            z_panel (pd.Series): The Z panel values.
+
+        Returns:
+            pd.Series: The signed XZ distance, rounded to 4 decimal places.
+
+        Summary:
+            Computes max(|1 - X/Z|, |1 - Z/X|) * sqrt(ZPanel) * sign(X - Z).
+        """
+        distance = np.maximum(np.abs(1 - (x_factor / z_factor)),
+                              np.abs(1 - (z_factor / x_factor)))
+        return np.round(distance * np.sqrt(z_panel) *
+                        np.sign(x_factor - z_factor), 4)
+
+    @pipeline_stage
     def set_vue_cells(self):
         """
         Set up VUE cell data.
@@ -144,26 +525,29 @@ class XZTG:
         
         Step-by-step:
         1. Call set_bau_cells() to get the BAU cell data.
-        2. Create a copy of the vue_samplenspc DataFrame.
-        3. Select specific columns from vue_nspc:
+        2. Take the vue_samplenspc table indexed on 'Cell ID' (key_index).
+        3. Join these columns of vue_samplenspc to the BAU cell data, matching 'Cell_ID' 
+           with 'Cell ID' (inner join, in the order of the BAU cell data):
             - 'IBD Name'
             - 'IBD ID'
-            - 'Cell ID'
             - 'X Universe'
             - 'Z Universe' 
             - 'X Panel'
             - 'Z Panel'
             - 'X Factor'
             - 'Z Factor'
-        4. Rename columns:
-            a. Replace spaces with underscores for 'IBD Name', 'IBD ID', and 'Cell ID'.
+        4. Rename the joined columns:
+            a. Replace spaces with underscores for 'IBD Name' and 'IBD ID'.
             b. Remove spaces from other column names.
-            c. Prefix 'VUE_' to all columns except 'IBD_Name', 'IBD_ID', and 'Cell_ID'.
-        5. Merge the processed vue_nspc with the BAU cell data on 'Cell_ID'.
+            c. Prefix 'VUE_' to all columns except 'IBD_Name' and 'IBD_ID'.
+        5. The BAU cell data rows without a match in vue_samplenspc are dropped.
         6. Calculate 'VUE_XZRatio' by dividing 'VUE_XFactor' by 'VUE_ZFactor'.
-        7. Calculate 'VUE_XZDistance' using the formula:
-            (1 - (VUE_ZFactor / VUE_XFactor)) * sqrt(VUE_ZPanel)
-        8. Select and reorder specific columns in the final DataFrame:
+        7. Calculate 'VUE_XZDistance' with xz_distance:
+            max(|1 - VUE_XFactor / VUE_ZFactor|, |1 - VUE_ZFactor / VUE_XFactor|) 
+            * sqrt(VUE_ZPanel) * sign(VUE_XFactor - VUE_ZFactor)
+        8. Calculate 'Handler' with _handler_values on 'Cell_Name' (get_handler_value of 
+           each cell name).
+        9. Select and reorder specific columns in the final DataFrame:
             - 'INDEX'
             - 'CHANNEL'
             - 'SAMPLE'
@@ -174,6 +558,7 @@ class XZTG:
             - 'NielsenArea'
             - 'StoreTypeChannel'
             - 'StoreType'
+            - 'Handler'
             - 'BAU_XPanel'
             - 'BAU_ZPanel'
             - 'BAU_XUniverse'
@@ -189,35 +574,27 @@ class XZTG:
             - 'VUE_ZFactor'
             - 'VUE_XZRatio'
             - 'VUE_XZDistance'
-        9. Return the resulting DataFrame.
+        10. Return the resulting DataFrame.
         """
         cells_df = self.set_bau_cells()
-        vue_nspc = self.vue_samplenspc.copy()
+        vue_nspc = self.key_index('vue_samplenspc', 'Cell ID')
         ucols = ['IBD Name',
                  'IBD ID',
-                 'Cell ID',
                  'X Universe',
                  'Z Universe',
                  'X Panel',
                  'Z Panel',
                  'X Factor',
                  'Z Factor']
-        vue_nspc = vue_nspc[ucols]
-        vue_nspc.rename(columns={x: x.replace(' ', '_')
-                                 for x in vue_nspc.columns.unique().tolist()
-                                 if x in ['IBD Name', 'IBD ID', 'Cell ID']},
-                        inplace=True)
-        vue_nspc.rename(columns={x: x.replace(' ', '')
-                                 for x in vue_nspc.columns.unique().tolist()
-                                 if x not in [
-                                     'IBD_Name', 'IBD_ID', 'Cell_ID']},
-                        inplace=True)
-        vue_nspc.rename(columns={x: f'VUE_{x}'
-                                 for x in vue_nspc.columns.unique().tolist()
-                                 if x not in [
-                                     'IBD_Name', 'IBD_ID', 'Cell_ID']},
-                        inplace=True)
-        cells = pd.merge(cells_df, vue_nspc, on='Cell_ID')
+        cells = vue_nspc.join(cells_df, ucols, left_on='Cell_ID').reset_index(drop=True)
+        cells.rename(columns={x: x.replace(' ', '_')
+                              for x in ['IBD Name', 'IBD ID']},
+                     inplace=True)
+        cells.rename(columns={x: 'VUE_' + x.replace(' ', '')
+                              for x in ucols if x not in ['IBD Name', 'IBD ID']},
+                     inplace=True)
+        self.profiler.record_merge('VUE_SampleNSPC.csv', cells_df, vue_nspc.table, cells,
+                                   'Cell_ID', right_on='Cell ID')
         cells_message = '''
         Consider that only the Cell_IDs from Cells BAU dataframe that are also
         present in VUE_SampleNSPC.csv will be considered. This match will result
@@ -226,16 +603,13 @@ class XZTG:
         print(cells_message)
         cells['VUE_XZRatio'] = np.round(
             cells['VUE_XFactor'] / cells['VUE_ZFactor'], 4)
-        cells['VUE_XZDistance'] = cells.apply(lambda row: np.round(
-            max(abs(1 - (row['VUE_XFactor'] / row['VUE_ZFactor'])),
-                abs(1 - (row['VUE_ZFactor'] / row['VUE_XFactor']))) *
-            np.sqrt(row['VUE_ZPanel']) *
-            np.sign(row['VUE_XFactor'] - row['VUE_ZFactor']), 4), axis=1)
+        cells['VUE_XZDistance'] = self.xz_distance(cells['VUE_XFactor'],
+                                                   cells['VUE_ZFactor'],
+                                                   cells['VUE_ZPanel'])
         #cells['VUE_XZDistance'] = np.round((
         #    1 - (cells['VUE_ZFactor'] / cells['VUE_XFactor']))*np.sqrt(
         #        cells['VUE_ZPanel']), 4) 
-        cells['Handler'] = cells.apply(lambda row: self.get_handler_value(
-            row['Cell_Name']), axis=1)
+        cells['Handler'] = self._handler_values(cells['Cell_Name'])
         cells = cells[['INDEX', 
                        'CHANNEL',
                        'SAMPLE',
@@ -287,64 +661,55 @@ class XZTG:
               c1,
               distance):
         """
-        Perform a distance test on a given value.
+        Perform a distance test on a given column.
 
         Args:
-            c1 (float): The value to test.
-            distance_param (float): Parameter for Distance test.
+            c1 (pd.Series or np.ndarray): The values to test.
+            distance (float): Parameter for Distance test.
 
         Returns:
-            int: 0 if the absolute value of c1 is less than or equal to distance_param, 1 otherwise.
+            np.ndarray: 0 where the absolute value of c1 is less than or equal to distance, 1 otherwise.
 
         Summary:
-            Checks if the absolute value of c1 is within the range [-distance_param, distance_param].
+            Checks if the absolute values of c1 are within the range [-distance, distance].
         """
-        if abs(c1) <= distance:
-            return 0
-        else:
-            return 1
+        return np.where(np.abs(c1) <= distance, 0, 1)
 
     def var_test(self, 
                  var_col, 
                  param: float):
         """
-        Perform a variance test on a given value.
+        Perform a variance test on a given column.
 
         Args:
-            var_col (float): The value to test.
+            var_col (pd.Series or np.ndarray): The values to test.
             param (float): The threshold parameter.
 
         Returns:
-            int: 0 if the absolute value of var_col is less than param, 1 otherwise.
+            np.ndarray: 0 where the absolute value of var_col is less than param, 1 otherwise.
 
         Summary:
-            Checks if the absolute value of var_col is less than the given parameter.
+            Checks if the absolute values of var_col are less than the given parameter.
         """
-        if abs(var_col) < param:
-            return 0
-        else:
-            return 1
+        return np.where(np.abs(var_col) < param, 0, 1)
 
     def sign_test(self, 
                   v1, 
                   v2):
         """
-        Perform a sign test on two values.
+        Perform a sign test on two columns.
 
         Args:
-            v1 (float): The first value.
-            v2 (float): The second value.
+            v1 (pd.Series or np.ndarray): The first values.
+            v2 (pd.Series or np.ndarray): The second values.
 
         Returns:
-            int: 0 if the signs are the same, 1 if they are different.
+            np.ndarray: 0 where the signs are the same, 1 where they are different.
 
         Summary:
             Compares the signs of v1 and v2, handling cases where one or both values are zero.
         """
-        if v1*v2 < 0:
-            return 1
-        else:
-            return 0
+        return np.where(v1 * v2 < 0, 1, 0)
         
     def gap_difference_test(self, 
                             v1,
@@ -352,32 +717,35 @@ class XZTG:
                             same_dir_gap_tolerance,
                             diff_dir_gap_tolerance):
         """
-        Perform a gap difference test between two values based on their direction and magnitude.
+        Perform a gap difference test between two columns based on their direction and magnitude.
 
         Args:
-            v1 (float): First value to compare.
-            v2 (float): Second value to compare.
+            v1 (pd.Series or np.ndarray): First values to compare.
+            v2 (pd.Series or np.ndarray): Second values to compare.
             same_dir_gap_tolerance (float): Tolerance threshold for values in the same direction.
             diff_dir_gap_tolerance (float): Tolerance threshold for values in different directions.
 
         Returns:
-            int: 
-                - 0 if the values are within the respective tolerance thresholds
-                - 1 if the values exceed their respective tolerance thresholds
+            np.ndarray: 
+                - 0 where the values are within the respective tolerance thresholds
+                - 1 where the values exceed their respective tolerance thresholds
 
         Summary:
             Determines whether two values have a significant gap based on their sign and magnitude.
-
+            When the product of both values is 0, the direction is taken from the sign of v1
+            (positive means same direction). Missing or infinite products are treated as
+            different directions.
         """
-        try:
-            same_sign = (v1 * v2) / abs(v1 * v2)
-        except ZeroDivisionError:
-            same_sign = 1 if v1 > 0 else -1
-        var_x_z_diff = abs(v1 - v2)
-        if same_sign == 1:
-            return 1 if var_x_z_diff > same_dir_gap_tolerance else 0
-        else:
-            return 1 if var_x_z_diff > diff_dir_gap_tolerance else 0
+        v1 = np.asarray(v1, dtype=float)
+        v2 = np.asarray(v2, dtype=float)
+        product = v1 * v2
+        same_sign = np.where(product == 0,
+                             v1 > 0,
+                             (product > 0) & np.isfinite(product))
+        var_x_z_diff = np.abs(v1 - v2)
+        return np.where(same_sign,
+                        var_x_z_diff > same_dir_gap_tolerance,
+                        var_x_z_diff > diff_dir_gap_tolerance).astype(int)
 
     def cell_cond(self, 
                   v1, 
@@ -386,25 +754,24 @@ class XZTG:
                   v4, 
                   v5):
         """
-        Determine the cell condition based on four input values.
+        Determine the cell condition based on five test result columns.
 
         Args:
-            v1 (int): First test result.
-            v2 (int): Second test result.
-            v3 (int): Third test result.
-            v4 (int): Fourth test result.
+            v1 (pd.Series or np.ndarray): First test results.
+            v2 (pd.Series or np.ndarray): Second test results.
+            v3 (pd.Series or np.ndarray): Third test results.
+            v4 (pd.Series or np.ndarray): Fourth test results.
+            v5 (pd.Series or np.ndarray): Fifth test results.
 
         Returns:
-            str: 'Anomalous' if the sum of inputs is 2 or greater, 'Normal' otherwise.
+            np.ndarray: 'Anomalous' where the sum of inputs is 3 or greater, 'Normal' otherwise.
 
         Summary:
-            Sums the input values and classifies the cell as 'Anomalous' or 'Normal'.
+            Sums the input values and classifies each cell as 'Anomalous' or 'Normal'.
         """
-        if (v1 + v2 + v3 + v4 + v5) >= 3:
-            return 'Anomalous'
-        else:
-            return 'Normal'
+        return np.where((v1 + v2 + v3 + v4 + v5) >= 3, 'Anomalous', 'Normal')
 
+    @pipeline_stage
     def set_dummy_calc(self):
         """
         Perform dummy calculations on cell data.
@@ -422,8 +789,9 @@ class XZTG:
             a. 'XZ Proposed Distance': Set to VUE_XZDistance
             b. 'ADJ_XFactor': Set to VUE_XFactor
             c. 'ADJ_XUniverse': Set to VUE_XUniverse
-            d. 'ADJ_XPanel': Set to VUE_XPanel
-        3. Calculate variance metrics:
+        3. Overwrite ADJ_XFactor and ADJ_XUniverse with the analysts' edits kept in 
+           adj_overrides (see update_adjustments).
+        4. Calculate variance metrics:
             a. 'VAR_XUniverse (BAU vs VUE)': Relative change between BAU_XUniverse and VUE_XUniverse:
                 (VUE_XUniverse / BAU_XUniverse) - 1
             b. 'VAR_XUniverse (BAU vs ADJ)': Relative change between BAU_XUniverse and ADJ_XUniverse:
@@ -434,15 +802,49 @@ class XZTG:
                 (ADJ_XFactor / BAU_XFactor) - 1
             e. 'VAR_ZUniverse': Relative change between BAU_ZUniverse and VUE_ZUniverse:
                 (VUE_ZUniverse / BAU_ZUniverse) - 1
-        4. Add 'Change in XPanel' column:
-            Compare VUE_XPanel and ADJ_XPanel using bool_comparisson method for each row:
-                True if the values are different, False if they are the same.
         5. Return the updated DataFrame with all new columns and calculations.
         """
         cells_df = self.set_vue_cells()
         cells_df['XZ Proposed Distance'] = cells_df['VUE_XZDistance']
         cells_df['ADJ_XFactor'] = cells_df['VUE_XFactor']
         cells_df['ADJ_XUniverse'] = cells_df['VUE_XUniverse']
+        self._apply_adj_overrides(cells_df, self.adj_overrides)
+        self._add_variations(cells_df)
+        return cells_df
+
+    def _apply_adj_overrides(self,
+                             cells_df: pd.DataFrame,
+                             adj_overrides: pd.DataFrame):
+        """
+        Overwrite ADJ columns with the values edited by the analysts.
+
+        Args:
+            cells_df (pd.DataFrame): The cell DataFrame to modify.
+            adj_overrides (pd.DataFrame): ADJ values indexed by Cell_ID; missing values 
+                keep the current ADJ value.
+
+        Returns:
+            pd.Series: Boolean mask of the rows with at least one overridden value.
+        """
+        overridden = pd.Series(False, index=cells_df.index)
+        for adj_col in adj_overrides.columns:
+            new_values = cells_df['Cell_ID'].map(adj_overrides[adj_col])
+            has_value = new_values.notna()
+            cells_df.loc[has_value, adj_col] = new_values[has_value]
+            overridden |= has_value
+        return overridden
+
+    def _add_variations(self,
+                        cells_df: pd.DataFrame):
+        """
+        Add the variance metrics between BAU, VUE, and adjusted values.
+
+        Args:
+            cells_df (pd.DataFrame): The cell DataFrame to modify.
+
+        Summary:
+            Computes the VAR_* columns described in set_dummy_calc, step 4.
+        """
         cells_df['VAR_XUniverse (BAU vs VUE)'] = self.relative_change(
             cells_df['BAU_XUniverse'], cells_df['VUE_XUniverse'])
         cells_df['VAR_XUniverse (BAU vs ADJ)'] = self.relative_change(
@@ -453,7 +855,6 @@ class XZTG:
             cells_df['BAU_XFactor'], cells_df['ADJ_XFactor'])
         cells_df['VAR_ZUniverse'] = self.relative_change(
             cells_df['BAU_ZUniverse'], cells_df['VUE_ZUniverse'])
-        return cells_df
     
     def area_channel_weight(self,
                             row,
@@ -472,7 +873,8 @@ class XZTG:
 
         Summary:
             Calculates the weight based on the Handler value and the ratio of the target column
-            value to the sum of target column values for matching rows.
+            value to the sum of target column values for matching rows. The stages compute 
+            all the rows at once with area_channel_weights.
         """
         if row['Handler'] == 1:
             mask = (df['Handler'] == 1) & \
@@ -486,6 +888,37 @@ class XZTG:
         else:
             return 0
 
+    def area_channel_weights(self,
+                             df,
+                             target_column_names):
+        """
+        Calculate the area-channel weights for several target columns at once.
+
+        Args:
+            df (pd.DataFrame): The entire DataFrame.
+            target_column_names (list): The names of the target columns for calculations.
+
+        Returns:
+            pd.DataFrame: The calculated area-channel weights, one column per target column.
+
+        Summary:
+            Groups the rows by Handler, StoreTypeChannel and NielsenArea, and divides
+            each target column value by the sum of the target column within its group.
+            Rows with Handler different from 1, or whose group sum is 0, get a weight of 0.
+        """
+        values = df[target_column_names]
+        group_sums = values.groupby([df['Handler'],
+                                     df['StoreTypeChannel'],
+                                     df['NielsenArea']]).transform('sum')
+        valid = (df['Handler'] == 1).to_numpy()[:, None] & \
+            group_sums.notna().to_numpy() & (group_sums != 0).to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weights = np.where(valid,
+                               values.to_numpy() / group_sums.to_numpy(),
+                               0.0)
+        return pd.DataFrame(weights, index=df.index, columns=target_column_names)
+
+    @pipeline_stage
     def set_cell_area_channel_weights(self):
         """
         Set area-channel weights for different scenarios.
@@ -495,21 +928,44 @@ class XZTG:
 
         Summary:
             Calculates and adds columns for BAU, VUE, and ADJ area-channel weights
-            for both N and NSPC scenarios.
+            for both N and NSPC scenarios, in a single grouped pass. With max_workers 
+            above 1, each INDEX and CHANNEL partition is computed in its own thread, 
+            unless an area-channel group spans several partitions.
         """
         cells_df = self.set_dummy_calc()
-        cells_df['BAU_N Area-Channel Cell Weight'] = cells_df.apply(lambda row: 
-            self.area_channel_weight(row, cells_df, 'BAU_ZUniverse'), axis=1)
-        cells_df['BAU_NSPC Area-Channel Cell Weight'] = cells_df.apply(lambda row: 
-            self.area_channel_weight(row, cells_df, 'BAU_XUniverse'), axis=1)
-        cells_df['VUE_N Area-Channel Cell Weight'] = cells_df.apply(lambda row: 
-            self.area_channel_weight(row, cells_df, 'VUE_ZUniverse'), axis=1)
-        cells_df['VUE_NSPC Area-Channel Cell Weight'] = cells_df.apply(lambda row: 
-            self.area_channel_weight(row, cells_df, 'VUE_XUniverse'), axis=1)
-        cells_df['ADJ_NSPC Area-Channel Cell Weight'] = cells_df.apply(lambda row: 
-            self.area_channel_weight(row, cells_df, 'ADJ_XUniverse'), axis=1)
-        return cells_df
+        max_workers = self.max_workers
+        if max_workers > 1:
+            partition_counts = cells_df.groupby(area_channel_group_cols)[
+                cell_partition_cols].nunique(dropna=False)
+            if (partition_counts > 1).any(axis=None):
+                print('Some area-channel groups span several INDEX and CHANNEL values; '
+                      'the area-channel weights are computed without partitioning.')
+                max_workers = 1
+
+        def add_partition_weights(partition):
+            self._add_area_channel_weights(partition)
+            return partition
+        return map_partitions(add_partition_weights, cells_df, cell_partition_cols,
+                              max_workers)
+
+    def _add_area_channel_weights(self,
+                                  cells_df: pd.DataFrame):
+        """
+        Add the area-channel weight columns.
+
+        Args:
+            cells_df (pd.DataFrame): The cell DataFrame to modify. Every cell of an 
+                area-channel group must be present for the weights to be correct.
+
+        Summary:
+            Computes the five weight columns of area_channel_weight_cols in one grouped pass.
+        """
+        weights = self.area_channel_weights(cells_df,
+                                            list(area_channel_weight_cols.values()))
+        for weight_col, target_col in area_channel_weight_cols.items():
+            cells_df[weight_col] = weights[target_col]
     
+    @pipeline_stage
     def set_cell_area_channel_weight_diff(self):
         """
         Calculate differences between area-channel weights.
@@ -522,6 +978,20 @@ class XZTG:
             area-channel weights for both N and NSPC scenarios.
         """
         cells_df = self.set_cell_area_channel_weights()
+        self._add_area_channel_weight_diff(cells_df)
+        return cells_df
+
+    def _add_area_channel_weight_diff(self,
+                                      cells_df: pd.DataFrame):
+        """
+        Add the area-channel weight difference columns.
+
+        Args:
+            cells_df (pd.DataFrame): The cell DataFrame to modify.
+
+        Summary:
+            Subtracts the BAU, VUE, and ADJ area-channel weights from each other.
+        """
         cells_df['N Area-Channel Cell Weight diff (BAU vs VUE)'] = (
             cells_df['BAU_N Area-Channel Cell Weight'] 
             - cells_df['VUE_N Area-Channel Cell Weight'])
@@ -534,7 +1004,6 @@ class XZTG:
         cells_df['NSPC Area-Channel Cell Weight diff (VUE vs ADJ)'] = (
             cells_df['VUE_NSPC Area-Channel Cell Weight'] 
             - cells_df['ADJ_NSPC Area-Channel Cell Weight'])
-        return cells_df
     
     def average_x_vs_z(self, 
                        x_column,
@@ -555,6 +1024,7 @@ class XZTG:
         avrg = np.round((x_column / z_column), 3)
         return avrg
     
+    @pipeline_stage
     def set_bau_vue_averages(self):
         """
         Set average values for BAU, VUE, and ADJ scenarios.
@@ -567,18 +1037,32 @@ class XZTG:
             for BAU, VUE, and ADJ scenarios.
         """
         cells_df = self.set_cell_area_channel_weight_diff()
-        cells_df['Average BAU Universe'] = cells_df.apply(lambda row:
-            self.average_x_vs_z(row['BAU_XUniverse'], row['BAU_ZUniverse']), axis=1)
-        cells_df['Average BAU Panel'] = cells_df.apply(lambda row:
-            self.average_x_vs_z(row['BAU_XPanel'], row['BAU_ZPanel']), axis=1)
-        cells_df['Average VUE Universe'] = cells_df.apply(lambda row:
-            self.average_x_vs_z(row['VUE_XUniverse'], row['VUE_ZUniverse']), axis=1)
-        cells_df['Average VUE Panel'] = cells_df.apply(lambda row:
-            self.average_x_vs_z(row['VUE_XPanel'], row['VUE_ZPanel']), axis=1)
-        cells_df['Average ADJ Universe'] = cells_df.apply(lambda row:
-            self.average_x_vs_z(row['ADJ_XUniverse'], row['VUE_ZUniverse']), axis=1)
+        self._add_averages(cells_df)
         return cells_df
 
+    def _add_averages(self,
+                      cells_df: pd.DataFrame):
+        """
+        Add the average Universe and Panel columns.
+
+        Args:
+            cells_df (pd.DataFrame): The cell DataFrame to modify.
+
+        Summary:
+            Computes the X vs Z averages for BAU, VUE, and ADJ scenarios.
+        """
+        cells_df['Average BAU Universe'] = self.average_x_vs_z(
+            cells_df['BAU_XUniverse'], cells_df['BAU_ZUniverse'])
+        cells_df['Average BAU Panel'] = self.average_x_vs_z(
+            cells_df['BAU_XPanel'], cells_df['BAU_ZPanel'])
+        cells_df['Average VUE Universe'] = self.average_x_vs_z(
+            cells_df['VUE_XUniverse'], cells_df['VUE_ZUniverse'])
+        cells_df['Average VUE Panel'] = self.average_x_vs_z(
+            cells_df['VUE_XPanel'], cells_df['VUE_ZPanel'])
+        cells_df['Average ADJ Universe'] = self.average_x_vs_z(
+            cells_df['ADJ_XUniverse'], cells_df['VUE_ZUniverse'])
+
+    @pipeline_stage
     def set_cell_flags(self, 
                        distance_param: float,
                        nspc_param: float, 
@@ -603,46 +1087,69 @@ class XZTG:
 
         Step-by-step:
         1. Call set_bau_vue_averages() to prepare the initial DataFrame
-        2. Add 'DTest' column by applying dtest to 'VUE_XZDistance':
+        2. Add 'DTest' column by evaluating dtest on 'VUE_XZDistance':
             - Returns 0 if absolute distance is within threshold
             - Returns 1 if absolute distance exceeds threshold
-        3. Add 'NSPCTest' column by applying var_test to 'VAR_XUniverse (BAU vs ADJ)':
+        3. Add 'NSPCTest' column by evaluating var_test on 'VAR_XUniverse (BAU vs ADJ)':
             - Returns 0 if variation is within NSPC parameter
             - Returns 1 if variation exceeds NSPC parameter
-        4. Add 'XFTest' column by applying var_test to 'VAR_XFactor (BAU vs ADJ)':
+        4. Add 'XFTest' column by evaluating var_test on 'VAR_XFactor (BAU vs ADJ)':
             - Returns 0 if X-Factor variation is within threshold
             - Returns 1 if X-Factor variation exceeds threshold
-        5. Add 'SignTest' column by applying sign_test to universe variations:
+        5. Add 'SignTest' column by evaluating sign_test on universe variations:
             - Returns 0 if signs are the same
             - Returns 1 if signs are different
-        6. Add 'VarDirectionGapTest' column by applying gap_difference_test:
+        6. Add 'VarDirectionGapTest' column by evaluating gap_difference_test:
             - Checks gap between 'VAR_XUniverse (BAU vs ADJ)' and 'VAR_ZUniverse'
             - Uses different tolerances for same and different directions
         7. Return the DataFrame with all test result columns
     """
         cells_df = self.set_bau_vue_averages()
-        cells_df['DTest'] = cells_df.apply(lambda row: self.dtest(
-            row['VUE_XZDistance'], distance_param), axis=1)
-        cells_df['NSPCTest'] = cells_df.apply(lambda row: self.var_test(
-            row['VAR_XUniverse (BAU vs ADJ)'], nspc_param), axis=1)
-        cells_df['XFTest'] = cells_df.apply(lambda row: self.var_test(
-            row['VAR_XFactor (BAU vs ADJ)'], xf_param), axis=1)
-        cells_df['SignTest'] = cells_df.apply(lambda row: self.sign_test(
-            row['VAR_XUniverse (BAU vs ADJ)'], row['VAR_ZUniverse']),
-            axis=1)
-        cells_df['VarDirectionGapTest'] = cells_df.apply(lambda row: self.gap_difference_test(
-            row['VAR_XUniverse (BAU vs ADJ)'], row['VAR_ZUniverse'], 
-            same_dir_gap_tolerance,
-            diff_dir_gap_tolerance),
-            axis=1)
+        self._add_flags(cells_df, distance_param, nspc_param, xf_param,
+                        same_dir_gap_tolerance, diff_dir_gap_tolerance)
         return cells_df
 
+    def _add_flags(self,
+                   cells_df: pd.DataFrame,
+                   distance_param: float,
+                   nspc_param: float, 
+                   xf_param: float,
+                   same_dir_gap_tolerance: float,
+                   diff_dir_gap_tolerance: float):
+        """
+        Add the diagnostic test columns.
+
+        Args:
+            cells_df (pd.DataFrame): The cell DataFrame to modify.
+            distance_param (float): Threshold parameter for distance test.
+            nspc_param (float): Threshold parameter for NSPC test.
+            xf_param (float): Threshold parameter for X-Factor test.
+            same_dir_gap_tolerance (float): Tolerance threshold for values in the same direction.
+            diff_dir_gap_tolerance (float): Tolerance threshold for values in different directions.
+
+        Summary:
+            Computes the test columns described in set_cell_flags, steps 2 to 6.
+        """
+        cells_df['DTest'] = self.dtest(
+            cells_df['VUE_XZDistance'], distance_param)
+        cells_df['NSPCTest'] = self.var_test(
+            cells_df['VAR_XUniverse (BAU vs ADJ)'], nspc_param)
+        cells_df['XFTest'] = self.var_test(
+            cells_df['VAR_XFactor (BAU vs ADJ)'], xf_param)
+        cells_df['SignTest'] = self.sign_test(
+            cells_df['VAR_XUniverse (BAU vs ADJ)'], cells_df['VAR_ZUniverse'])
+        cells_df['VarDirectionGapTest'] = self.gap_difference_test(
+            cells_df['VAR_XUniverse (BAU vs ADJ)'], cells_df['VAR_ZUniverse'], 
+            same_dir_gap_tolerance,
+            diff_dir_gap_tolerance)
+
     def get_cell_diagnostics(self, 
                              distance_param: float,
                              nspc_param: float, 
                              xf_param: float,
                              same_dir_gap_tolerance: float,
-                             diff_dir_gap_tolerance: float):
+                             diff_dir_gap_tolerance: float,
+                             save: bool = True):
         """
         Generate comprehensive cell diagnostics and save results.
 
@@ -652,6 +1159,7 @@ class XZTG:
             xf_param (float): Threshold parameter for X-Factor test.
             same_dir_gap_tolerance (float): Tolerance threshold for values in the same direction.
             diff_dir_gap_tolerance (float): Tolerance threshold for values in different directions.
+            save (bool, optional): Whether to save the results (steps 3 to 5). Defaults to True.
 
         Returns:
             pd.DataFrame: DataFrame containing detailed cell diagnostic information.
@@ -663,22 +1171,195 @@ class XZTG:
         Step-by-step:
         1. Call set_cell_flags with all input parameters to generate test flags
         2. Add 'CellDiagnostic' column by computing cell condition:
-            - Sum the test flags (DTest, NSPCTest, XFTest, SignTest)
-            - Classify cell as 'Anomalous' if sum is 2 or greater
-            - Classify cell as 'Normal' if sum is less than 2
+            - Sum the test flags (DTest, NSPCTest, XFTest, SignTest, VarDirectionGapTest)
+            - Classify cell as 'Anomalous' if sum is 3 or greater
+            - Classify cell as 'Normal' if sum is less than 3
         3. Save the diagnostic results to a CSV file:
             - File path: {self.output_dir}/XZTemplate_v0.csv
             - Exclude index column from CSV export
-        4. Return the final DataFrame with all diagnostic information
+        4. If delta is True, save the rows that changed since the previous run to 
+           {self.output_dir}/XZTemplate_v0_delta.csv and log them in changelog.csv
+        5. Save the run report ({self.output_dir}/run_report.json) if the profiler is enabled
+        6. Return the final DataFrame with all diagnostic information
         """
         cells_df = self.set_cell_flags(distance_param, nspc_param, xf_param, 
                                        same_dir_gap_tolerance, diff_dir_gap_tolerance)
-        cells_df['CellDiagnostic'] = cells_df.apply(lambda row: self.cell_cond(
-            row['DTest'], row['NSPCTest'], row['XFTest'], row['SignTest'],
-            row['VarDirectionGapTest']),
-            axis=1)
+        cells_df['CellDiagnostic'] = self.cell_cond(
+            cells_df['DTest'], cells_df['NSPCTest'], cells_df['XFTest'],
+            cells_df['SignTest'], cells_df['VarDirectionGapTest'])
         cells_df.drop_duplicates(inplace=True, ignore_index=True)
-        cells_df.to_csv(f'{self.output_dir}/XZTemplate_v0.csv',
-                        index=False)
+        if not save:
+            return cells_df
+        previous = od.read_previous(self.output_dir, 'XZTemplate_v0.csv') if self.delta else None
+        with self.profiler.stage('save XZTemplate_v0.csv', type(self).__name__) as record:
+            cells_df.to_csv(f'{self.output_dir}/XZTemplate_v0.csv',
+                            index=False)
+            record['rows_out'] = len(cells_df)
         print('XZTemplate_v0.csv has been saved to the outputs directory.')
+        if self.delta:
+            with self.profiler.stage('delta XZTemplate_v0.csv', type(self).__name__):
+                od.write_delta(previous, cells_df, self.output_dir, 'XZTemplate_v0.csv')
+        self.profiler.write(f'{self.output_dir}/run_report.json', self.working_dir)
         return cells_df
+
+    def _adj_changes_frame(self,
+                           adj_changes: pd.DataFrame):
+        """
+        Validate ADJ edits and index them by Cell_ID.
+
+        Args:
+            adj_changes (pd.DataFrame): 'Cell_ID' plus ADJ_XFactor and/or ADJ_XUniverse columns.
+
+        Returns:
+            pd.DataFrame: The new ADJ values indexed by Cell_ID, keeping the last edit of each cell.
+
+        Raises:
+            ValueError: If 'Cell_ID' or every ADJ column is missing, or if other columns are present.
+        """
+        changes_columns = adj_changes.columns.tolist()
+        column_error_list = [col for col in changes_columns
+                             if col not in ['Cell_ID'] + adj_columns]
+        if ('Cell_ID' not in changes_columns
+                or len(column_error_list) > 0
+                or not any(col in changes_columns for col in adj_columns)):
+            print('The ADJ changes must have a Cell_ID column and at least one of:')
+            for column in adj_columns:
+                print('\t', column)
+            if len(column_error_list) > 0:
+                print('The following columns are not allowed:')
+                for column in column_error_list:
+                    print('\t', column)
+            raise ValueError('Please check the columns of the ADJ changes.')
+        changes = adj_changes.drop_duplicates('Cell_ID', keep='last')
+        return changes.set_index('Cell_ID').astype(float)
+
+    def update_adjustments(self,
+                           adj_changes: pd.DataFrame):
+        """
+        Apply analysts' ADJ_XFactor / ADJ_XUniverse edits, recomputing only the affected cells.
+
+        Args:
+            adj_changes (pd.DataFrame): 'Cell_ID' plus the edited ADJ_XFactor and/or 
+                ADJ_XUniverse columns. Missing values keep the current ADJ value.
+
+        Returns:
+            pd.DataFrame or None: The recomputed rows (every cell of the area-channel groups 
+                touched by the edits), including 'CellDiagnostic' if the cell flags were 
+                already computed. None if no stage from set_dummy_calc on is cached, in which 
+                case the edits are applied on the next computation.
+
+        Summary:
+            Records the edits in adj_overrides, so later full computations keep them, and 
+            patches the cached stage results in place instead of invalidating them.
+
+        Step-by-step:
+        1. Validate adj_changes and merge them into adj_overrides.
+        2. Take the cells of every (Handler, StoreTypeChannel, NielsenArea) group with an 
+           edited cell from the most downstream cached stage.
+        3. On those rows only, apply the edits and recompute the columns of each cached 
+           stage, in stage order: variations, area-channel weights, weight differences, 
+           averages, and cell flags (with the parameters the flags were cached with).
+        4. Write the recomputed rows back into every cached stage result.
+        5. Return the recomputed rows.
+        """
+        changes = self._adj_changes_frame(adj_changes)
+        self._adj_overrides = changes.combine_first(self._adj_overrides)[adj_columns]
+        patch_steps = {'set_dummy_calc': self._add_variations,
+                       'set_cell_area_channel_weights': self._add_area_channel_weights,
+                       'set_cell_area_channel_weight_diff': self._add_area_channel_weight_diff,
+                       'set_bau_vue_averages': self._add_averages}
+        if 'set_cell_flags' in self._stage_cache:
+            flag_params = dict(self._stage_cache['set_cell_flags'][0])
+            patch_steps['set_cell_flags'] = lambda df: self._add_flags(df, **flag_params)
+        cached = [stage for stage in self.stage_graph
+                  if stage in patch_steps and stage in self._stage_cache]
+        if len(cached) == 0:
+            return None
+        cells_df = self._stage_cache[cached[-1]][1]
+        changed = cells_df['Cell_ID'].isin(changes.index).to_numpy()
+        group_keys = pd.MultiIndex.from_frame(
+            cells_df[['Handler', 'StoreTypeChannel', 'NielsenArea']])
+        rows = group_keys.isin(group_keys[changed]) | changed
+        cells_sub = cells_df.loc[rows].copy()
+        self._apply_adj_overrides(cells_sub, changes)
+        for stage in cached:
+            patch_steps[stage](cells_sub)
+        for stage in cached:
+            stage_df = self._stage_cache[stage][1]
+            stage_cols = [col for col in cells_sub.columns if col in stage_df.columns]
+            stage_df.loc[rows, stage_cols] = cells_sub[stage_cols]
+        if 'set_cell_flags' in cached:
+            cells_sub['CellDiagnostic'] = self.cell_cond(
+                cells_sub['DTest'], cells_sub['NSPCTest'], cells_sub['XFTest'],
+                cells_sub['SignTest'], cells_sub['VarDirectionGapTest'])
+        return cells_sub
+
+    def sweep_cell_diagnostics(self,
+                               distance_params: list,
+                               nspc_params: list,
+                               xf_params: list,
+                               same_dir_gap_tolerances: list,
+                               diff_dir_gap_tolerances: list):
+        """
+        Count anomalous cells for every combination of diagnostic parameters.
+
+        Args:
+            distance_params (list): Values to evaluate for the distance test.
+            nspc_params (list): Values to evaluate for the NSPC test.
+            xf_params (list): Values to evaluate for the X-Factor test.
+            same_dir_gap_tolerances (list): Values to evaluate for the same direction tolerance.
+            diff_dir_gap_tolerances (list): Values to evaluate for the different direction tolerance.
+
+        Returns:
+            pd.DataFrame: One row per parameter combination, with the parameter values and 
+                          the 'AnomalousCells' and 'Cells' counts.
+
+        Summary:
+            Computes the parameter-independent columns once (through set_bau_vue_averages), 
+            evaluates each test for all of its parameter values at once, and adds the test 
+            results up one (distance, nspc, xf) combination at a time, so the largest array 
+            held is the one of the gap tests, whatever the size of the other grids.
+            Nothing is written to the outputs directory.
+
+        Step-by-step:
+        1. Call set_bau_vue_averages() and drop duplicated rows, as get_cell_diagnostics does.
+        2. Evaluate, with one array operation each:
+            - DTest for every distance_param -> (distance, cell)
+            - NSPCTest for every nspc_param -> (nspc, cell)
+            - XFTest for every xf_param -> (xf, cell)
+            - SignTest, which has no parameter -> (cell)
+            - VarDirectionGapTest for every pair of tolerances -> (same, diff, cell)
+        3. For each combination of distance_param, nspc_param and xf_param, add their tests 
+           and SignTest, broadcast the sum over the tolerance pairs, and count the cells 
+           whose sum is 3 or greater.
+        4. Return the counts next to the parameter grid.
+        """
+        cells_df = self.set_bau_vue_averages()
+        cells_df.drop_duplicates(inplace=True, ignore_index=True)
+        distance = cells_df['VUE_XZDistance'].to_numpy()
+        var_xu = cells_df['VAR_XUniverse (BAU vs ADJ)'].to_numpy()
+        var_xf = cells_df['VAR_XFactor (BAU vs ADJ)'].to_numpy()
+        var_zu = cells_df['VAR_ZUniverse'].to_numpy()
+        grid = [np.asarray(values, dtype=float).reshape(-1)
+                for values in [distance_params, nspc_params, xf_params,
+                               same_dir_gap_tolerances, diff_dir_gap_tolerances]]
+        d_tests = self.dtest(distance[None, :], grid[0][:, None]).astype(np.int8)
+        nspc_tests = self.var_test(var_xu[None, :], grid[1][:, None]).astype(np.int8)
+        xf_tests = self.var_test(var_xf[None, :], grid[2][:, None]).astype(np.int8)
+        sign_tests = self.sign_test(var_xu, var_zu).astype(np.int8)
+        gap_tests = self.gap_difference_test(var_xu[None, None, :], var_zu[None, None, :],
+                                             grid[3][:, None, None],
+                                             grid[4][None, :, None]).astype(np.int8)
+        anomalous = np.zeros([len(values) for values in grid], dtype=np.int64)
+        for i, j, k in np.ndindex(*anomalous.shape[:3]):
+            tests = d_tests[i] + nspc_tests[j] + xf_tests[k] + sign_tests
+            anomalous[i, j, k] = ((tests + gap_tests) >= 3).sum(axis=-1)
+        mesh = np.meshgrid(*grid, indexing='ij')
+        sweep_df = pd.DataFrame({'distance_param': mesh[0].ravel(),
+                                 'nspc_param': mesh[1].ravel(),
+                                 'xf_param': mesh[2].ravel(),
+                                 'same_dir_gap_tolerance': mesh[3].ravel(),
+                                 'diff_dir_gap_tolerance': mesh[4].ravel(),
+                                 'AnomalousCells': anomalous.ravel(),
+                                 'Cells': len(cells_df)})
+        return sweep_df
@@ -0,0 +1,82 @@
+import os
+import shutil
+import sys
+import pandas as pd
+import pytest
+
+"""
+Shared fixtures of the tests. Each test runs on its own copy of the sample
+market in inputs/, so the outputs and the clean cache of the repository are
+never touched. The reference outputs in tests/reference were saved by the
+scripts before any optimization, and the refactored stages must reproduce
+them.
+"""
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+reference_dir = f'{repo_dir}/tests/reference'
+sys.path.insert(0, f'{repo_dir}/scripts')
+
+params = {'distance_param': 3,
+          'nspc_param': 0.15,
+          'xf_param': 0.05,
+          'cell_cat_param': 0.2,
+          'cell_weight_param': 0.1,
+          'same_dir_gap_tolerance': 0.1,
+          'diff_dir_gap_tolerance': 0.05}
+cell_params = ['distance_param',
+               'nspc_param',
+               'xf_param',
+               'same_dir_gap_tolerance',
+               'diff_dir_gap_tolerance']
+output_names = ['XZTemplate_v0.csv',
+                'MBDCat_Impacts_v0.csv',
+                'MBDCatCell_Impacts_v0.csv']
+
+
+def copy_market(working_dir: str):
+    """
+    Copy the sample inputs to a new working directory with an empty outputs folder.
+
+    Args:
+        working_dir (str): The working directory to create.
+
+    Returns:
+        str: working_dir.
+    """
+    shutil.copytree(f'{repo_dir}/inputs', f'{working_dir}/inputs')
+    os.makedirs(f'{working_dir}/outputs')
+    return working_dir
+
+
+def read_reference(name: str):
+    """
+    Read a reference output.
+
+    Args:
+        name (str): The output file name, e.g. 'XZTemplate_v0.csv'.
+
+    Returns:
+        pd.DataFrame: The reference output.
+    """
+    return pd.read_csv(f'{reference_dir}/{name}.gz')
+
+
+def assert_output_equal(working_dir: str,
+                        name: str,
+                        expected: pd.DataFrame = None):
+    """
+    Check a saved output against the reference, or against another output.
+
+    Args:
+        working_dir (str): The working directory of the run.
+        name (str): The output file name.
+        expected (pd.DataFrame, optional): The expected output. Defaults to the reference.
+    """
+    expected = read_reference(name) if expected is None else expected
+    pd.testing.assert_frame_equal(pd.read_csv(f'{working_dir}/outputs/{name}'), expected,
+                                  check_dtype=False, check_exact=False, rtol=1e-12)
+
+
+@pytest.fixture
+def market_dir(tmp_path):
+    return copy_market(str(tmp_path / 'market'))
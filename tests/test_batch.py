@@ -0,0 +1,33 @@
+import pandas as pd
+import MarketBatch as mb
+import MBDCatCellImpacts as MBDCCI
+from conftest import assert_output_equal, copy_market, output_names, params
+
+
+def test_run_markets(tmp_path):
+    markets = [copy_market(str(tmp_path / name)) for name in ['CERVEZAS', 'GASEOSAS']]
+    missing = str(tmp_path / 'MISSING')
+    summary_path = str(tmp_path / 'batch_summary.csv')
+    summary_df = mb.run_markets(markets + [missing], params,
+                                market_params={markets[1]: {'cell_cat_param': 0.01}},
+                                max_workers=2, summary_path=summary_path)
+    assert summary_df['WorkingDir'].tolist() == markets + [missing]
+    assert summary_df['Status'].tolist() == ['OK', 'OK', 'Failed']
+    assert summary_df.loc[2, 'Error'].startswith('FileNotFoundError')
+    assert summary_df.loc[:1, 'Error'].isna().all()
+    for name in output_names:
+        assert_output_equal(markets[0], name)
+    for row, market in zip(summary_df.itertuples(), markets):
+        mbdcci = MBDCCI.MBDCCImpcts(market, *{**params, **(
+            {'cell_cat_param': 0.01} if market == markets[1] else {})}.values())
+        cell_diag = mbdcci.get_mbd_diagnostics()
+        mbd_df = mbdcci.set_mbd_targets()
+        assert row.Cells == len(mbdcci.cell_adj_df)
+        assert row.MBDCatCells == len(cell_diag)
+        assert row.AnomalousMBDCatCells == (cell_diag['MBDCatDiag'] == 'Anomalous').sum()
+        assert row.MBDCats == len(mbd_df)
+        assert row.MBDs == mbd_df['MbdID'].nunique() <= row.MBDCats
+        assert row.OutOfTargetMBDs == mbd_df.loc[mbd_df['OutOfTarget'] >= 1,
+                                                 'MbdID'].nunique()
+    assert summary_df.loc[0, 'AnomalousMBDCatCells'] != summary_df.loc[1, 'AnomalousMBDCatCells']
+    pd.testing.assert_frame_equal(pd.read_csv(summary_path), summary_df, check_dtype=False)
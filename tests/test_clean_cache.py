@@ -0,0 +1,90 @@
+import json
+import os
+import pandas as pd
+import pytest
+import InputsPreCleaning as ipc
+import MBDCatCellImpacts as MBDCCI
+from conftest import assert_output_equal, output_names, params
+
+all_files = {csv: None for csv in ipc.input_files_names}
+
+
+def clean_mtimes(working_dir: str):
+    """
+    Read the modification time of every clean file of a working directory.
+    """
+    return {csv: os.stat(ipc.clean_file_path(f'{working_dir}/cache', csv)).st_mtime_ns
+            for csv in ipc.input_files_names}
+
+
+def test_cache_reused(market_dir, capsys):
+    cleaning = ipc.CleaningInputs(market_dir)
+    cleaned = cleaning.get_clean_frames(all_files)
+    with open(cleaning.manifest_path) as file:
+        assert sorted(json.load(file)) == sorted(ipc.input_files_names)
+    mtimes = clean_mtimes(market_dir)
+    capsys.readouterr()
+    reused = ipc.CleaningInputs(market_dir).get_clean_frames(all_files)
+    assert 'the cached clean files were reused' in capsys.readouterr().out
+    assert clean_mtimes(market_dir) == mtimes
+    # The frames handed over from memory are typed as the ones read back from the cache.
+    for csv in ipc.input_files_names:
+        pd.testing.assert_frame_equal(cleaned[csv], reused[csv])
+
+
+def test_cache_invalidated_by_changed_input(market_dir, capsys):
+    cleaning = ipc.CleaningInputs(market_dir)
+    cleaning.get_clean_csvs()
+    with open(cleaning.manifest_path) as file:
+        manifest = json.load(file)
+    mtimes = clean_mtimes(market_dir)
+    changed = 'MBD_TypeTarget.csv'
+    with open(f'{market_dir}/inputs/{changed}', 'a') as file:
+        file.write('20126364,CERVEZAS,NEW_TOTAL COLOMBIA_75,TOTAL COUNTRY,0.05\n')
+    capsys.readouterr()
+    frames = ipc.CleaningInputs(market_dir).get_clean_frames({changed: None})
+    out = capsys.readouterr().out
+    assert changed in out
+    with open(cleaning.manifest_path) as file:
+        updated = json.load(file)
+    new_mtimes = clean_mtimes(market_dir)
+    for csv in ipc.input_files_names:
+        assert (updated[csv] != manifest[csv]) == (csv == changed)
+        assert (new_mtimes[csv] != mtimes[csv]) == (csv == changed)
+    assert (frames[changed]['Target'] == 0.05).sum() == 1
+
+
+def test_cache_invalidated_by_schema_version(market_dir, monkeypatch, capsys):
+    ipc.CleaningInputs(market_dir).get_clean_csvs()
+    monkeypatch.setattr(ipc, 'schema_version', ipc.schema_version + 1)
+    capsys.readouterr()
+    ipc.CleaningInputs(market_dir).get_clean_csvs()
+    out = capsys.readouterr().out
+    assert all(csv in out for csv in ipc.input_files_names)
+
+
+def test_header_error_before_cleaning(market_dir):
+    path = f'{market_dir}/inputs/MBD_NumDist.csv'
+    with open(path) as file:
+        lines = file.readlines()
+    lines[0] = lines[0].replace('MbdID', 'MbdId', 1)
+    with open(path, 'w') as file:
+        file.writelines(lines)
+    with pytest.raises(ValueError):
+        ipc.CleaningInputs(market_dir).get_clean_csvs()
+    assert not os.path.exists(f'{market_dir}/cache')
+
+
+def test_missing_input_file(market_dir):
+    os.remove(f'{market_dir}/inputs/VUE_SampleNSPC.csv')
+    with pytest.raises(FileNotFoundError):
+        ipc.CleaningInputs(market_dir).get_clean_csvs()
+
+
+def test_run_from_cache_matches_reference(market_dir):
+    MBDCCI.MBDCCImpcts(market_dir, *params.values()).get_mbd_diagnostics()
+    for name in output_names:
+        os.remove(f'{market_dir}/outputs/{name}')
+    MBDCCI.MBDCCImpcts(market_dir, *params.values()).get_mbd_diagnostics()
+    for name in output_names:
+        assert_output_equal(market_dir, name)
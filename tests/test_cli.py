@@ -0,0 +1,86 @@
+import json
+import pytest
+import RunTemplate as rt
+from conftest import params
+
+
+def flags(values: dict):
+    """
+    Turn parameters into command line flags.
+    """
+    return [item for name, value in values.items()
+            for item in ['--' + name.replace('_', '-'), str(value)]]
+
+
+def write_config(tmp_path,
+                 config: dict):
+    path = tmp_path / 'market.json'
+    path.write_text(json.dumps(config))
+    return str(path)
+
+
+def test_config_merged_with_flags(tmp_path, market_dir):
+    config = write_config(tmp_path, {'working_dir': market_dir, **params,
+                                     'cell_cat_param': '0.3', 'max_workers': 2.0,
+                                     'delta': True})
+    args = rt.build_parser().parse_args(['--config', config, '--xf-param', '0.07',
+                                         '--max-workers', '3'])
+    resolved = rt.resolve_params(args)
+    assert resolved == {'working_dir': market_dir, **params, 'xf_param': 0.07,
+                        'cell_cat_param': 0.3, 'max_workers': 3, 'delta': True}
+    args = rt.build_parser().parse_args(['--config', config])
+    assert rt.resolve_params(args)['max_workers'] == 2
+
+
+@pytest.mark.parametrize('config', [{'cell_cat_param': 'high'},
+                                    {'cell_cat_param': True},
+                                    {'distance_param': float('nan')},
+                                    {'chunksize': 0},
+                                    {'max_workers': 1.5},
+                                    {'delta': 'yes'},
+                                    {'non_handler_patterns': 'SCAN'},
+                                    {'unknown_param': 1},
+                                    {'cells_only': True, 'workbook': 'market.xlsm'},
+                                    {'cells_only': True, 'chunksize': 1000}])
+def test_invalid_config_is_usage_error(tmp_path, market_dir, config):
+    path = write_config(tmp_path, {'working_dir': market_dir, **params, **config})
+    assert rt.main(['--config', path, '--quiet']) == rt.exit_codes['usage']
+
+
+def test_missing_param_is_usage_error(market_dir):
+    values = {key: value for key, value in params.items() if key != 'xf_param'}
+    assert rt.main(['--working-dir', market_dir, *flags(values)]) == rt.exit_codes['usage']
+
+
+def test_run(market_dir, capsys):
+    assert rt.main(['--working-dir', market_dir, *flags(params), '--quiet']) == 0
+    summary = json.loads(capsys.readouterr().out)
+    assert summary['MBDs'] <= summary['MBDCats']
+    assert summary['Cells'] > summary['AnomalousCells'] > 0
+
+
+def test_cells_only_run(market_dir, capsys):
+    values = {key: params[key] for key in rt.cell_param_names}
+    assert rt.main(['--working-dir', market_dir, *flags(values), '--cells-only',
+                    '--quiet']) == 0
+    assert 'MBDs' not in json.loads(capsys.readouterr().out)
+
+
+def test_missing_inputs(tmp_path):
+    assert rt.main(['--working-dir', str(tmp_path / 'none'), *flags(params),
+                    '--quiet']) == rt.exit_codes['missing_files']
+
+
+def test_invalid_input_values(market_dir):
+    path = f'{market_dir}/inputs/MBD_TypeTarget.csv'
+    with open(path, 'a') as file:
+        file.write('20126364,CERVEZAS,NEW_TOTAL COLOMBIA_75,TOTAL COUNTRY,high\n')
+    assert rt.main(['--working-dir', market_dir, *flags(params),
+                    '--quiet']) == rt.exit_codes['invalid_inputs']
+
+
+def test_internal_error_is_not_invalid_inputs(market_dir, monkeypatch):
+    def run(params):
+        raise KeyError('Cell_ID')
+    monkeypatch.setattr(rt, 'run', run)
+    assert rt.main(['--working-dir', market_dir, *flags(params)]) == rt.exit_codes['failed']
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import MBDCatCellImpacts as MBDCCI
+import OutputDelta as od
+from conftest import output_names, params
+
+
+def make_runs():
+    """
+    Build two runs of a small XZTemplate-like output: cell 1 is unchanged but for float 
+    noise and missing values, cell 2 has a changed factor, cell 3 was removed, and cell 4 
+    is inserted.
+    """
+    previous = pd.DataFrame({'Cell_ID': [1, 2, 3],
+                             'Cell_Name': ['A', 'B', 'C'],
+                             'ADJ_XFactor': [1.5, 2.0, 3.0],
+                             'Comments': [np.nan, 'x', np.nan]})
+    current = pd.DataFrame({'Cell_ID': [4, 2, 1],
+                            'Cell_Name': pd.Categorical(['D', 'B', 'A']),
+                            'ADJ_XFactor': [4.0, 2.5, 1.5 * (1 + 1e-14)],
+                            'Comments': [np.nan, 'x', np.nan]})
+    return previous, current
+
+
+def test_diff_outputs():
+    previous, current = make_runs()
+    delta, changed_columns = od.diff_outputs(previous, od._as_saved(current, previous),
+                                             ['Cell_ID'])
+    assert delta['Change'].tolist() == ['changed', 'removed', 'inserted']
+    assert delta['Cell_ID'].tolist() == [2, 3, 4]
+    assert delta['ADJ_XFactor'].tolist() == [2.5, 3.0, 4.0]
+    assert changed_columns == ['ADJ_XFactor']
+
+
+def test_diff_outputs_tolerance():
+    previous, _ = make_runs()
+    current = previous.assign(ADJ_XFactor=previous['ADJ_XFactor'] * (1 + 1e-10))
+    delta, changed_columns = od.diff_outputs(previous, current, ['Cell_ID'])
+    assert delta['Change'].tolist() == ['changed'] * 3
+    assert changed_columns == ['ADJ_XFactor']
+    current = previous.assign(ADJ_XFactor=previous['ADJ_XFactor'] * (1 + 1e-13))
+    delta, changed_columns = od.diff_outputs(previous, current, ['Cell_ID'])
+    assert delta.empty and changed_columns == []
+
+
+def test_write_delta_changelog(tmp_path):
+    previous, current = make_runs()
+    logs = [od.write_delta(None, previous, str(tmp_path), 'XZTemplate_v0.csv', run='first'),
+            od.write_delta(previous, current, str(tmp_path), 'XZTemplate_v0.csv',
+                           run='second')]
+    changelog = pd.read_csv(tmp_path / 'changelog.csv', keep_default_na=False)
+    assert changelog.columns.tolist() == od.changelog_columns
+    assert changelog.to_dict('records') == logs
+    assert logs[0] == {'Run': 'first', 'File': 'XZTemplate_v0.csv', 'Inserted': 3,
+                       'Removed': 0, 'Changed': 0, 'Unchanged': 0, 'ChangedColumns': ''}
+    assert logs[1] == {'Run': 'second', 'File': 'XZTemplate_v0.csv', 'Inserted': 1,
+                       'Removed': 1, 'Changed': 1, 'Unchanged': 1,
+                       'ChangedColumns': 'ADJ_XFactor'}
+    delta = pd.read_csv(tmp_path / 'XZTemplate_v0_delta.csv')
+    assert delta.columns.tolist() == ['Change'] + previous.columns.tolist()
+    assert delta['Change'].tolist() == ['changed', 'removed', 'inserted']
+
+
+def test_delta_runs(market_dir):
+    changelog_path = f'{market_dir}/outputs/changelog.csv'
+    MBDCCI.MBDCCImpcts(market_dir, *params.values(), delta=True).get_mbd_diagnostics()
+    first = pd.read_csv(changelog_path)
+    assert (first['Inserted'] > 0).all() and (first['Unchanged'] == 0).all()
+    # The outputs held in memory compare equal to the same outputs read back from disk.
+    MBDCCI.MBDCCImpcts(market_dir, *params.values(), delta=True).get_mbd_diagnostics()
+    second = pd.read_csv(changelog_path).iloc[len(first):]
+    assert sorted(second['File']) == sorted(output_names)
+    assert (second[['Inserted', 'Removed', 'Changed']] == 0).all().all()
+    assert second['Unchanged'].tolist() == first['Inserted'].tolist()
+    changed = {**params, 'cell_cat_param': 0.01}
+    MBDCCI.MBDCCImpcts(market_dir, *changed.values(), delta=True).get_mbd_diagnostics()
+    third = pd.read_csv(changelog_path).iloc[len(first) + len(second):].set_index('File')
+    assert third.loc['MBDCatCell_Impacts_v0.csv', 'Changed'] > 0
+    assert 'MBDCatDiag' in third.loc['MBDCatCell_Impacts_v0.csv', 'ChangedColumns']
+    assert third.loc['XZTemplate_v0.csv', 'Changed'] == 0
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+import MBDCatCellImpacts as MBDCCI
+import SalesIncidence as si
+from conftest import assert_output_equal, params
+
+nan_cell_id = 10003434
+
+
+@pytest.fixture
+def nan_market(market_dir):
+    """
+    The sample market with the X Factor of one cell with impacts left empty.
+    """
+    path = f'{market_dir}/inputs/VUE_SampleNSPC.csv'
+    with open(path, newline='') as file:
+        content = file.read()
+    assert content.count(',45.1009,11.6667,') == 1
+    with open(path, 'w', newline='') as file:
+        file.write(content.replace(',45.1009,11.6667,', ',,11.6667,'))
+    return market_dir
+
+
+def test_factor_vector():
+    incidence = si.SalesIncidence(pd.DataFrame({'MbdID': [1, 1],
+                                                'MbdName': ['M1', 'M1'],
+                                                'CategoryCode': [10, 10],
+                                                'CategoryName': ['C', 'C'],
+                                                'Cell_ID': [1, 2],
+                                                'Baseline_Sales': [1.0, 1.0],
+                                                'UnprojectedSales': [1.0, 2.0]}))
+    factors = pd.Series([3.0, np.nan, 5.0], index=[1, 2, 2])
+    np.testing.assert_array_equal(incidence.factor_vector(factors), [3.0, 5.0])
+    factors = pd.Series([3.0, np.nan], index=[1, 2])
+    np.testing.assert_array_equal(incidence.factor_vector(factors), [3.0, 0.0])
+    with pytest.raises(ValueError):
+        incidence.factor_vector(pd.Series([3.0], index=[1]))
+
+
+def test_nan_xfactor_skipped(nan_market):
+    mbdcci = MBDCCI.MBDCCImpcts(nan_market, *params.values())
+    assert mbdcci.cell_adj_df.loc[mbdcci.cell_adj_df['Cell_ID'] == nan_cell_id,
+                                  'VUE_XFactor'].isna().all()
+    mbd_df = mbdcci.set_mbd_impacts()
+    # The sums of the cell projected sales by groupby, which skip NaN.
+    expected = mbdcci._sum_mbd_sales(mbdcci.set_cell_impacts()).reset_index()
+    pd.testing.assert_frame_equal(mbd_df[expected.columns], expected,
+                                  check_exact=False, rtol=1e-12)
+    assert np.isfinite(mbd_df[['VUE_ProjectedSales', 'ADJ_ProjectedSales']]).all().all()
+
+
+def test_nan_xfactor_streaming_matches_in_memory(nan_market):
+    MBDCCI.MBDCCImpcts(nan_market, *params.values()).get_mbd_diagnostics()
+    expected = {name: pd.read_csv(f'{nan_market}/outputs/{name}')
+                for name in ['MBDCat_Impacts_v0.csv', 'MBDCatCell_Impacts_v0.csv']}
+    MBDCCI.MBDCCImpcts(nan_market, *params.values(), chunksize=997).stream_mbd_diagnostics()
+    for name, df in expected.items():
+        assert_output_equal(nan_market, name, df)
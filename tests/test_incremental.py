@@ -0,0 +1,51 @@
+import os
+import numpy as np
+import pandas as pd
+import MBDCatCellImpacts as MBDCCI
+from conftest import cell_params, params
+
+
+def cell_diagnostics(mbdcci: MBDCCI.MBDCCImpcts):
+    """
+    Recompute the cell diagnostics of an object with its current parameters.
+    """
+    return mbdcci.xztg.get_cell_diagnostics(*[params[name] for name in cell_params])
+
+
+def test_update_adjustments_matches_full_recompute(market_dir):
+    mbdcci = MBDCCI.MBDCCImpcts(market_dir, *params.values())
+    base = mbdcci.get_mbd_diagnostics()
+    cell_ids = mbdcci.cell_adj_df['Cell_ID'].iloc[[3, 40, 41, 200]].tolist()
+    updated = mbdcci.update_adjustments(pd.DataFrame({'Cell_ID': cell_ids,
+                                                      'ADJ_XFactor': [1.5, np.nan, 2.0, 0.7],
+                                                      'ADJ_XUniverse': [np.nan, 1234., 99., 10.]}))
+    assert 0 < len(updated) < len(base)
+    mbdcci.update_adjustments(pd.DataFrame({'Cell_ID': [cell_ids[1]], 'ADJ_XUniverse': [5.]}))
+    mbdcci.update_adjustments(pd.DataFrame({'Cell_ID': [cell_ids[0]], 'ADJ_XFactor': [500.]}))
+    incremental_cells = mbdcci.cell_adj_df
+    incremental_mbd = mbdcci.set_mbd_targets()
+    incremental = mbdcci.get_mbd_diagnostics()
+
+    full = MBDCCI.MBDCCImpcts(market_dir, *params.values())
+    full.xztg.adj_overrides = mbdcci.xztg.adj_overrides
+    full.cell_adj_df = cell_diagnostics(full)
+    pd.testing.assert_frame_equal(incremental_cells, full.cell_adj_df)
+    pd.testing.assert_frame_equal(cell_diagnostics(mbdcci), full.cell_adj_df)
+    pd.testing.assert_frame_equal(incremental, full.get_mbd_diagnostics())
+    pd.testing.assert_frame_equal(incremental_mbd, full.set_mbd_targets())
+    assert (incremental['MBDCatDiag'] != base['MBDCatDiag']).any()
+
+
+def test_update_adjustments_before_diagnostics(market_dir):
+    mbdcci = MBDCCI.MBDCCImpcts(market_dir, *params.values())
+    cell_id = mbdcci.cell_adj_df['Cell_ID'].iloc[3]
+    os.remove(f'{market_dir}/outputs/XZTemplate_v0.csv')
+    assert mbdcci.update_adjustments(pd.DataFrame({'Cell_ID': [cell_id],
+                                                   'ADJ_XFactor': [1.5]})) is None
+    # The fallback recomputes the cell diagnostics without saving them.
+    assert not os.path.exists(f'{market_dir}/outputs/XZTemplate_v0.csv')
+    full = MBDCCI.MBDCCImpcts(market_dir, *params.values())
+    full.xztg.adj_overrides = mbdcci.xztg.adj_overrides
+    full.cell_adj_df = cell_diagnostics(full)
+    pd.testing.assert_frame_equal(mbdcci.cell_adj_df, full.cell_adj_df)
+    pd.testing.assert_frame_equal(mbdcci.get_mbd_diagnostics(), full.get_mbd_diagnostics())
@@ -0,0 +1,18 @@
+import pytest
+import MBDCatCellImpacts as MBDCCI
+from conftest import assert_output_equal, output_names, params
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_outputs_match_reference(market_dir, max_workers):
+    mbdcci = MBDCCI.MBDCCImpcts(market_dir, *params.values(), max_workers=max_workers)
+    mbdcci.get_mbd_diagnostics()
+    for name in output_names:
+        assert_output_equal(market_dir, name)
+
+
+def test_profiled_run_matches_reference(market_dir):
+    mbdcci = MBDCCI.MBDCCImpcts(market_dir, *params.values(), profile=True)
+    mbdcci.get_mbd_diagnostics()
+    for name in output_names:
+        assert_output_equal(market_dir, name)
@@ -0,0 +1,96 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+import pytest
+import MBDCatCellImpacts as MBDCCI
+import TemplateService as ts
+from conftest import copy_market, params
+
+
+@pytest.fixture
+def service_url(market_dir):
+    """
+    Serve the sample market on a free local port for the duration of a test.
+    """
+    service = ts.TemplateService(market_dir, params)
+    server = ts.make_server(service, '127.0.0.1', 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+def request(url: str,
+            body: dict = None):
+    """
+    Send a GET request, or a POST request if body is given, and read the JSON answer.
+
+    Returns:
+        tuple: The HTTP status and the answer.
+    """
+    data = None if body is None else json.dumps(body).encode()
+    try:
+        with urllib.request.urlopen(url, data=data) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read())
+
+
+@pytest.mark.parametrize('value, expected', [(None, False), (True, True), (False, False),
+                                             ('1', True), ('true', True), ('Yes', True),
+                                             ('0', False), ('false', False), ('', False)])
+def test_parse_flag(value, expected):
+    assert ts.parse_flag(value) is expected
+
+
+def test_load_saves_nothing(market_dir):
+    ts.TemplateService(market_dir, params, delta=True)
+    assert os.listdir(f'{market_dir}/outputs') == []
+
+
+def test_status(service_url):
+    status, summary = request(f'{service_url}/status')
+    assert status == 200
+    assert summary['Params'] == params
+    assert summary['MBDs'] <= summary['MBDCats']
+    assert summary['OutOfTargetMBDs'] <= summary['OutOfTargetMBDCats']
+    assert 'AnomalousCellIDs' not in summary
+    for query in ['details=0', 'details=false']:
+        status, summary = request(f'{service_url}/status?{query}')
+        assert 'AnomalousCellIDs' not in summary
+    status, summary = request(f'{service_url}/status?details=1')
+    assert len(summary['AnomalousCellIDs']) == summary['AnomalousCells']
+    assert len(summary['OutOfTargetMBDCatKeys']) == summary['OutOfTargetMBDCats']
+
+
+def test_diagnostics_match_full_run(service_url, tmp_path):
+    status, summary = request(f'{service_url}/diagnostics',
+                              {'params': {'cell_cat_param': 0.3}, 'details': False})
+    assert status == 200
+    assert 'AnomalousCellIDs' not in summary
+    full = MBDCCI.MBDCCImpcts(copy_market(str(tmp_path / 'full')),
+                              *{**params, 'cell_cat_param': 0.3}.values())
+    cell_diag = full.set_mbd_cell_diag()
+    mbd_df = full.set_mbd_targets()
+    assert summary['Params'] == full.get_params()
+    assert summary['MBDs'] == mbd_df['MbdID'].nunique()
+    assert summary['MBDCats'] == len(mbd_df)
+    assert summary['MBDCatCells'] == len(cell_diag)
+    assert summary['AnomalousMBDCatCells'] == (cell_diag['MBDCatDiag'] == 'Anomalous').sum()
+    status, answer = request(f'{service_url}/diagnostics', {'params': {'unknown': 1}})
+    assert status == 400
+
+
+def test_adjustments(service_url):
+    status, summary = request(f'{service_url}/status?details=true')
+    cell_id = summary['AnomalousCellIDs'][0]
+    status, summary = request(f'{service_url}/adjustments',
+                              {'changes': [{'Cell_ID': cell_id, 'ADJ_XFactor': 1.5}]})
+    assert status == 200
+    assert summary['UpdatedMBDCatCells'] > 0
+    assert summary['Params'] == params
+    status, answer = request(f'{service_url}/unknown', {})
+    assert status == 404
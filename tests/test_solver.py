@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+import MBDCatCellImpacts as MBDCCI
+import SalesIncidence as si
+import XFactorSolver as xfs
+from conftest import params
+
+
+def make_incidence():
+    """
+    Build a two MBD-category incidence: MBD 1 has cells A and B, MBD 2 only cell C.
+    Each cell's unprojected sales are its share of the MBD-category's Baseline_Sales,
+    so an X-Factor of 1 reproduces the baseline.
+    """
+    impact_df = pd.DataFrame({'MbdID': [1, 1, 2],
+                              'MbdName': ['M1', 'M1', 'M2'],
+                              'CategoryCode': [10, 10, 10],
+                              'CategoryName': ['C', 'C', 'C'],
+                              'Cell_ID': ['A', 'B', 'C'],
+                              'Baseline_Sales': [60.0, 40.0, 50.0],
+                              'UnprojectedSales': [60.0, 40.0, 50.0]})
+    return si.SalesIncidence(impact_df)
+
+
+@pytest.fixture
+def edited_market(market_dir):
+    """
+    The sample market with the ADJ_XFactor of every 7th cell raised by 30% over its
+    VUE_XFactor, which puts MBD-categories out of target.
+    """
+    mbdcci = MBDCCI.MBDCCImpcts(market_dir, *params.values())
+    mbdcci.get_mbd_diagnostics()
+    cell_adj = mbdcci.cell_adj_df.drop_duplicates('Cell_ID', keep='last')
+    edited = cell_adj.iloc[::7]
+    mbdcci.update_adjustments(pd.DataFrame({'Cell_ID': edited['Cell_ID'],
+                                            'ADJ_XFactor': edited['VUE_XFactor'] * 1.3}))
+    assert mbdcci.set_mbd_targets()['OutOfTarget'].sum() > 0
+    return mbdcci
+
+
+def test_solver_feasible_optimum():
+    incidence = make_incidence()
+    reference = np.array([1.5, 1.5, 1.0])
+    variable = np.array([True, True, False])
+    targets = np.array([0.1, np.nan])
+    x, info = xfs.solve_xfactors(incidence, reference, reference.copy(), variable,
+                                 np.zeros(3), np.full(3, np.inf), targets)
+    # MBD 1 projects 90 uA + 60 uB above 110 with the relative changes u = x / 1.5 - 1,
+    # so the smallest change bringing it to +10% is proportional to (90, 60).
+    u = -40 * np.array([90, 60]) / (90 ** 2 + 60 ** 2)
+    assert info['Feasible'] and info['Converged']
+    assert info['ConstrainedRows'] == 1
+    np.testing.assert_allclose(x, [*(1.5 * (1 + u)), 1.0], atol=1e-6)
+
+
+def test_solver_infeasible_within_bounds():
+    incidence = make_incidence()
+    reference = np.array([1.5, 1.5, 1.0])
+    variable = np.array([True, False, False])
+    targets = np.array([0.1, np.nan])
+    x, info = xfs.solve_xfactors(incidence, reference, reference.copy(), variable,
+                                 reference * 0.95, reference * 1.05, targets)
+    # Cell A alone, within 5% of its reference, cannot bring MBD 1 within target, so it
+    # stops at its lower bound.
+    assert info['Converged'] and not info['Feasible']
+    assert info['ViolatedRows'] == 1
+    np.testing.assert_allclose(x, [1.425, 1.5, 1.0], atol=1e-6)
+
+
+def test_solver_without_variable_cells():
+    incidence = make_incidence()
+    reference = np.array([1.5, 1.5, 1.0])
+    current = np.array([1.2, 1.3, 1.0])
+    x, info = xfs.solve_xfactors(incidence, reference, current, np.zeros(3, dtype=bool),
+                                 np.zeros(3), np.full(3, np.inf), np.array([0.1, 0.1]))
+    assert info['ConstrainedRows'] == 0
+    np.testing.assert_array_equal(x, current)
+
+
+def test_proposal_reaches_target(edited_market):
+    cells = edited_market.cell_adj_df['Cell_ID']
+    proposal = edited_market.propose_adj_xfactors(cells=cells, apply=True)
+    assert (proposal['Proposed_ADJ_XFactor'] >= 0).all()
+    assert edited_market.set_mbd_targets()['OutOfTarget'].sum() == 0
+
+
+def test_proposal_within_max_relative_change(edited_market):
+    before = edited_market.set_mbd_targets()['OutOfTarget'].sum()
+    proposal = edited_market.propose_adj_xfactors(max_relative_change=0.05, apply=True)
+    vue = proposal['VUE_XFactor']
+    assert (proposal['Proposed_ADJ_XFactor'] >= vue * 0.95 - 1e-9).all()
+    assert (proposal['Proposed_ADJ_XFactor'] <= vue * 1.05 + 1e-9).all()
+    after = edited_market.set_mbd_targets()['OutOfTarget'].sum()
+    assert 0 < after < before
+
+
+def test_proposal_without_cells(edited_market, capsys):
+    before = edited_market.set_mbd_targets()['OutOfTarget'].sum()
+    proposal = edited_market.propose_adj_xfactors(cells=[])
+    assert proposal.empty
+    out = capsys.readouterr().out
+    assert f'{before} before, {before} after' in out
+    assert f'{before} of them have none of the given cells' in out
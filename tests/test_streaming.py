@@ -0,0 +1,47 @@
+import os
+import pandas as pd
+import pytest
+import MBDCatCellImpacts as MBDCCI
+from conftest import assert_output_equal, params, read_reference
+
+
+@pytest.mark.parametrize('chunksize', [997, 5000, 10_000_000])
+def test_streaming_matches_reference(market_dir, chunksize):
+    mbdcci = MBDCCI.MBDCCImpcts(market_dir, *params.values(), chunksize=chunksize)
+    assert mbdcci.vue_impacts is None
+    mbd_df = mbdcci.stream_mbd_diagnostics()
+    for name in ['XZTemplate_v0.csv', 'MBDCat_Impacts_v0.csv', 'MBDCatCell_Impacts_v0.csv']:
+        assert_output_equal(market_dir, name)
+    assert len(mbd_df) == len(pd.read_csv(f'{market_dir}/outputs/MBDCat_Impacts_v0.csv'))
+
+
+def test_streaming_matches_in_memory(market_dir):
+    in_memory = MBDCCI.MBDCCImpcts(market_dir, *params.values())
+    in_memory.get_mbd_diagnostics()
+    expected = {name: pd.read_csv(f'{market_dir}/outputs/{name}')
+                for name in ['MBDCat_Impacts_v0.csv', 'MBDCatCell_Impacts_v0.csv']}
+    streamed = MBDCCI.MBDCCImpcts(market_dir, *params.values(), chunksize=2000)
+    streamed.stream_mbd_diagnostics()
+    for name, df in expected.items():
+        assert_output_equal(market_dir, name, df)
+    with pytest.raises(ValueError):
+        streamed.set_cell_impacts()
+
+
+def test_streaming_drops_duplicates_across_chunks(market_dir):
+    # Rows that differ only in a column not loaded from VUE_Impacts survive the cleaning
+    # and give duplicated output rows, here in chunks far from their first occurrence.
+    path = f'{market_dir}/inputs/VUE_Impacts.csv'
+    with open(path) as file:
+        lines = file.readlines()
+    with open(path, 'a') as file:
+        file.writelines(line.replace(',Reported Group 1,', ',Reported Group 2,', 1)
+                        for line in lines[1:1500])
+    MBDCCI.MBDCCImpcts(market_dir, *params.values()).get_mbd_diagnostics()
+    expected = pd.read_csv(f'{market_dir}/outputs/MBDCatCell_Impacts_v0.csv')
+    assert len(expected) == len(read_reference('MBDCatCell_Impacts_v0.csv'))
+    MBDCCI.MBDCCImpcts(market_dir, *params.values(), chunksize=997).stream_mbd_diagnostics()
+    assert_output_equal(market_dir, 'MBDCatCell_Impacts_v0.csv', expected)
+    # The spilled partitions are removed with their temporary directory.
+    assert all(os.path.isfile(f'{market_dir}/cache/{entry}')
+               for entry in os.listdir(f'{market_dir}/cache'))
@@ -0,0 +1,44 @@
+import MBDCatCellImpacts as MBDCCI
+from conftest import params
+
+param_grid = {'distance_param': [1, 3],
+              'same_dir_gap_tolerance': [0.1, 0.2],
+              'cell_cat_param': [0.01, 0.05],
+              'cell_weight_param': [0.01, 0.1]}
+
+
+def test_sweep_matches_looped_runs(market_dir):
+    sweep = MBDCCI.MBDCCImpcts(market_dir, *params.values()).sweep_diagnostics(param_grid)
+    assert len(sweep) == 16
+    assert sweep['AnomalousCells'].nunique() > 1
+    assert sweep['AnomalousMBDCatCells'].nunique() > 1
+    for _, row in sweep.iterrows():
+        run = MBDCCI.MBDCCImpcts(market_dir, *[row[name] for name in params])
+        cells_df = run.cell_adj_df
+        cell_diag = run.get_mbd_diagnostics()
+        mbd_df = run.set_mbd_targets()
+        out_of_target = mbd_df['OutOfTarget'] >= 1
+        expected = {'AnomalousCells': (cells_df['CellDiagnostic'] == 'Anomalous').sum(),
+                    'Cells': len(cells_df),
+                    'AnomalousMBDCatCells': (cell_diag['MBDCatDiag'] == 'Anomalous').sum(),
+                    'MBDCatCells': len(cell_diag),
+                    'OutOfTargetMBDCats': out_of_target.sum(),
+                    'MBDCats': len(mbd_df),
+                    'OutOfTargetMBDs': mbd_df.loc[out_of_target, 'MbdID'].nunique(),
+                    'MBDs': mbd_df['MbdID'].nunique()}
+        assert row[list(expected)].to_dict() == expected
+
+
+def test_cell_sweep_matches_looped_runs(market_dir):
+    xztg = MBDCCI.MBDCCImpcts(market_dir, *params.values()).xztg
+    cell_grid = {'distance_param': [params['distance_param']],
+                 'nspc_param': [0.05, 0.2],
+                 'xf_param': [0.05, 0.3],
+                 'same_dir_gap_tolerance': [params['same_dir_gap_tolerance']],
+                 'diff_dir_gap_tolerance': [0.05, 0.2]}
+    sweep = xztg.sweep_cell_diagnostics(*cell_grid.values())
+    assert len(sweep) == 8
+    assert sweep['AnomalousCells'].nunique() > 1
+    for _, row in sweep.iterrows():
+        cells_df = xztg.get_cell_diagnostics(*[row[name] for name in cell_grid], save=False)
+        assert row['AnomalousCells'] == (cells_df['CellDiagnostic'] == 'Anomalous').sum()
@@ -0,0 +1,154 @@
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
+import pytest
+import MBDCatCellImpacts as MBDCCI
+import WorkbookExport as wbx
+from conftest import params, repo_dir
+
+main_ns = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+rel_ns = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+templates = [f'{repo_dir}/LatAM_XZ_Distance (Third_Deliver).xlsm',
+             f'{repo_dir}/LatAM_XZ_Distance (Second_Deliver).xlsm']
+
+
+def sheet_part(workbook: zipfile.ZipFile,
+               sheet: str):
+    """
+    Find the XML part of a sheet with an XML parser, independently of WorkbookExport.
+    """
+    sheets = ET.fromstring(workbook.read('xl/workbook.xml'))
+    rel_id = [element.get(f'{{{rel_ns}}}id') for element in sheets.iter(f'{{{main_ns}}}sheet')
+              if element.get('name') == sheet][0]
+    rels = ET.fromstring(workbook.read('xl/_rels/workbook.xml.rels'))
+    target = [element.get('Target') for element in rels if element.get('Id') == rel_id][0]
+    return target.lstrip('/') if target.startswith('/') else f'xl/{target}'
+
+
+def read_sheet(path: str,
+               sheet: str):
+    """
+    Read a sheet of a workbook back into a DataFrame, with its first row as header.
+
+    Returns:
+        tuple: The DataFrame and the parsed sheet XML.
+    """
+    with zipfile.ZipFile(path) as workbook:
+        shared = []
+        if 'xl/sharedStrings.xml' in workbook.namelist():
+            shared = [''.join(t.text or '' for t in item.iter(f'{{{main_ns}}}t'))
+                      for item in ET.fromstring(workbook.read('xl/sharedStrings.xml'))]
+        root = ET.fromstring(workbook.read(sheet_part(workbook, sheet)))
+    rows = []
+    for row in root.find(f'{{{main_ns}}}sheetData'):
+        values = {}
+        for cell in row:
+            position = wbx._column_position(re.match(r'[A-Z]+', cell.get('r')).group(0))
+            kind = cell.get('t')
+            value = cell.find(f'{{{main_ns}}}v')
+            if kind == 'inlineStr':
+                values[position] = ''.join(t.text or '' for t in cell.iter(f'{{{main_ns}}}t'))
+            elif value is None:
+                continue
+            elif kind == 's':
+                values[position] = shared[int(value.text)]
+            elif kind == 'b':
+                values[position] = value.text == '1'
+            else:
+                values[position] = float(value.text)
+        rows.append(values)
+    header = {position: wbx.header_aliases.get(name.strip(), name.strip())
+              for position, name in rows[0].items()}
+    df = pd.DataFrame([[values.get(position) for position in header] for values in rows[1:]],
+                      columns=list(header.values()))
+    return df, root
+
+
+def assert_sheet_equal(sheet_df: pd.DataFrame,
+                       expected: pd.DataFrame):
+    """
+    Check the columns of a read-back sheet against the DataFrame written into it.
+    """
+    assert len(sheet_df) == len(expected)
+    for col in expected.columns:
+        got = sheet_df[col].reset_index(drop=True)
+        want = expected[col].reset_index(drop=True)
+        if pd.api.types.is_bool_dtype(want):
+            assert got.tolist() == want.tolist(), col
+        elif pd.api.types.is_numeric_dtype(want):
+            np.testing.assert_allclose(got.astype(float), want.astype(float), rtol=1e-12,
+                                       err_msg=col)
+        else:
+            assert got.fillna('').astype(str).tolist() == \
+                want.fillna('').astype(str).tolist(), col
+
+
+@pytest.fixture
+def diagnosed_market(market_dir):
+    mbdcci = MBDCCI.MBDCCImpcts(market_dir, *params.values())
+    mbdcci.get_mbd_diagnostics()
+    return mbdcci
+
+
+@pytest.mark.parametrize('template_path', templates)
+def test_export_matches_outputs(diagnosed_market, template_path):
+    output_path = diagnosed_market.export_workbook(template_path)
+    for sheet, name in [('CellAdj', 'XZTemplate_v0.csv'),
+                        ('Impacts', 'MBDCatCell_Impacts_v0.csv')]:
+        expected = pd.read_csv(f'{diagnosed_market.output_dir}/{name}')
+        sheet_df, root = read_sheet(output_path, sheet)
+        assert_sheet_equal(sheet_df, expected[[col for col in expected.columns
+                                               if col in sheet_df.columns]])
+        data_range = root.find(f'{{{main_ns}}}dimension').get('ref')
+        assert data_range.endswith(str(len(expected) + 1))
+        auto_filter = root.find(f'{{{main_ns}}}autoFilter')
+        if auto_filter is not None:
+            assert auto_filter.get('ref') == data_range
+    with zipfile.ZipFile(template_path) as template, zipfile.ZipFile(output_path) as output:
+        assert output.testzip() is None
+        assert sorted(output.namelist()) == sorted(part for part in template.namelist()
+                                                   if part != 'xl/calcChain.xml')
+        assert output.read('xl/vbaProject.bin') == template.read('xl/vbaProject.bin')
+        for part in output.namelist():
+            if part.endswith('.xml') or part.endswith('.rels'):
+                ET.fromstring(output.read(part))
+        assert 'calcChain' not in output.read('[Content_Types].xml').decode('utf-8')
+        for part in output.namelist():
+            if part.startswith('xl/pivotCache/pivotCacheDefinition') and part.endswith('.xml'):
+                cache = ET.fromstring(output.read(part))
+                source = cache.find(f'.//{{{main_ns}}}worksheetSource')
+                if source is not None and source.get('sheet') in ['CellAdj', 'Impacts']:
+                    assert cache.get('refreshOnLoad') == '1'
+                    rows = read_sheet(output_path, source.get('sheet'))[0]
+                    assert source.get('ref').endswith(str(len(rows) + 1))
+
+
+def test_export_escapes_text(market_dir):
+    cells = pd.DataFrame({'Cell_ID': [1, 2, 3],
+                          'Cell_Name': ['A & B <C>', 'quote " \x01', None],
+                          'IBD_ID': ['10', '20', None],
+                          'ADJ_XFactor': [1.5, np.nan, 1e-20],
+                          'DTest': [True, False, True],
+                          'Unknown': [1, 2, 3]})
+    output_path = f'{market_dir}/outputs/filled.xlsm'
+    rows = wbx.export_workbook(templates[0], output_path, {'CellAdj': cells})
+    assert rows == {'CellAdj': 3}
+    sheet_df, _ = read_sheet(output_path, 'CellAdj')
+    assert 'Unknown' not in sheet_df.columns
+    assert sheet_df['Cell_Name'].tolist()[:2] == ['A & B <C>', 'quote " ']
+    assert sheet_df['IBD_ID'].tolist()[:2] == [10.0, 20.0]
+    assert sheet_df[['Cell_Name', 'IBD_ID']].iloc[2].isna().all()
+    assert sheet_df['ADJ_XFactor'].tolist()[0::2] == [1.5, 1e-20]
+    assert pd.isna(sheet_df['ADJ_XFactor'][1])
+    assert sheet_df['DTest'].tolist() == [True, False, True]
+    assert sheet_df['Comments'].isna().all()
+
+
+def test_export_errors(market_dir):
+    with pytest.raises(ValueError):
+        wbx.export_workbook(templates[0], templates[0], {})
+    with pytest.raises(ValueError):
+        wbx.export_workbook(templates[0], f'{market_dir}/outputs/filled.xlsm',
+                            {'Missing': pd.DataFrame({'a': [1]})})